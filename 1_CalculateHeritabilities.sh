@@ -13,7 +13,7 @@ if [ ! -e $broaddir ]; then mkdir $broaddir; fi
 
 keyfile=$rawdir/mapping_with_abundance.txt
 biom=$rawdir/otu_table_80percShared_relAbundance.biom
-biom_text=${biom/.biom/.txt}
+biom_log=$parsedir/0a_otu_table.log_transformed.txt
 maxprocs=8  # Number of parallel processes to start
 
 
@@ -21,25 +21,35 @@ maxprocs=8  # Number of parallel processes to start
 # Raw data manipulations
 ##################
 
+# The Python scripts read raw files straight out of $rawdir.zip if it hasn't been extracted, but biom and R need real
+# files, so extract (and verify) just these two
+python3 rawdata.py --extract -i $keyfile $biom
+
 # Get summaries to look at stats
 biom summarize-table -i $biom -o $parsedir/0a_biom_summary.samples.txt
 biom summarize-table -i $biom -o $parsedir/0a_biom_summary.observations.txt --observations
 
-# Convert biom to text
-biom convert -i $biom -o $biom_text --to-tsv
+# Log-transform the (sparse) biom table directly, without converting it to dense text first
+python3 1a_LogTransformBiom.py -i $biom -o $biom_log
 
 
 ###########
 # Broad-sense heritability
 ###########
 
-n_runs=10
-perms_per_run=500
-for i in $(seq $n_runs); do
-  Rscript 1a_BroadSenseHeritability.r -i $biom_text -k $keyfile --log-transform --num-cores $maxprocs \
-    --heritfile $broaddir/1a_otu_heritabilities.$i.txt --random-perms $perms_per_run --covariates "Seq_Count_80Perc + (1|AGE) + (1|ENV)" --seed $i --rescale Seq_Count_80Perc
-done
-Rscript 1b_RecombineHeritabilities.r -i $broaddir/1a_otu_heritabilities.*.txt -o $broaddir/1b_otu_heritabilities.combined.txt
+# Permutations run in small checkpointed blocks, each with its own seed derived from --seed; rerunning this after an
+# interruption only runs the missing blocks, then combines them all
+python3 1a_RunPermutationBlocks.py --perms 5000 --block-size 100 --seed 1 -d $broaddir/1a_otu_heritabilities.blocks \
+  -o $broaddir/1b_otu_heritabilities.combined.txt -- \
+  Rscript 1a_BroadSenseHeritability.r -i $biom_log -k $keyfile --num-cores $maxprocs \
+    --covariates "Seq_Count_80Perc + (1|AGE) + (1|ENV)" --rescale Seq_Count_80Perc
+
+# Or, to spread the work over a cluster, queue it in a directory all nodes can see, start workers on as many nodes as
+# are available ("python3 workqueue.py -q $broaddir/1a_queue", eg with srun or qsub), and wait for them to finish:
+# python3 1a_QueueHeritabilities.py -i $biom_log -o $broaddir/1b_otu_heritabilities.combined.txt -q $broaddir/1a_queue \
+#   --perms 5000 --perm-block 100 --trait-block 500 --seed 1 -- \
+#   Rscript 1a_BroadSenseHeritability.r -k $keyfile --num-cores $maxprocs \
+#     --covariates "Seq_Count_80Perc + (1|AGE) + (1|ENV)" --rescale Seq_Count_80Perc
 python3 1b_PlotHeritabilities.py -i $broaddir/1b_otu_heritabilities.combined.txt -o $broaddir/1b_otu_heritabilities.combined.png
 
 
@@ -56,15 +66,18 @@ if [ ! -e $splitdir ]; then mkdir $splitdir; fi
 if [ ! -e $biomdir ]; then mkdir $biomdir; fi
 if [ ! -e $outdir ]; then mkdir $outdir; fi
 
-# Split distance matrices by weeks
+# Split distance matrices by weeks (converts each matrix to a binary store once)
 for set in weighted unweighted; do
   distances=$rawdir/${set}_unifrac_dm.txt
-  Rscript 1c_SplitDistanceMatrices.r -i $distances -o $splitdir/1c_distances.$set -k $keyfile --splits AGE_fixed ENV 
+  python3 1c_SplitDistanceMatrices.py -i $distances -o $splitdir/1c_distances.$set -k $keyfile --splits AGE_fixed ENV
 done
 
-# Get PCs with QIIME
-principal_coordinates.py -i $splitdir -o $pcdir
+# Get the first few PCs of each split straight from the binary stores
+python3 1c_PrincipalCoordinates.py -i $splitdir/*.splits.txt -o $pcdir --num-pcs 5
+
 
+# Convert all PC files to pseudo-BIOM format in one go
+python3 1c_ConvertQiimePcsToFakeBiomFile.py -i $pcdir/*.txt --batch-outdir $biomdir --num-pcs 5 --num-procs $maxprocs
 
 # # Principal components by week: 
 for pcs in $pcdir/*.txt; do
@@ -74,13 +87,12 @@ for pcs in $pcdir/*.txt; do
   echo -e "#####\n$stem\n#####"
   
   biom=$biomdir/1e_$stem.biom.txt
-  graphic=$biomdir/1e_$stem.pc_dist.png
   herits=$outdir/1f_${stem}.heritabilities.txt
   heritgraph=$outdir/1f_${stem}.heritabilities.png
 
-  python3 1c_ConvertQiimePcsToFakeBiomFile.py -i $pcs -o $biom --num-pcs 5 --outgraphic $graphic --stem $stem
-  Rscript 1a_BroadSenseHeritability.r -i $biom -o $outdir/1e_${stem}.blups.txt -k $keyfile --num-cores $maxprocs \
-    --heritfile $herits --random-perms 1000 --covariates ""  --seed 1 # No covariates because age and environment are fixed for these samples
+  # No covariates because age and environment are fixed for these samples, so can use the closed-form one-way model
+  python3 1a_BroadSenseHeritability.py -i $biom -o $outdir/1e_${stem}.blups.txt -k $keyfile \
+    --heritfile $herits --random-perms 1000 --seed 1
   python3 1b_PlotHeritabilities.py -i $herits -o $heritgraph
 #   break
 done
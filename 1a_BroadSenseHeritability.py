@@ -0,0 +1,117 @@
+__author__ = 'jgwall'
+
+# Calculate broad-sense heritability (and optionally BLUPs) for traits with the one-way "(1|INBRED_nested)" model, ie,
+# what 1a_BroadSenseHeritability.r does with --covariates "". All traits and permutations are solved in closed form at
+# once (see oneway_herit.py) instead of fitting lmer for each one. Models with covariates still need the R script.
+
+import argparse
+import herit_store
+import numpy as np
+import oneway_herit
+import profiling
+import pandas as pd
+
+debug = False
+
+
+def main():
+    args = parse_args()
+    profiling.start_from_args(args, __file__)
+    print("Calculating one-way heritability of traits in", args.infile)
+
+    # Load and match data
+    with profiling.phase("load"):
+        data = oneway_herit.load_traits(args.infile)
+        if args.subset: data = subset_traits(data, args.subset)
+        key = oneway_herit.load_key(args.keyfile)
+        values, codes, groups, samples = oneway_herit.match_data(data, key)
+    if debug: values, data = values[:, :10], data.iloc[:10, :]
+    traits = ["trait_" + str(t) for t in data.index]   # Same naming as the R script
+    print("\tData has", len(samples), "samples in", len(groups), "groups and", len(traits), "traits")
+
+    # Write BLUPs in TASSEL format
+    if args.outfile:
+        print("Writing out BLUPs to", args.outfile)
+        with profiling.phase("blups"):
+            effects = oneway_herit.blups(*oneway_herit.sufficient_stats(values, codes, len(groups)))
+        with profiling.phase("write"):
+            write_blups(pd.DataFrame(effects, index=groups, columns=traits), args.outfile)
+
+    # Get heritabilities, including random permutations
+    if args.adaptive:
+        print("Performing up to", args.random_perms, "random permutations for heritability analysis, stopping each trait once",
+              "it has", args.stop_hits, "permutations at or above its actual value or can no longer reach p <=", args.p_cutoff)
+        with profiling.phase("permutations"):
+            actual, perms, drawn, hits = oneway_herit.adaptive_heritabilities(values, codes, len(groups), args.random_perms,
+                                            args.p_cutoff, stop_hits=args.stop_hits, block_size=args.block_size, seed=args.seed)
+        print("\tRan", np.sum(drawn), "trait permutations instead of", args.random_perms * len(traits), "; only",
+              np.sum(drawn == args.random_perms), "traits needed all of them")
+        if args.countfile:
+            print("Writing permutation counts to", args.countfile)
+            counts = pd.DataFrame({"trait": traits, "actual": actual, "perms_run": drawn, "perms_at_or_above_actual": hits})
+            counts.to_csv(args.countfile, sep='\t', index=False, na_rep="NA")
+    else:
+        print("Performing", args.random_perms, "random permutations for heritability analysis")
+        with profiling.phase("permutations"):
+            actual, perms = oneway_herit.permuted_heritabilities(values, codes, len(groups), args.random_perms, seed=args.seed)
+    herits = oneway_herit.make_herit_table(traits, actual, perms)
+
+    # Write out heritability results
+    if args.heritfile:
+        print("Writing heritability to", args.heritfile)
+        with profiling.phase("write"):
+            oneway_herit.write_herit_table(herits, args.heritfile)
+            herit_store.write_store(args.heritfile, herits)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--infile", help="Input file of traits in (pseudo-)BIOM text format")
+    parser.add_argument("-o", "--outfile", help="Output file of BLUPs as a matrix")
+    parser.add_argument("-k", "--keyfile", help="QIIME-formatted key file of sample metadata")
+    parser.add_argument("-s", "--subset", help="File of traits to keep; others will be ignored")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for permutations")
+    parser.add_argument("-r", "--random-perms", default=0, type=int, help="Number of randomly scrambled datasets to run")
+    parser.add_argument("--heritfile", help="Output file for heritability (includes random permutation heritabilities if specified")
+    parser.add_argument("-a", "--adaptive", default=False, action="store_true",
+                        help="Stop permuting each trait once its p-value is clearly above --p-cutoff (--random-perms is then the maximum). "
+                             "Permutations a trait did not need are written as NA. Only this one-way engine (used for the PC traits) has "
+                             "early stopping; the OTU runs with 1a_BroadSenseHeritability.r always do every permutation")
+    parser.add_argument("-p", "--p-cutoff", type=float, default=0.001, help="Significance cutoff for adaptive permutations")
+    parser.add_argument("--stop-hits", type=int, default=10, help="Stop a trait after this many permutations at or above its actual value")
+    parser.add_argument("--block-size", type=int, default=100, help="Number of permutations to draw at a time in adaptive mode")
+    parser.add_argument("--countfile", help="Output file for the number of permutations each trait got in adaptive mode")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+# Keep only the traits listed (whitespace-separated) in subsetfile, in their original order, like the R script does
+def subset_traits(data, subsetfile):
+    print("Subsetting traits to those specified in", subsetfile)
+    IN = open(subsetfile, "r")
+    tosub = set(IN.read().split())
+    IN.close()
+    data = data.loc[data.index.astype(str).isin(tosub), :]
+    print("\tResulting data has", len(data), "traits to analyze")
+    return data
+
+
+# Write BLUPs the same way as the R script (TASSEL phenotype format)
+def write_blups(blups, outfile):
+    blups = blups.dropna(how="all").sort_index()
+    blups.index.name = "Taxon"
+    OUT = open(outfile, "w")
+    OUT.write("<Phenotype>\n")
+    OUT.write("\t".join(["taxa"] + ["data"] * len(blups.columns)) + "\n")
+    blups.to_csv(OUT, sep='\t', na_rep="NA")
+    OUT.close()
+
+
+if __name__ == '__main__': main()
@@ -45,7 +45,7 @@ if(!is.null(args$subset)){
   cat("Subsetting OTUs to those specified in",args$subset,"\n")
   tosub = scan(args$subset, what=character())
   cat("\tLoaded",length(tosub),"OTUs to subset data to; original data has",nrow(data),"OTUs in it\n")
-  data=data[rownames(data) %in% tosub,]
+  data=data[rownames(data) %in% tosub,,drop=FALSE]	# drop=FALSE so a single OTU stays a 1-row data frame
   cat("\tResulting data frame has",nrow(data),"OTUs to analyze\n")
 }
 
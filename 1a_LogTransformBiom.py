@@ -0,0 +1,52 @@
+__author__ = 'jgwall'
+
+# Log-transform a BIOM table of relative abundances for 1a_BroadSenseHeritability.r, reading the BIOM file directly as a
+# sparse matrix (see biom_loader.py). Output is the same as the R script's --log-transform --write-transformed, so the R
+# script can then be run on it without --log-transform.
+
+import argparse
+import biom_loader
+import profiling
+
+debug = False
+
+
+def main():
+    args = parse_args()
+    profiling.start_from_args(args, __file__)
+    print("Loading BIOM table from", args.infile)
+    with profiling.phase("load"):
+        table = biom_loader.load_biom(args.infile)
+    print("\tLoaded", len(table.otus), "OTUs across", len(table.samples), "samples with", table.matrix.nnz, "non-zero values")
+
+    # Subset if specified
+    if args.subset:
+        print("Subsetting OTUs to those specified in", args.subset)
+        tosub = biom_loader.read_subset(args.subset)
+        print("\tLoaded", len(tosub), "OTUs to subset data to; original data has", len(table.otus), "OTUs in it")
+        table = table.subset(tosub)
+        print("\tResulting table has", len(table.otus), "OTUs to analyze")
+
+    # Log-transform and write out
+    print("Writing log-transformed values to", args.outfile)
+    with profiling.phase("compute"):     # The transform happens as each OTU is written
+        biom_loader.write_transformed(table, args.outfile)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--infile", help="Input BIOM file (HDF5 or JSON)")
+    parser.add_argument("-o", "--outfile", help="Output file of log-transformed values, in BIOM text format")
+    parser.add_argument("-s", "--subset", help="File of OTUs to keep; others will be ignored")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__': main()
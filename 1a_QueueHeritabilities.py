@@ -0,0 +1,208 @@
+__author__ = 'jgwall'
+
+# Spread heritability calculations over several machines through a shared-directory work queue (see workqueue.py).
+# Each input file is a job that is cut into tasks of (block of traits x block of permutations), which any number of
+# workers can run:
+#   python3 workqueue.py -q <queue dir>
+# This script submits the tasks, waits for them (optionally running some workers itself with --num-workers), requeues
+# tasks whose workers have died, and once every task of a job is done merges its results into the usual heritability
+# table (an "actual" row plus perm1..permN) and its binary store, or with --summary-only into just the actual row and a
+# summary of each trait's permutations (see herit_stats.PermutationSketch).
+#
+# The heritability command (1a_BroadSenseHeritability.r or .py, with any other options) goes after "--", without -i;
+# each task runs it with -i, --subset, --random-perms, --seed and --heritfile added. Permutation block seeds are derived
+# from --seed as in 1a_RunPermutationBlocks.py, and every trait block uses the same ones, so each merged permutation row
+# comes from the same scrambling of samples for all traits, just as in a single run.
+#
+# Rerunning with the same queue directory skips finished tasks and retries failed ones, so eg the script can be run
+# with --no-wait to just submit, and run again later to wait and merge.
+#
+# Eg, python3 1a_QueueHeritabilities.py -i otus.txt -o otu_heritabilities.txt -q /shared/queue --perms 5000 -- \
+#         Rscript 1a_BroadSenseHeritability.r -k key.txt --num-cores 8
+
+import argparse
+import hashlib
+import herit_store
+import importlib
+import numpy as np
+import os
+import pandas as pd
+import profiling
+import subprocess
+import sys
+import time
+import workqueue
+from herit_stats import PermutationSketch
+
+debug = False
+
+
+def main():
+    args = parse_args()
+    profiling.start_from_args(args, __file__)
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        sys.exit("ERROR! No heritability command given (it goes after --)")
+    if len(args.infiles) != len(args.outfiles):
+        sys.exit("ERROR! Need one output file for each input file")
+    queue = workqueue.Queue(args.queue)
+
+    # Submit tasks
+    with profiling.phase("submit"):
+        jobs = [make_job(queue, infile, outfile, command, args) for infile, outfile in zip(args.infiles, args.outfiles)]
+        if len(set(j["name"] for j in jobs)) != len(jobs):
+            sys.exit("ERROR! Output files need different names, since they name the jobs in the queue")
+        n_new = sum(queue.submit(t["id"], t["cmd"]) for job in jobs for t in job["tasks"])
+    print("Queued", sum(len(j["tasks"]) for j in jobs), "tasks for", len(jobs), "jobs in", args.queue, ";", n_new, "new")
+    if args.no_wait: return
+
+    # Start local workers, if any, and wait for everything to finish
+    workers = [subprocess.Popen([sys.executable, os.path.abspath(workqueue.__file__), "-q", args.queue, "-w", "local" + str(i) + "." + str(os.getpid()),
+                                 "--lease", str(args.lease), "--poll", str(args.poll), "--max-attempts", str(args.max_attempts)])
+               for i in range(1, args.num_workers + 1)]
+    with profiling.phase("wait"):
+        wait(queue, [t["id"] for job in jobs for t in job["tasks"]], args.lease, args.poll)
+    for worker in workers:
+        worker.wait()
+
+    # Merge each job's results
+    with profiling.phase("combine"):
+        for job in jobs:
+            merge_job(queue, job, args.tolerance, args.summary_only)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--infiles", nargs="*", help="Input files of traits (one job each)")
+    parser.add_argument("-o", "--outfiles", nargs="*", help="Output files of combined heritabilities, one per input file")
+    parser.add_argument("-q", "--queue", help="Queue directory, on a filesystem all workers can see")
+    parser.add_argument("-n", "--perms", type=int, default=0, help="Total number of random permutations per job")
+    parser.add_argument("-b", "--perm-block", type=int, default=100, help="Number of permutations per task")
+    parser.add_argument("-t", "--trait-block", type=int, default=500, help="Number of traits per task")
+    parser.add_argument("--seed", type=int, default=1, help="Master random seed; each permutation block's seed is derived from this and its number")
+    parser.add_argument("-p", "--num-workers", type=int, default=0, help="Number of workers to run on this machine while waiting")
+    parser.add_argument("-l", "--lease", type=float, default=600, help="Seconds without a renewal before a claimed task is given to someone else")
+    parser.add_argument("--poll", type=float, default=10, help="Seconds between checks on the queue")
+    parser.add_argument("-m", "--max-attempts", type=int, default=3, help="Number of times to try a task before giving up on it")
+    parser.add_argument("--tolerance", type=float, default=1e-8,
+                        help="Maximum absolute difference allowed between the actual heritabilities of different permutation blocks")
+    parser.add_argument("-s", "--summary-only", default=False, action="store_true",
+                        help="Only keep a summary of each trait's permutations (p-values, maximum and a histogram for plots), not the permutations")
+    parser.add_argument("--no-wait", default=False, action="store_true", help="Just submit the tasks and exit")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Heritability command to run for each task, after --")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+# Trait IDs are the first column of a (fake) BIOM text file, after its comment line
+def read_trait_ids(infile):
+    return list(pd.read_csv(infile, sep='\t', skiprows=1, usecols=[0], dtype=str).iloc[:, 0])
+
+
+# Split a job into tasks, writing its trait subset files to the queue. The job's settings are saved in the queue, so a
+# rerun with different ones can't pick up results that don't belong to it.
+def make_job(queue, infile, outfile, command, args):
+    name = os.path.basename(outfile)[:-len(".txt")] if outfile.endswith(".txt") else os.path.basename(outfile)
+    trait_ids = read_trait_ids(infile)
+    trait_blocks = [trait_ids[i:i + args.trait_block] for i in range(0, len(trait_ids), args.trait_block)]
+    if len(trait_blocks) > 1 and len(trait_blocks[-1]) == 1:    # A lone trait gets folded into the block before it, since
+        trait_blocks[-2:] = [trait_blocks[-2] + trait_blocks[-1]]     # single-trait subsets are fragile in R
+    perm_blocks = load_script("1a_RunPermutationBlocks").make_blocks(args.perms, args.perm_block, args.seed)
+    if not perm_blocks: perm_blocks = [{"block": 1, "perms": 0, "seed": args.seed}]     # Just the actual values
+
+    settings = {"infile": os.path.abspath(infile), "command": command, "trait_block": args.trait_block, "perms": args.perms,
+                "perm_block": args.perm_block, "seed": args.seed,
+                "traits": hashlib.md5("\n".join(trait_ids).encode("utf-8")).hexdigest()}
+    settingsfile = os.path.join(queue.path, "jobs", name + ".json")
+    os.makedirs(os.path.dirname(settingsfile), exist_ok=True)
+    if os.path.exists(settingsfile) and workqueue.read_json(settingsfile) != settings:
+        sys.exit("ERROR! Queue " + queue.path + " already has job " + name + " with different settings or inputs; use a new queue directory")
+    workqueue.write_json(settings, settingsfile)
+
+    tasks = list()
+    for t, traits in enumerate(trait_blocks, start=1):
+        subsetfile = os.path.abspath(os.path.join(queue.path, "jobs", name + ".traits" + str(t).zfill(4) + ".txt"))
+        herit_store.write_names(subsetfile, traits)
+        for block in perm_blocks:
+            cmd = command + ["-i", infile, "--subset", subsetfile, "--random-perms", str(block["perms"]), "--seed", str(block["seed"]),
+                             "--heritfile", workqueue.output_placeholder]
+            tasks.append({"id": name + ".t" + str(t).zfill(4) + ".p" + str(block["block"]).zfill(5), "cmd": cmd,
+                          "trait_block": t, "perm_block": block["block"], "n_perms": block["perms"]})
+    return {"name": name, "outfile": outfile, "tasks": tasks, "n_trait_blocks": len(trait_blocks), "perm_blocks": perm_blocks}
+
+
+# Script names start with numbers, so have to be imported this way
+def load_script(script):
+    return importlib.import_module(script)
+
+
+# Wait until all tasks are done, requeueing any whose lease has run out
+def wait(queue, task_ids, lease, poll):
+    last = None
+    while True:
+        failed = [t for t in task_ids if os.path.exists(queue.task_file("failed", t))]
+        if failed:
+            sys.exit("ERROR! " + str(len(failed)) + " tasks failed too many times (eg, " + failed[0] + "; see " + queue.log_file(failed[0]) +
+                     "); rerun this script to retry them")
+        n_done = sum(queue.is_done(t) for t in task_ids)
+        if n_done != last:
+            print("\t" + str(n_done), "of", len(task_ids), "tasks done")
+            last = n_done
+        if n_done == len(task_ids): return
+        for task_id in queue.requeue_expired(lease):
+            print("\tLease expired on", task_id, "; requeued it")
+        time.sleep(poll)
+
+
+# Combine a job's results one permutation block at a time: trait blocks side by side, permutation blocks one after
+# another, so memory only has to hold one block of permutations for all traits
+def merge_job(queue, job, tolerance, summary_only=False):
+    print("Merging", len(job["tasks"]), "tasks into", job["outfile"])
+    tasks = {(t["trait_block"], t["perm_block"]): t for t in job["tasks"]}
+    n_perms = sum(b["perms"] for b in job["perm_blocks"])
+    actual, store, sketch, OUT, perm = None, None, None, None, 0
+    for block in job["perm_blocks"]:
+        parts = [pd.read_csv(queue.result_file(tasks[(t, block["block"])]["id"]), sep='\t')
+                 for t in range(1, job["n_trait_blocks"] + 1)]
+        herits = pd.concat(parts, axis=1)
+        if len(herits) != block["perms"] + 1:
+            sys.exit("ERROR! Permutation block " + str(block["block"]) + " of " + job["name"] + " should have " + str(block["perms"]) +
+                     " permutations but has " + str(len(herits) - 1))
+        myactual = np.array(herits.loc["actual", :], dtype=float)
+        if actual is None:
+            actual = myactual
+            if summary_only:
+                sketch = PermutationSketch(herits.columns, actual)
+            else:
+                store = herit_store.StoreWriter(job["outfile"], herits.columns, n_perms + 1)
+                store.write_rows(herits.loc[["actual"], :])
+            OUT = open(job["outfile"], "w")
+            OUT.write("\t".join(herits.columns) + "\n")
+            herits.loc[["actual"], :].to_csv(OUT, sep='\t', header=False, na_rep="NA")
+        elif not np.allclose(myactual, actual, rtol=0, atol=tolerance, equal_nan=True):
+            sys.exit("ERROR! Actual heritabilities of permutation block " + str(block["block"]) + " of " + job["name"] +
+                     " differ from those of block 1")
+
+        # Number permutations straight through, as if from one run
+        perms = herits.drop("actual")
+        perm += len(perms)
+        if sketch:
+            sketch.update(perms)
+            continue
+        perms.index = ["perm" + str(i) for i in range(perm - len(perms) + 1, perm + 1)]
+        perms.to_csv(OUT, sep='\t', header=False, na_rep="NA")
+        store.write_rows(perms)
+    OUT.close()
+    if store: store.close()
+    if sketch: herit_store.write_sketch(job["outfile"], sketch)     # After the text table, so it's the newer of the two
+    print("\tCombined data has", len(actual), "traits and", perm, "permutations")
+
+
+if __name__ == '__main__': main()
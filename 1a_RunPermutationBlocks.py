@@ -0,0 +1,144 @@
+__author__ = 'jgwall'
+
+# Run a heritability script's random permutations as many small blocks that can be checkpointed, then combine them.
+# The heritability command (1a_BroadSenseHeritability.r or .py, with all its other options) goes after "--"; each
+# block runs it with its own --random-perms, --seed and --heritfile. Block seeds come from the master seed and the block
+# number alone, so a block gives the same permutations however many blocks there are, in whatever order they're run.
+#
+# Each block writes its table to the checkpoint directory, followed by a small .done file recording its seed, size and
+# a hash of the heritability command; a table without a matching .done file is incomplete or from other settings.
+# Rerunning the same command after a crash or preemption only runs the blocks that aren't done, and once all are,
+# combines them with 1b_RecombineHeritabilities.py.
+#
+# Eg, python3 1a_RunPermutationBlocks.py --perms 5000 --block-size 100 --seed 1 -d checkpoints -o combined.txt -- \
+#         Rscript 1a_BroadSenseHeritability.r -i otus.txt -k key.txt --num-cores 8
+
+import argparse
+import concurrent.futures
+import hashlib
+import numpy as np
+import os
+import profiling
+import subprocess
+import sys
+
+debug = False
+
+
+def main():
+    args = parse_args()
+    profiling.start_from_args(args, __file__)
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        sys.exit("ERROR! No heritability command given (it goes after --)")
+    if not os.path.exists(args.checkpoint_dir): os.makedirs(args.checkpoint_dir)
+
+    blocks = make_blocks(args.perms, args.block_size, args.seed)
+    for block in blocks:
+        block["command"] = command_hash(command)
+    todo = [b for b in blocks if not is_done(args.checkpoint_dir, b)]
+    print("Running", args.perms, "permutations in", len(blocks), "blocks of up to", args.block_size, ";", len(blocks) - len(todo),
+          "already done")
+    with profiling.phase("blocks"):     # Around the whole pool, since phases are only recorded from the main thread
+        failed = run_blocks(command, todo, args.checkpoint_dir, args.num_procs)
+    if failed:
+        sys.exit("ERROR! " + str(len(failed)) + " blocks failed (" + ", ".join(str(b["block"]) for b in failed) +
+                 "); rerun the same command to retry just those")
+
+    # Combine
+    shards = [shard_file(args.checkpoint_dir, b) for b in blocks]
+    print("Combining", len(shards), "blocks into", args.outfile)
+    with profiling.phase("combine"):
+        returncode = subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "1b_RecombineHeritabilities.py"),
+                                     "-i"] + shards + ["-o", args.outfile] + (["--summary-only"] if args.summary_only else [])).returncode
+    if returncode != 0:
+        sys.exit("ERROR! Could not combine blocks into " + args.outfile)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--perms", type=int, help="Total number of random permutations")
+    parser.add_argument("-b", "--block-size", type=int, default=100, help="Number of permutations per block")
+    parser.add_argument("--seed", type=int, default=1, help="Master random seed; each block's seed is derived from this and its number")
+    parser.add_argument("-d", "--checkpoint-dir", help="Directory for the finished blocks")
+    parser.add_argument("-o", "--outfile", help="Output file of combined heritabilities")
+    parser.add_argument("-p", "--num-procs", type=int, default=1, help="Number of blocks to run at once")
+    parser.add_argument("-s", "--summary-only", default=False, action="store_true",
+                        help="Only keep a summary of each trait's permutations in the combined output (see 1b_RecombineHeritabilities.py)")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Heritability command to run for each block, after --")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+# Blocks as {block number, permutations, seed}. Seeds fit in R's (signed 32-bit) set.seed()
+def make_blocks(n_perms, block_size, seed):
+    blocks = list()
+    for block, start in enumerate(range(0, n_perms, block_size), start=1):
+        block_seed = int(np.random.SeedSequence([seed, block]).generate_state(1)[0] & 0x7fffffff)
+        blocks.append({"block": block, "perms": min(block_size, n_perms - start), "seed": block_seed})
+    return blocks
+
+
+def shard_file(checkpoint_dir, block):
+    return os.path.join(checkpoint_dir, "block" + str(block["block"]).zfill(5) + ".txt")
+
+
+# Blocks run with other options (eg, different covariates) don't count as done
+def command_hash(command):
+    return hashlib.md5("\0".join(command).encode("utf-8")).hexdigest()
+
+
+# The .done file holds the seed, size and command a block was run with
+def done_file(checkpoint_dir, block):
+    return shard_file(checkpoint_dir, block)[:-len(".txt")] + ".done"
+
+
+def done_line(block):
+    return str(block["seed"]) + "\t" + str(block["perms"]) + "\t" + block["command"] + "\n"
+
+
+def is_done(checkpoint_dir, block):
+    done = done_file(checkpoint_dir, block)
+    if not os.path.exists(done) or not os.path.exists(shard_file(checkpoint_dir, block)): return False
+    IN = open(done, "r")
+    line = IN.read()
+    IN.close()
+    return line == done_line(block)
+
+
+# Run blocks up to num_procs at a time; returns the ones that failed
+def run_blocks(command, blocks, checkpoint_dir, num_procs):
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=num_procs)     # Threads just wait on subprocesses
+    results = pool.map(lambda b: (b, run_block(command, b, checkpoint_dir)), blocks)
+    failed = [b for b, ok in results if not ok]
+    pool.shutdown()
+    return failed
+
+
+def run_block(command, block, checkpoint_dir):
+    shard, done = shard_file(checkpoint_dir, block), done_file(checkpoint_dir, block)
+    if os.path.exists(done): os.remove(done)
+    cmd = command + ["--random-perms", str(block["perms"]), "--seed", str(block["seed"]), "--heritfile", shard]
+    print("Running block", block["block"], "with", block["perms"], "permutations and seed", block["seed"])
+    try:
+        returncode = subprocess.run(cmd).returncode
+    except OSError as error:
+        print("ERROR! Could not run", cmd[0], ":", error)
+        return False
+    if returncode != 0:
+        print("ERROR! Block", block["block"], "failed with exit code", returncode)
+        return False
+    OUT = open(done, "w")
+    OUT.write(done_line(block))
+    OUT.close()
+    return True
+
+
+if __name__ == '__main__': main()
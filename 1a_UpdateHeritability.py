@@ -0,0 +1,89 @@
+__author__ = 'jgwall'
+
+# Incremental version of the one-way "(1|INBRED_nested)" heritability in 1a_BroadSenseHeritability.py. The per-group
+# sufficient statistics of the actual data and of every permutation are kept in a statistics file (see group_stats.py).
+# The first run creates it from all samples; later runs on an input that has gained samples (eg, a new week or field
+# location) only add the new samples to the groups they belong to, then recalculate heritabilities and empirical
+# p-values from the updated statistics, without redoing anything for the samples already counted.
+#
+# Eg, python3 1a_UpdateHeritability.py -i traits.txt -k key.txt -s traits.stats.npz --random-perms 1000 --heritfile herits.txt
+# and after adding samples to traits.txt (and key.txt), the same command again.
+
+import argparse
+import group_stats
+import herit_store
+import oneway_herit
+import os
+import profiling
+import sys
+from herit_stats import PermutationNull
+
+debug = False
+
+
+def main():
+    args = parse_args()
+    profiling.start_from_args(args, __file__)
+    print("Updating one-way heritability of traits in", args.infile, "from statistics in", args.statsfile)
+
+    # Load and match data
+    with profiling.phase("load"):
+        data = oneway_herit.load_traits(args.infile)
+        key = oneway_herit.load_key(args.keyfile)
+        values, codes, groups, samples = oneway_herit.match_data(data, key)
+        traits = ["trait_" + str(t) for t in data.index]   # Same naming as the R script
+    print("\tData has", len(samples), "samples in", len(groups), "groups and", len(traits), "traits")
+
+    # Start new statistics or add new samples to existing ones
+    with profiling.phase("compute"):
+        if os.path.exists(args.statsfile):
+            stats = group_stats.load(args.statsfile)
+            if list(stats["traits"]) != traits:
+                sys.exit("ERROR! Traits in " + args.infile + " do not match those in " + args.statsfile + "; new traits need a full recalculation")
+            if args.random_perms is not None and args.random_perms != group_stats.n_perms(stats):
+                sys.exit("ERROR! " + args.statsfile + " has " + str(group_stats.n_perms(stats)) + " permutations, not " + str(args.random_perms))
+            n_new = group_stats.add_samples(stats, values, codes, groups, samples)
+            print("\tAdded", n_new, "new samples to the", len(stats["samples"]) - n_new, "already in", args.statsfile)
+        else:
+            n_perms = args.random_perms if args.random_perms is not None else 0
+            print("\tStarting new statistics with", n_perms, "random permutations")
+            stats = group_stats.create(traits, values, codes, groups, samples, n_perms, seed=args.seed)
+            n_new = len(samples)
+        actual, perms = group_stats.heritabilities(stats)
+    herits = oneway_herit.make_herit_table(traits, actual, perms)
+
+    # Write out statistics and results
+    with profiling.phase("write"):
+        if n_new:
+            print("Writing updated statistics to", args.statsfile)
+            group_stats.save(stats, args.statsfile)
+        if args.heritfile:
+            print("Writing heritability to", args.heritfile)
+            oneway_herit.write_herit_table(herits, args.heritfile)
+            herit_store.write_store(args.heritfile, herits)
+        if args.summary:
+            print("Writing heritabilities and empirical p-values to", args.summary)
+            PermutationNull(herits).summary().to_csv(args.summary, sep='\t', index=False, na_rep="NA")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--infile", help="Input file of traits in (pseudo-)BIOM text format, including any new samples")
+    parser.add_argument("-k", "--keyfile", help="QIIME-formatted key file of sample metadata")
+    parser.add_argument("-s", "--statsfile", help="File of per-group statistics to update (created if it doesn't exist)")
+    parser.add_argument("-r", "--random-perms", type=int, help="Number of random permutations (when creating the statistics; default 0)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for permutations (when creating the statistics)")
+    parser.add_argument("--heritfile", help="Output file for heritability (includes random permutation heritabilities)")
+    parser.add_argument("--summary", help="Output file of each trait's heritability and empirical p-value")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__': main()
@@ -1,46 +1,57 @@
 __author__ = 'jgwall'
 
 import argparse
-import matplotlib.gridspec as gridspec
-import matplotlib.pyplot as plt
+import herit_store
 import numpy as np
 import pandas as pd
+import profiling
+import violins
 
 debug = False
 
 
 def main():
     args = parse_args()
+    profiling.start_from_args(args, __file__)
     print("Plotting heritabilities from",args.infile)
 
     # Load and sort data
-    data=pd.read_csv(args.infile, sep='\t')
-    order = np.argsort(data.loc['actual',:])[::-1]
-    data = data.iloc[:,order]
+    with profiling.phase("load"):
+        table = herit_store.open_table(args.infile)
+        order = np.argsort(table.actual)[::-1]
+        actual = pd.Series(table.actual[order], index=table.traits[order])
+        perms = table.permutations(order)   # Or their summary, for tables stored in summary-only mode
+    plot_heritabilities(actual, perms, args.outfile, args.dist_style)
+
+
+def plot_heritabilities(actual, perms, outfile, style="violin"):
+    with profiling.phase("render"):
+        fig = draw_heritabilities(actual, perms, style)
+    with profiling.phase("savefig.png"):
+        fig.savefig(outfile, dpi=100)
+
+
+def draw_heritabilities(actual, perms, style="violin"):
+    import matplotlib.gridspec as gridspec  # Plotting libraries are only imported when needed, since they are slow to load
+    import matplotlib.pyplot as plt
 
     # Plot
-    fig = plt.figure(figsize=(5 + .25 * len(data.columns), 5))
+    fig = plt.figure(figsize=(5 + .25 * len(actual), 5))
     grid = gridspec.GridSpec(nrows=100, ncols=100)
     ax = fig.add_subplot(grid[:80,:], title="Distributions of null heritabilities", xlabel="trait", ylabel="Heritability")
 
-    # Violin plots of random permutations
-    perms = data.index != "actual"
-    xticks, xlabels = list(), list()
-    for x in range(len(data.columns)):
-        trait = data.columns[x]
-        xticks.append(x)
-        ax.violinplot(data.loc[perms, trait], positions=[x])
-        xlabels.append(trait.replace("trait_", ""))
+    # Violin plots of random permutations, all drawn at once (NAs = permutations skipped in adaptive mode)
+    xticks = list(range(len(actual)))
+    xlabels = [trait.replace("trait_", "") for trait in actual.index]
+    violins.draw_distributions(ax, perms, xticks, style=style, color="C0", alpha=0.3)
 
     # Add dots for actual heritabilities
-    ax.scatter(xticks, data.loc['actual',:])
+    ax.scatter(xticks, actual)
 
     # Prettify
     ax.set_xticks(xticks)
     ax.set_xticklabels(xlabels, rotation="vertical")
-
-    # Save
-    fig.savefig(args.outfile, dpi=100)
+    return fig
 
 
 
@@ -48,6 +59,9 @@ def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--infile")
     parser.add_argument("-o", "--outfile")
+    parser.add_argument("-s", "--dist-style", choices=["violin", "box"], default="violin",
+                        help="How to draw the permutation distributions ('box' = quartile boxes, for plots with very many traits)")
+    profiling.add_arguments(parser)
     parser.add_argument("--debug", default=False, action="store_true")
     args = parser.parse_args()
 
@@ -0,0 +1,126 @@
+__author__ = 'jgwall'
+
+# Combine heritability shards (one "actual" row plus permutations each) into a single table. Shards are streamed in
+# blocks of rows, so memory stays bounded by the block size no matter how many shards or permutations there are.
+# The combined matrix is also written to a binary store (see herit_store.py) for faster loading downstream. With
+# --summary-only the permutations aren't kept at all: the output has just the actual row, plus a fixed-size summary of
+# each trait's permutations (see herit_stats.PermutationSketch) that is updated as they stream in, which is all the
+# p-values and plots downstream need.
+
+import argparse
+import herit_store
+import numpy as np
+import pandas as pd
+import profiling
+import sys
+from herit_stats import PermutationSketch
+
+debug = False
+
+
+def main():
+    args = parse_args()
+    profiling.start_from_args(args, __file__)
+    print("Combining heritabilities from", len(args.infiles), "input files")
+
+    # Make sure all shards have the same traits in the same order
+    traits = read_traits(args.infiles[0])
+    for infile in args.infiles[1:]:
+        if read_traits(infile) != traits:
+            sys.exit("ERROR! Traits in " + infile + " do not match those in " + args.infiles[0])
+
+    # Size the binary store: one actual row plus every permutation
+    store, sketch = None, None
+    if not args.summary_only:
+        nrows = 1 + sum(count_perm_rows(infile) for infile in args.infiles)
+        store = herit_store.StoreWriter(args.outfile, traits, nrows)
+
+    with profiling.phase("combine"):
+        actual = None
+        n_perms = 0
+        OUT = open(args.outfile, "w")
+        OUT.write("\t".join(traits) + "\n")
+        for i, infile in enumerate(args.infiles, start=1):
+            for chunk in pd.read_csv(infile, sep='\t', chunksize=args.chunksize):
+                isactual = np.array(chunk.index == "actual")
+
+                # Keep the first set of actual values and check all others against it
+                if np.any(isactual):
+                    myactual = np.array(chunk.loc[isactual, :], dtype=float)[0, :]
+                    if actual is None:
+                        actual = myactual
+                        chunk.loc[isactual, :].iloc[:1, :].to_csv(OUT, sep='\t', header=False, na_rep="NA")
+                        if store: store.write_rows(chunk.loc[isactual, :].iloc[:1, :])
+                        if args.summary_only: sketch = PermutationSketch(traits, actual, bins=args.sketch_bins)
+                    else:
+                        check_actuals(actual, myactual, args.tolerance, i)
+
+                # Write permutations, with shard number added to the names so they stay unique
+                perms = chunk.loc[~isactual, :]
+                n_perms += len(perms)
+                if args.summary_only:
+                    if len(perms) and sketch is None:
+                        sys.exit("ERROR! Permutations come before the actual heritabilities in " + infile)
+                    if len(perms): sketch.update(perms)
+                    continue
+                perms.index = [str(p) + "_" + str(i) for p in perms.index]
+                perms.to_csv(OUT, sep='\t', header=False, na_rep="NA")
+                store.write_rows(perms)
+        OUT.close()
+
+    if actual is None:
+        sys.exit("ERROR! No actual heritabilities found in any input file")
+    if store: store.close()
+    if sketch: herit_store.write_sketch(args.outfile, sketch)     # After the text table, so it's the newer of the two
+    print("\tAll actual values match to within", args.tolerance)
+    print("Combined data has", n_perms, "permutations; written to", args.outfile)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--infiles", nargs="*", help="Input files with actual and permuted heritabilities")
+    parser.add_argument("-o", "--outfile", help="Output file of combined heritabilities")
+    parser.add_argument("-t", "--tolerance", type=float, default=1e-8,
+                        help="Maximum absolute difference allowed between the actual heritabilities of different input files")
+    parser.add_argument("-c", "--chunksize", type=int, default=100, help="Number of rows to read from an input file at a time")
+    parser.add_argument("-s", "--summary-only", default=False, action="store_true",
+                        help="Only keep a summary of each trait's permutations (p-values, maximum and a histogram for plots), not the permutations")
+    parser.add_argument("--sketch-bins", type=int, default=128, help="Number of histogram bins per trait in --summary-only mode")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+# Helper function to get trait names from the header line (which has no entry for the row names)
+def read_traits(infile):
+    IN = open(infile, "r")
+    header = IN.readline().rstrip("\n").split("\t")
+    IN.close()
+    return header
+
+
+# Number of permutation rows in a shard, counted the way pandas reads them: not the header, the actual row(s) or blank
+# lines, whether or not the file ends with a newline
+def count_perm_rows(infile):
+    IN = open(infile, "rb")
+    IN.readline()
+    n = sum(1 for line in IN if line.strip() != b"" and not line.startswith(b"actual\t"))
+    IN.close()
+    return n
+
+
+# Make sure actual values match the first input file, to within the given tolerance
+def check_actuals(actual, myactual, tolerance, index):
+    mismatch = ~np.isclose(myactual, actual, rtol=0, atol=tolerance, equal_nan=True)
+    if np.sum(mismatch) > 0:
+        sys.exit("ERROR! " + str(np.sum(mismatch)) + " values of actual heritabilities differ at index " + str(index) +
+                 " compared to index 1")
+
+
+if __name__ == '__main__': main()
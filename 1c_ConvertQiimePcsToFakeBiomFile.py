@@ -2,24 +2,30 @@ __author__ = 'jgwall'
 
 import argparse
 import math
+import multiprocessing
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
 import pandas as pd
+import os
+import profiling
 from os.path import commonprefix
+from qiime_pcs import read_pc_file
 import re
 
 debug = False
 
-matplotlib.rcParams.update({'font.size':10})
-
 def main():
     args = parse_args()
-    pcs = load_pcs(args.infiles, args.num_pcs, args.stem)
-    output_fake_biom(pcs, args.outfile)
-    if args.outgraphic:
-        output_pheno_distributions(pcs, args.outgraphic)
+    profiling.start_from_args(args, __file__)
+    if args.batch_outdir:
+        convert_batch(args.infiles, args.batch_outdir, args.num_pcs, args.num_procs, graphics=not args.no_graphics)
+        return
+    with profiling.phase("load"):
+        pcs = load_pcs(args.infiles, args.num_pcs, args.stem)
+    with profiling.phase("write"):
+        output_fake_biom(pcs, args.outfile)
+    if args.outgraphic and not args.no_graphics:
+        with profiling.phase("render"):     # Includes saving
+            output_pheno_distributions(pcs, args.outgraphic)
 
 
 def parse_args():
@@ -29,6 +35,11 @@ def parse_args():
     parser.add_argument("-g", "--outgraphic", help="Output graphic of histograms of each phenotype")
     parser.add_argument("-n", "--num-pcs", type=int, default=1, help="Number of principal components to take")
     parser.add_argument("-s", "--stem", default="", help="Stem to append to beginning of PC name")
+    parser.add_argument("-b", "--batch-outdir", help="Batch mode: convert each input file separately, writing 1e_<stem>.biom.txt and "
+                        "1e_<stem>.pc_dist.png to this directory (stem taken from the file name; --outfile, --outgraphic and --stem are ignored)")
+    parser.add_argument("-p", "--num-procs", type=int, default=1, help="Number of parallel processes to use in batch mode")
+    parser.add_argument("--no-graphics", default=False, action="store_true", help="Only write the pseudo-BIOM files, no histograms")
+    profiling.add_arguments(parser)
     parser.add_argument("--debug", default=False, action="store_true")
     args = parser.parse_args()
 
@@ -39,12 +50,46 @@ def parse_args():
     return parser.parse_args()
 
 
+# Batch mode: convert each PC file on its own, spread across a pool of worker processes
+def convert_batch(infiles, outdir, num_pcs, num_procs, graphics=True):
+    if debug: infiles=infiles[:5]
+    print("Converting",len(infiles),"principal component files in batch mode with",num_procs,"processes")
+    jobs = [(infile, outdir, num_pcs, graphics) for infile in infiles]
+    if num_procs > 1:
+        pool = multiprocessing.Pool(num_procs, initializer=profiling.collect)   # Workers drop the copy of the main process's phases
+        profiles = pool.starmap(convert_one, jobs, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        profiles = [convert_one(*job) for job in jobs]
+    for profile in profiles:
+        profiling.merge(profile)
+
+
+def convert_one(infile, outdir, num_pcs, graphics=True):
+    stem = get_stem(infile)
+    print("#####\n" + stem + "\n#####")
+    with profiling.phase("load"):
+        pcs = load_pcs([infile], num_pcs, stem)
+    with profiling.phase("write"):
+        output_fake_biom(pcs, os.path.join(outdir, "1e_" + stem + ".biom.txt"))
+    if graphics:
+        with profiling.phase("render"):     # Includes saving
+            output_pheno_distributions(pcs, os.path.join(outdir, "1e_" + stem + ".pc_dist.png"))
+    return profiling.collect()  # Phases run here, to send back from worker processes
+
+
+# Get the dataset stem from a PC file name the same way 1_CalculateHeritabilities.sh does (${pcs/*distances./} then ${stem/.txt/})
+def get_stem(infile):
+    stem = infile.rsplit("distances.", 1)[-1]
+    return stem.replace(".txt", "", 1)
+
+
 def load_pcs(infiles, num_pcs, stem):
     if debug: infiles=infiles[:5]   # Debug mode = take only first 5 input files
     print("Loading principal components from",len(infiles),"input files")
-    data = [load_pc_file(f) for f in infiles]
     print("\tTaking the first",num_pcs,"components of each")
-    data = [d[:,:num_pcs+1] for d in data]
+    data = [read_pc_file(f, num_pcs) for f in infiles]
 
     # Handle dataset names
     names = [i.replace('/', '_') for i in infiles]
@@ -58,7 +103,7 @@ def load_pcs(infiles, num_pcs, stem):
 
     # Convert to individual DataFrames for easier unification
     colnames = ["PC" + str(p) for p in range(1, num_pcs+1)]
-    data = [pd.DataFrame(d[:,1:], index=d[:,0], dtype=float, columns=colnames) for d in data]  # Slice first columns out to be the index
+    data = [pd.DataFrame(d.coords, index=d.ids, columns=colnames) for d in data]
     for mydata in data:
         mydata.columns = [stem + "_" + c for c in mydata.columns] # Add dataset name as part of column name
     # print(data[0].head())
@@ -70,23 +115,6 @@ def load_pcs(infiles, num_pcs, stem):
     # Return a concatenated dataframe
     return master
 
-# Helper function to load a single PC file from QIIME
-def load_pc_file(infile):
-    IN=open(infile, "r")
-    for line in IN:    # Advance through lines until get to right spot
-        if line.startswith("Site"): break
-    site, nrow, ncol = line.strip().split('\t')
-    matrix = list()
-    for line in IN:
-        if line == "\n": break  # When hit white space, break out
-        data = line.strip().split('\t')
-        matrix.append(data)
-    matrix = np.array(matrix)
-    IN.close()
-    return(matrix)
-
-
-
 def output_fake_biom(pcs, outfile):
     print("Outputting",len(pcs.columns), "traits in a pseudo-BIOM format to",outfile)
     pcs.index.name="Taxon"
@@ -97,6 +125,11 @@ def output_fake_biom(pcs, outfile):
     OUT.close()
 
 def output_pheno_distributions(pcs, outgraphic):
+    import matplotlib   # Plotting libraries are only imported when needed, since they are slow to load
+    import matplotlib.pyplot as plt
+    import matplotlib.gridspec as gridspec
+    matplotlib.rcParams.update({'font.size':10})
+
     print("Outputting phenotype distributions to",outgraphic)
     # Determine plotting dimensions
     nplots = len(pcs.columns)
@@ -121,7 +154,9 @@ def output_pheno_distributions(pcs, outgraphic):
             i+=1
 
 
-    fig.savefig(outgraphic, dpi=100)
+    with profiling.phase("savefig.png"):
+        fig.savefig(outgraphic, dpi=100)
+    plt.close(fig)  # Free the figure, since batch mode makes many of them in the same process
 
 
 if __name__ == '__main__': main()
\ No newline at end of file
@@ -0,0 +1,51 @@
+__author__ = 'jgwall'
+
+# Principal coordinates of each distance-matrix split written by 1c_SplitDistanceMatrices.py. Replaces QIIME's
+# principal_coordinates.py: each split is pulled straight out of the binary distance store and only the first few
+# components are computed (see pcoa.py). Output files are named like QIIME's (pcoa_<split file>.txt) and are in its format.
+
+import argparse
+import distance_store
+import os
+import pcoa
+import profiling
+from qiime_pcs import write_pc_file
+
+debug = False
+
+
+def main():
+    args = parse_args()
+    profiling.start_from_args(args, __file__)
+    if not os.path.exists(args.outdir): os.mkdir(args.outdir)
+    for splitfile in args.infiles:
+        prefix, splits = distance_store.read_splits(splitfile)
+        store = distance_store.open_store(prefix)
+        outprefix = os.path.join(args.outdir, "pcoa_" + os.path.basename(splitfile)[:-len(".splits.txt")])
+        print("Calculating", args.num_pcs, "principal coordinates for", len(splits), "splits in", splitfile)
+        for name, indices in splits.items():
+            if debug: print("\t", name, "with", len(indices), "samples")
+            with profiling.phase("compute"):
+                pcfile = pcoa.pcoa(store.submatrix(indices), store.ids[indices], min(args.num_pcs, len(indices)), seed=args.seed)
+            with profiling.phase("write"):
+                write_pc_file(pcfile, ".".join([outprefix, name, "txt"]))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--infiles", nargs="*", help="Split index files (*.splits.txt) from 1c_SplitDistanceMatrices.py")
+    parser.add_argument("-o", "--outdir", help="Output directory for PC files")
+    parser.add_argument("-n", "--num-pcs", type=int, default=5, help="Number of principal coordinates to calculate")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the eigensolver's starting vector (splits of more than 500 samples)")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__': main()
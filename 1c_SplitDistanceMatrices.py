@@ -0,0 +1,67 @@
+__author__ = 'jgwall'
+
+# Split a distance matrix by combinations of key columns (eg, week and location). The text matrix is converted once to
+# a memory-mapped binary store (see distance_store.py), and each split is then just a set of integer indices into it.
+# Text submatrices (as 1c_SplitDistanceMatrices.r wrote them, for QIIME) are only written if asked for.
+
+import argparse
+import distance_store
+import os
+import pandas as pd
+import profiling
+import rawdata
+
+debug = False
+
+
+def main():
+    args = parse_args()
+    profiling.start_from_args(args, __file__)
+    print("Subsetting distance matrix in", args.infile, "by", args.splits)
+    prefix = args.store if args.store else distance_store.store_prefix(args.infile, os.path.dirname(args.outprefix))
+
+    # Convert to binary once (and again whenever the text matrix changes)
+    if not distance_store.has_store(prefix, args.infile) or args.rebuild:
+        print("\tConverting to binary store", prefix)
+        with profiling.phase("load"):
+            distance_store.convert_text(args.infile, prefix)
+    store = distance_store.open_store(prefix)
+
+    # Work out splits and write out the split indices
+    with profiling.phase("compute"):
+        IN = rawdata.open_raw(args.keyfile)
+        key = pd.read_csv(IN, sep='\t', index_col=0, dtype=str)
+        IN.close()
+        splits = store.split_indices(key, args.splits)
+    print("\tFound", len(splits), "splits with output prefix", args.outprefix)
+    distance_store.write_splits(splits, args.outprefix + ".splits.txt", prefix)
+
+    # Write text versions if requested
+    if args.write_text:
+        print("Writing", len(splits), "subset distance matrices as text")
+        for name, indices in splits.items():
+            with profiling.phase("write"):
+                distance_store.write_text(store.ids[indices], store.submatrix(indices), ".".join([args.outprefix, name, "txt"]))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--infile", help="Input distance matrix (tab-delimited text)")
+    parser.add_argument("-o", "--outprefix", help="Prefix for output files")
+    parser.add_argument("-k", "--keyfile", help="QIIME-formatted key file of sample metadata")
+    parser.add_argument("-s", "--splits", nargs="*", help="Which keyfile columns to split on")
+    parser.add_argument("--store", help="Prefix of the binary distance store (default: input file name with .dm instead of .txt, in the output directory)")
+    parser.add_argument("--rebuild", default=False, action="store_true", help="Rebuild the binary store even if it is newer than the input")
+    parser.add_argument("-t", "--write-text", default=False, action="store_true", help="Also write each split as a text distance matrix")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__': main()
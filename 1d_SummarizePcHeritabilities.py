@@ -1,52 +1,84 @@
 __author__ = 'jgwall'
 
 import argparse
+import heatmaps
+import herit_store
 import math
-import matplotlib
-import matplotlib.gridspec as gridspec
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+import profiling
 import re
+import trait_table
 
 debug = False
 
 
 def main():
     args = parse_args()
+    profiling.start_from_args(args, __file__)
     if debug: args.infiles=args.infiles[:2]
     print("Summarizing heritabilities from",len(args.infiles),"input files")
 
     # Load data
-    data = [load_herit(i) for i in args.infiles]
-    compiled = dict()
-    for d in data:
-        for trait in d:
-            if trait in compiled:
-                print("WARNING! Trait",trait,"exists twice in the dataset! Only one will be retained")
-            compiled[trait] = d[trait]
-    print("\tLoadeed",len(compiled),"traits")
+    with profiling.phase("load"):
+        data = [load_herit(i) for i in args.infiles]
+        compiled = pd.concat(data)
+    for trait in compiled.index[compiled.index.duplicated()]:
+        print("WARNING! Trait",trait,"exists twice in the dataset! Only one will be retained")
+    compiled = compiled[~compiled.index.duplicated(keep='last')]
+    print("\tLoaded",len(compiled),"traits")
     
 
-    # # Write text output
-    # columns=['trait','herit','pval','perm_max','herit_minus_perm_max']
-    # print("Writing text summary to",args.outfile,"\n")
-    # OUT = open(args.outfile, 'w')
-    # OUT.write("\t".join(columns) + "\n")
-    # for trait in sorted(compiled.keys()):
-    #     values = [str(compiled[trait][c]) for c in columns]
-    #     OUT.write("\t".join(values) + "\n")
-    # OUT.close()
-    
-    
+    # Write text output
+    if args.outfile:
+        with profiling.phase("write"):
+            write_summary(compiled, args.outfile)
+
     # Make graphical output
-    locations = get_uniques(compiled, 'location')
-    ages = get_uniques(compiled, 'age')
-    pcs = get_uniques(compiled, 'pc')
+    if args.outgraphic:
+        plot_summary(compiled, args.outgraphic, label_boxes=not args.no_label_boxes)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--infiles", nargs="*")
+    parser.add_argument("-o", "--outfile")
+    parser.add_argument("-g", "--outgraphic")
+    parser.add_argument("--no-label-boxes", default=False, action="store_true", help="Skip the background boxes behind heatmap labels (faster)")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+def write_summary(compiled, outfile):
+    columns=['trait','herit','pval','perm_max','herit_minus_perm_max']
+    print("Writing text summary to",outfile)
+    compiled.sort_index()[columns].to_csv(outfile, sep='\t', index=False)
+
+
+def plot_summary(compiled, outgraphic, label_boxes=True):
+    with profiling.phase("render"):
+        fig = draw_summary(compiled, label_boxes)
+    with profiling.phase("savefig.png"):
+        fig.savefig(outgraphic, dpi=100)
+
+
+def draw_summary(compiled, label_boxes=True):
+    import matplotlib.gridspec as gridspec  # Plotting libraries are only imported when needed, since they are slow to load
+    import matplotlib.pyplot as plt
+
+    table = trait_table.TraitTable(compiled)
+    locations, ages = table.locations, table.ages
 
 
     ncol = 5
-    nrow = int(len(locations) * 2 / ncol)+1
+    nrow = 2 * math.ceil(len(locations) / ncol)   # Heritability and p-value rows for each row of locations
     fig = plt.figure(figsize=(6 * ncol, 0.75 * len(ages) * nrow + 4))
     grid = gridspec.GridSpec(nrows=nrow, ncols=ncol, hspace=0.25, wspace=0.25)
 
@@ -56,11 +88,11 @@ def main():
         ax_h2 = fig.add_subplot(grid[myrow, mycol], title=loc + " - H2", xlabel="PC", ylabel="Week")
         ax_pval = fig.add_subplot(grid[myrow+1, mycol], title=loc + " - Empirical p-value", xlabel="PC", ylabel="Week")
 
-        matrix_h2 = make_data_matrix(compiled, location=loc, key="herit")
-        matrix_pval = make_data_matrix(compiled, location=loc, key="pval")
+        matrix_h2 = table.matrix(loc, key="herit")
+        matrix_pval = table.matrix(loc, key="pval")
 
-        make_heatmap(ax_h2, matrix_h2)
-        make_heatmap(ax_pval, matrix_pval, reverse=True, log_transform=True, cmap_name="Reds")
+        make_heatmap(ax_h2, matrix_h2, label_boxes=label_boxes)
+        make_heatmap(ax_pval, matrix_pval, reverse=True, log_transform=True, cmap_name="Reds", label_boxes=label_boxes)
 
         # Prettify
         prettify(ax_h2)
@@ -70,105 +102,32 @@ def main():
         if mycol == ncol:
             mycol=0
             myrow += 2
+    return fig
 
-    ## Save
-    fig.savefig(args.outgraphic, dpi=100)
-
-
-
-def parse_args():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-i", "--infiles", nargs="*")
-    parser.add_argument("-o", "--outfile")
-    parser.add_argument("-g", "--outgraphic")
-    parser.add_argument("--debug", default=False, action="store_true")
-    args = parser.parse_args()
-
-    # Handle debug flag
-    global debug
-    debug = args.debug
-
-    return parser.parse_args()
 
 def load_herit(infile):
-    # Load data and identify which is the actual H2 value
-    data=pd.read_csv(infile, sep='\t')
-    perms = np.array(data.index)
-    isperm = perms != "actual"
-
-    # Load results into a dictionary for easier handling
-    result=dict()
-    for trait in data.columns:
-        if trait in result:
+    with profiling.phase("load_herit"):
+        # Load data and calculate empirical p-values for all traits at once
+        table=herit_store.open_table(infile)
+        traits = pd.Index(table.traits)
+        for trait in traits[traits.duplicated()]:
             print("\tWARNING! Trait",trait,"in",infile,"occurs more than once!")
-        values = np.array(data[trait])
-        result[trait] = dict()
-        result[trait]["trait"] = trait
-        result[trait]["herit"] = values[~isperm][0] # Index 0 to make it no longer an array
-        result[trait]["perms"] = values[isperm]
-        result[trait]["pval"] = np.sum((result[trait]["herit"] < result[trait]["perms"]) / len(result[trait]["perms"])) # Empirical p-value calculation
-        result[trait]["perm_max"] = np.max(result[trait]["perms"]) # Empirical p-value calculation
-        result[trait]["herit_minus_perm_max"] = result[trait]["herit"] - result[trait]["perm_max"]
-        result[trait]['location'], result[trait]['age'], result[trait]['pc'] = parse_trait_name(trait)
-
-    return result
-
-def parse_trait_name(trait):
-    #pattern='trait_(.+)_otu_table_(.+)_even[^_]+__AGE_([^_]+)___pc_(PC.+)' # For patterns of "trait_unweighted_unifrac_otu_table_Ithaca_even10000__AGE_4___pc_PC1"
-    pattern='trait_(.+)\.week(.+)\.(.+)_(PC.+)'     #for patterns of trait_unweighted.week05.Ithaca_PC2
-    matcher = re.search(string=trait, pattern=pattern)
-    name =  matcher.group(1) + ":" + matcher.group(3)   # Name = type of distance matrix + location
-    return name, int(matcher.group(2)), matcher.group(4)    # Return name, age, and PC number
-
-def get_uniques(data, key):
-    myset = {data[trait][key] for trait in data}
-    return sorted(myset)
-
-# Make a data matrix to plot, with weeks in rows and PCs in columns
-def make_data_matrix(data, location, key):
-    # Subset data to just this location
-    subdata=dict()
-    for trait in data:
-        if data[trait]["location"] == location:
-            subdata[trait] = data[trait]
-
-    # Gather data for conversion to data frame
-    tempdata = dict()
-    for trait in subdata:
-        mypc = subdata[trait]["pc"]
-        myweek = subdata[trait]["age"]
-        if mypc not in tempdata:
-            tempdata[mypc] = dict()
-        if myweek in tempdata[mypc]:    # Check that this is new data; should only be one per dataset
-            print("WARNING! Data for location",location,"age",myweek,"and PC",mypc,"has multiple values! Trait:", trait)
-            print("\t",trait,":",key,":",subdata[trait][key],"versus",tempdata[mypc][myweek])
-        tempdata[mypc][myweek] = subdata[trait][key]
-
-    # Make sure all weeks have data
-    weeks = list(range(1,16)) + [20]
-    pcs = ["PC1", "PC2", "PC3", "PC4","PC5"]
-    for week in weeks:
-        for pc in pcs:
-            if pc not in tempdata:
-                tempdata[pc] = dict()
-            if week not in tempdata[pc]:
-                tempdata[pc][week] = np.nan
-    return pd.DataFrame(tempdata)
-
-def make_heatmap(ax, matrix, reverse=False, min_value=None, log_transform=False, cmap_name = "Blues"):
+        result = table.null().summary()     # Works the same for tables stored in summary-only mode
+
+        # Add parsed trait names for easier handling
+        return trait_table.parse_traits(result)
+
+def make_heatmap(ax, matrix, reverse=False, min_value=None, log_transform=False, cmap_name = "Blues", label_boxes=True):
+    import matplotlib
+    import matplotlib.pyplot as plt
     nrow, ncol = matrix.shape
     offset=0.5
 
-    # Place text
-    for r in range(nrow):
-        for c in range(ncol):
-            myval = matrix.iloc[r, c]
-            myval = round(myval, 4)
-            ax.text(x=c + offset, y=r + offset, s=str(myval), fontsize="medium", ha="center", verticalalignment='center',
-                    bbox={"color": "white", "alpha": 0.5, "boxstyle": "round"}, zorder=99)
-            # Fix nans so doesn't mess up plotting
-            if np.isnan(myval):
-                matrix.iloc[r, c] = 1 if log_transform else 0
+    # Place text (all cells at once)
+    heatmaps.draw_cell_labels(ax, heatmaps.cell_labels(matrix, nan_label="nan"), boxes=label_boxes)
+
+    # Fix nans so doesn't mess up plotting
+    matrix = pd.DataFrame(heatmaps.fill_nans(matrix, 1 if log_transform else 0), index=matrix.index, columns=matrix.columns)
 
 
     # Make color plot, including various transformations
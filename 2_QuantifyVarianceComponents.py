@@ -0,0 +1,84 @@
+__author__ = 'jgwall'
+
+# Quantify how much of each principal coordinate is explained by week, location, inbred and their interactions. Same
+# model and output as 2_QuantifyVarianceComponents.r, but all PCs share one design matrix and are solved together
+# (see variance_components.py) instead of refitting lm() for each one
+
+import argparse
+import pandas as pd
+import profiling
+import rawdata
+import variance_components
+from qiime_pcs import read_pc_file
+
+debug = False
+
+
+def main():
+    args = parse_args()
+    profiling.start_from_args(args, __file__)
+    print("Quantifying variance components of principal coordinates in", args.infile)
+
+    # Load data
+    with profiling.phase("load"):
+        pcs = load_pcs(args.infile, args.num_pcs)
+        IN = rawdata.open_raw(args.keyfile)
+        key = pd.read_csv(IN, sep='\t', dtype=str)
+        IN.close()
+    key = key.rename(columns={key.columns[0]: "Sample"}).drop_duplicates("Sample").set_index("Sample")
+
+    # Match up to key and remove samples without the needed metadata
+    key = key.reindex(pcs.index)
+    data = pd.DataFrame({"week": key["AGE_fixed"], "location": key["ENV"], "inbred": key["INBREDS"]}, index=pcs.index)
+    data = data.join(pcs)
+    data = data[data[variance_components.factors].notnull().all(axis=1)]
+    print("\tFitting", len(pcs.columns), "PCs across", len(data), "samples")
+
+    # Calculate and write out sums of squares
+    with profiling.phase("compute"):
+        ss = variance_components.sum_squares_table(data, list(pcs.columns), ss_type=args.ss_type)
+    outfile = args.outprefix + ".txt"
+    print("Writing sums of squares to", outfile)
+    with profiling.phase("write"):
+        OUT = open(outfile, "w")
+        OUT.write("\t".join(ss.columns) + "\n")
+        ss.to_csv(OUT, sep='\t', header=False)
+        OUT.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", "--keyfile", help="QIIME-formatted key file")
+    parser.add_argument("-i", "--infile", help="Principal component file, either from QIIME or as a plain table of sample IDs and PCs")
+    parser.add_argument("-o", "--outprefix", help="Output file prefix")
+    parser.add_argument("-n", "--num-pcs", type=int, default=20, help="Number of principal components to take from a QIIME PC file")
+    parser.add_argument("-t", "--ss-type", type=int, default=1, choices=[1, 3],
+                        help="Type of sums of squares: 1 = sequential (what anova() reports in the R script), 3 = each term dropped from the full model")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+# Load PCs from a QIIME ordination file, or from the plain table that 2_VarianceComponents.sh used to cut out of one
+def load_pcs(infile, num_pcs):
+    IN = rawdata.open_raw(infile, verify=False)
+    is_qiime = IN.readline().startswith("Eigvals")
+    IN.close()
+    if is_qiime:
+        pcfile = read_pc_file(infile, num_pcs)
+        pcs = pd.DataFrame(pcfile.coords, index=pcfile.ids)
+    else:
+        IN = rawdata.open_raw(infile)
+        pcs = pd.read_csv(IN, sep='\t', header=None, index_col=0)
+        IN.close()
+    pcs.columns = ["pc" + str(i) for i in range(1, len(pcs.columns) + 1)]
+    return pcs
+
+
+if __name__ == '__main__': main()
@@ -7,12 +7,8 @@ if [ ! -e $vardir ] ;then mkdir $vardir; fi
 
 keyfile="0_RawData/mapping_with_abundance.txt"
 
-# Cut out PCs
+# Variance components of the first 20 PCs (all fit together, read straight from the QIIME PC file)
 for set in weighted unweighted; do
-  # Slice out first 20 PCs
-  tail -n +10 $rawdir/${set}_unifrac_pc.txt | cut -f1-21 > $vardir/2_${set}_pcs.txt    
-  
-  # Run analysis
-  Rscript 2_QuantifyVarianceComponents.r -i $vardir/2_${set}_pcs.txt -o $vardir/2a_${set}_pcs.sum_squares -k $keyfile
+  python3 2_QuantifyVarianceComponents.py -i $rawdir/${set}_unifrac_pc.txt --num-pcs 20 -o $vardir/2a_${set}_pcs.sum_squares -k $keyfile
 done  
  
\ No newline at end of file
@@ -0,0 +1,129 @@
+__author__ = 'jgwall'
+
+# Make the publication figures (3a, 3b and 3c) in parallel. Figures are described declaratively in make_jobs(); each job
+# names the script that draws it, how to load its inputs, and its text and figure outputs. Inputs are loaded once in the
+# main process (jobs with identical inputs share them), text outputs are written there too, and the figures are then
+# drawn across a process pool with the Agg backend, each one drawn once and saved in every requested format.
+
+import argparse
+import figures
+import glob
+import importlib
+import multiprocessing
+import os
+import profiling
+
+debug = False
+
+
+def main():
+    args = parse_args()
+    profiling.start_from_args(args, __file__)
+    jobs = make_jobs(args.rawdir, args.broaddir, args.vardir, args.plotdir, args.sets)
+    if args.only:
+        jobs = [j for j in jobs if any(o in j["name"] for o in args.only)]
+    if not os.path.exists(args.plotdir): os.mkdir(args.plotdir)
+    print("Making", len(jobs), "figures with", args.num_procs, "processes")
+
+    # Load inputs once and write text outputs
+    loaded = dict()
+    tasks = list()
+    for job in jobs:
+        key = (job["script"], job["load"], repr(sorted(job["load_args"].items())))
+        if key not in loaded:
+            print("Loading inputs for", job["name"])
+            with profiling.phase("load"):
+                loaded[key] = getattr(load_script(job["script"]), job["load"])(**job["load_args"])
+        inputs = loaded[key] if isinstance(loaded[key], tuple) else (loaded[key],)
+        if "text" in job:
+            with profiling.phase("write"):
+                getattr(load_script(job["script"]), job["text"])(*inputs, job["textfile"])
+        tasks.append((job["script"], job["plot"], inputs, job.get("plot_args", dict()), job["outprefix"], args.formats))
+
+    # Draw figures (workers send back the profiles of their phases, if profiling)
+    if args.num_procs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(args.num_procs, len(tasks)), initializer=init_worker)
+        profiles = pool.starmap(draw_figure, tasks, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        use_agg()
+        profiles = [draw_figure(*task) for task in tasks]
+    for profile in profiles:
+        profiling.merge(profile)
+
+
+# The figure jobs: one 3a and one 3b figure per distance type, plus the 3c OTU figure
+def make_jobs(rawdir, broaddir, vardir, plotdir, sets):
+    jobs = list()
+    for set in sets:
+        jobs.append({"name": "3a_sum_squares." + set, "script": "3a_PlotSumSquaresPretty",
+                     "load": "load_sum_squares",
+                     "load_args": {"infile": os.path.join(vardir, "2a_" + set + "_pcs.sum_squares.txt"), "num_pcs": 3,
+                                   "percent": True, "pcfile": os.path.join(rawdir, set + "_unifrac_pc.txt")},
+                     "plot": "plot_sum_squares", "plot_args": {"percent": True},
+                     "outprefix": os.path.join(plotdir, "3a_sum_squares." + set)})
+    for set in sets:
+        herits = sorted(glob.glob(os.path.join(broaddir, "1f_pc_heirtability", "1f_" + set + "*heritabilities.txt")))
+        jobs.append({"name": "3b_" + set + "_pc_heritabilities", "script": "3b_SummarizePcHeritabilities_pretty",
+                     "load": "load_compiled", "load_args": {"infiles": herits, "exclude": ["Columbia", "Urbana"]},
+                     "text": "write_summary", "textfile": os.path.join(plotdir, "3b_" + set + "_pc_heritabilities.summary.txt"),
+                     "plot": "plot_summary",
+                     "outprefix": os.path.join(plotdir, "3b_" + set + "_pc_heritabilities.summary")})
+    jobs.append({"name": "3c_broad_heritabilities", "script": "3c_PlotOtuHeritabilities_two_column",
+                 "load": "load_heritabilities",
+                 "load_args": {"infile": os.path.join(broaddir, "1b_otu_heritabilities.combined.txt"), "top_n": 200,
+                               "biomfile": os.path.join(rawdir, "otu_table_80percShared_relAbundance.biom"),
+                               "cachedir": plotdir},
+                 "text": "write_table", "textfile": os.path.join(plotdir, "3c_broad_heritabilities.txt"),
+                 "plot": "plot_figure", "plot_args": {"p_cutoff": 0.001},
+                 "outprefix": os.path.join(plotdir, "3c_broad_heritabilities")})
+    return jobs
+
+
+# Script names start with numbers, so have to be imported this way
+def load_script(script):
+    return importlib.import_module(script)
+
+
+def use_agg():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+# Worker processes start with a copy of the main process's phases so far, which are dropped so they aren't counted twice
+def init_worker():
+    use_agg()
+    profiling.collect()
+
+
+def draw_figure(script, plot, inputs, plot_args, outprefix, formats):
+    print("Drawing", outprefix)
+    with profiling.phase("render"):
+        fig = getattr(load_script(script), plot)(*inputs, **plot_args)
+    figures.save_figure(fig, outprefix, formats)
+    return profiling.collect()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rawdir", default="0_RawData")
+    parser.add_argument("--broaddir", default="1_BroadHerit")
+    parser.add_argument("--vardir", default="2_Variances")
+    parser.add_argument("--plotdir", default="3_PublicationGraphics")
+    parser.add_argument("-s", "--sets", nargs="*", default=["weighted", "unweighted"], help="Distance types to make figures for")
+    parser.add_argument("--only", nargs="*", help="Only make figures whose names contain one of these strings (eg, 3b_weighted)")
+    parser.add_argument("-f", "--formats", nargs="*", default=figures.formats, help="File formats to save each figure in")
+    parser.add_argument("-p", "--num-procs", type=int, default=4, help="Number of figures to draw at once")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__': main()
@@ -3,8 +3,9 @@ __author__ = 'jgwall'
 import argparse
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
+import profiling
+from figures import save_figure
+from qiime_pcs import read_pc_file
 
 debug = False
 
@@ -22,44 +23,46 @@ colorkey={"location":"lightsalmon",
 
 def main():
     args = parse_args()
+    profiling.start_from_args(args, __file__)
     print("Graphing sum of squares divisions in",args.infile)
+    with profiling.phase("load"):
+        data = load_sum_squares(args.infile, args.num_pcs, args.percent, args.pcfile)
+    with profiling.phase("render"):
+        fig = plot_sum_squares(data, args.percent)
+    save_figure(fig, args.outprefix)
 
+
+def load_sum_squares(infile, num_pcs=None, percent=False, pcfile=None):
     # Load data
-    data=pd.read_table(args.infile)
+    data=pd.read_table(infile)
     roworder = [plot_order[i] for i in data.index]
     data=data.iloc[np.argsort(roworder),:]
 
-    if args.num_pcs:
-        data=data.iloc[:,:args.num_pcs]
+    if num_pcs:
+        data=data.iloc[:,:num_pcs]
 
-    if args.percent and args.pcfile:
+    if percent and pcfile:
         print("\tConverting raw variance explained to percent")
-        # Read in eigenvalues (= variance explained)
-        IN = open(args.pcfile)
-        IN.readline()
-        eigens = IN.readline().strip().split('\t')
-        IN.close()
-        
-        # Convert data values to variance explained
-        eigens = [float(e) for e in eigens]
-        total_variance = sum(eigens)
+        # Read in eigenvalues (= variance explained) and convert data values to variance explained
+        total_variance = read_pc_file(pcfile, num_pcs=0).total_variance
         data = data / total_variance
 
     # data.index = [prettify_terms(i) for i in data.index]
+    return data
+
 
-    # Make graphic
+def plot_sum_squares(data, percent=False):
+    # Make graphic; plotting libraries are only imported here, since they are slow to load
+    import matplotlib.gridspec as gridspec
+    import matplotlib.pyplot as plt
     fig = plt.figure(figsize=(15, 6))
     grid = gridspec.GridSpec(nrows=1, ncols=2, hspace=0.5, wspace=0.25)
     ax_raw = fig.add_subplot(grid[:,0])
     ax_fract = fig.add_subplot(grid[:,1])
 
-    plot_bars(data, ax_raw, normalize=False, percent=args.percent)
-    plot_bars(data, ax_fract, normalize=True, percent=args.percent)
-
-
-    # Save image
-    fig.savefig(args.outprefix + ".png", dpi=100)
-    fig.savefig(args.outprefix + ".svg", dpi=600)
+    plot_bars(data.copy(), ax_raw, normalize=False, percent=percent)
+    plot_bars(data.copy(), ax_fract, normalize=True, percent=percent)
+    return fig
 
 
 def parse_args():
@@ -69,6 +72,7 @@ def parse_args():
     parser.add_argument("-n", "--num-pcs", type=int, help='Number of PCs to plot')
     parser.add_argument("--percent", default=False, action="store_true", help="Output percent variance explained instead of raw; requires the original QIIME PC file to be passed")
     parser.add_argument("-p", "--pcfile", help="Original QIIME PC file to be passed")
+    profiling.add_arguments(parser)
     parser.add_argument("--debug", default=False, action="store_true")
     args = parser.parse_args()
 
@@ -91,8 +95,8 @@ def plot_bars(data, ax, normalize=False, percent=False):
 
 
     for r in reversed(range(1, len(data.index))):
-        ax.bar(left = xvals, height = data.iloc[r, :], color = colors[r], bottom=bottoms.iloc[r-1,:], label=prettify(data.index[r]))
-    ax.bar(left=xvals, height=data.iloc[0, :], color=colors[0], label=prettify(data.index[0]))
+        ax.bar(x = xvals, height = data.iloc[r, :], color = colors[r], bottom=bottoms.iloc[r-1,:], label=prettify(data.index[r]))
+    ax.bar(x=xvals, height=data.iloc[0, :], color=colors[0], label=prettify(data.index[0]))
 
     legend = ax.legend(framealpha=0.9, fontsize="x-small")
     [t.set_weight('bold') for t in legend.get_texts()]
@@ -1,53 +1,84 @@
 __author__ = 'jgwall'
 
 import argparse
-import math
-import matplotlib
-import matplotlib.gridspec as gridspec
-import matplotlib.pyplot as plt
-import matplotlib.colors as colors
-import matplotlib.patches as patches
+import heatmaps
+import herit_store
 import numpy as np
 import pandas as pd
+import profiling
 import re
+import trait_table
+from figures import save_figure
 
 debug = False
 
 
 def main():
     args = parse_args()
+    profiling.start_from_args(args, __file__)
     if debug: args.infiles=args.infiles[:2]
     print("Summarizing heritabilities from",len(args.infiles),"input files")
 
     # Load data
-    data = [load_herit(i) for i in args.infiles]
-    compiled = dict()
-    for d in data:
-        for trait in d:
-            if trait in compiled:
-                print("WARNING! Trait",trait,"exists twice in the dataset! Only one will be retained")
-            if d[trait]['field'] in args.exclude: 
-                print("\tExcluding",trait)
-                continue
-            compiled[trait] = d[trait]
-    print("\tLoadeed",len(compiled),"traits")
-    
+    with profiling.phase("load"):
+        compiled = load_compiled(args.infiles, args.exclude)
+
+    # Write text output
+    if args.outfile:
+        with profiling.phase("write"):
+            write_summary(compiled, args.outfile)
 
-    # # Write text output
-    # columns=['trait','herit','pval','perm_max','herit_minus_perm_max']
-    # print("Writing text summary to",args.outfile,"\n")
-    # OUT = open(args.outfile, 'w')
-    # OUT.write("\t".join(columns) + "\n")
-    # for trait in sorted(compiled.keys()):
-    #     values = [str(compiled[trait][c]) for c in columns]
-    #     OUT.write("\t".join(values) + "\n")
-    # OUT.close()
-    
-    
     # Make graphical output
-    locations = get_uniques(compiled, 'location')
-    ages = get_uniques(compiled, 'age')
-    pcs = get_uniques(compiled, 'pc')
+    if args.outgraphic:
+        with profiling.phase("render"):
+            fig = plot_summary(compiled, label_boxes=not args.no_label_boxes)
+        save_figure(fig, args.outgraphic)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--infiles", nargs="*")
+    parser.add_argument("-o", "--outfile")
+    parser.add_argument("-g", "--outgraphic", help="Output prefix for graphical output file")
+    parser.add_argument("-x", "--exclude", default=[], nargs="*", help="List of locations to exclude from the plot")
+    parser.add_argument("--no-label-boxes", default=False, action="store_true", help="Skip the background boxes behind heatmap labels (faster)")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+def load_compiled(infiles, exclude=[]):
+    data = [load_herit(i) for i in infiles]
+    compiled = pd.concat(data)
+    for trait in compiled.index[compiled.index.duplicated()]:
+        print("WARNING! Trait",trait,"exists twice in the dataset! Only one will be retained")
+    compiled = compiled[~compiled.index.duplicated(keep='last')]
+    for trait in compiled.index[compiled['field'].isin(exclude)]:
+        print("\tExcluding",trait)
+    compiled = compiled[~compiled['field'].isin(exclude)]
+    print("\tLoaded",len(compiled),"traits")
+    return compiled
+
+
+def write_summary(compiled, outfile):
+    columns=['trait','herit','pval','perm_max','herit_minus_perm_max']
+    print("Writing text summary to",outfile)
+    compiled.sort_index()[columns].to_csv(outfile, sep='\t', index=False)
+
+
+def plot_summary(compiled, label_boxes=True):
+    import matplotlib.gridspec as gridspec  # Plotting libraries are only imported when needed, since they are slow to load
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
+
+    table = trait_table.TraitTable(compiled)
+    locations, ages = table.locations, table.ages
 
     ncol = len(locations)
     nrow = 2
@@ -60,11 +91,11 @@ def main():
         ax_h2 = fig.add_subplot(grid[myrow, mycol], title=loc + " - H2", ylabel="Week")
         ax_pval = fig.add_subplot(grid[myrow+1, mycol], title=loc + " - Empirical p-value", ylabel="Week")
 
-        matrix_h2 = make_data_matrix(compiled, location=loc, key="herit")
-        matrix_pval = make_data_matrix(compiled, location=loc, key="pval")
+        matrix_h2 = table.matrix(loc, key="herit")
+        matrix_pval = table.matrix(loc, key="pval")
 
-        make_heatmap(ax_h2, matrix_h2, nan_value=0)
-        make_heatmap(ax_pval, matrix_pval, nan_value=1, cmap_name="PVALS")
+        make_heatmap(ax_h2, matrix_h2, nan_value=0, label_boxes=label_boxes)
+        make_heatmap(ax_pval, matrix_pval, nan_value=1, cmap_name="PVALS", label_boxes=label_boxes)
 
         # Prettify
         prettify(ax_h2)
@@ -82,114 +113,29 @@ def main():
     patch2 = patches.Patch(color='tomato', label='p ≤ 0.01')
     patch3 = patches.Patch(color='seashell', label='p > 0.01')
     ax.legend(handles=[patch1, patch2, patch3])
-    
-    ## Save
-    fig.savefig(args.outgraphic + ".png", dpi=100)
-    fig.savefig(args.outgraphic + ".svg", dpi=600)
-
+    return fig
 
 
-def parse_args():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-i", "--infiles", nargs="*")
-    parser.add_argument("-o", "--outfile")
-    parser.add_argument("-g", "--outgraphic", help="Output prefix for graphical output file")
-    parser.add_argument("-x", "--exclude", default=[], nargs="*", help="List of locations to exclude from the plot")
-    parser.add_argument("--debug", default=False, action="store_true")
-    args = parser.parse_args()
-
-    # Handle debug flag
-    global debug
-    debug = args.debug
-
-    return parser.parse_args()
-
 def load_herit(infile):
-    # Load data and identify which is the actual H2 value
-    data=pd.read_csv(infile, sep='\t')
-    perms = np.array(data.index)
-    isperm = perms != "actual"
-
-    # Load results into a dictionary for easier handling
-    result=dict()
-    for trait in data.columns:
-        if trait in result:
+    with profiling.phase("load_herit"):
+        # Load data and calculate empirical p-values for all traits at once
+        table=herit_store.open_table(infile)
+        traits = pd.Index(table.traits)
+        for trait in traits[traits.duplicated()]:
             print("\tWARNING! Trait",trait,"in",infile,"occurs more than once!")
-        values = np.array(data[trait])
-        result[trait] = dict()
-        result[trait]["trait"] = trait
-        result[trait]["herit"] = values[~isperm][0] # Index 0 to make it no longer an array
-        result[trait]["perms"] = values[isperm]
-        result[trait]["pval"] = np.sum((result[trait]["herit"] < result[trait]["perms"]) / len(result[trait]["perms"])) # Empirical p-value calculation
-        result[trait]["perm_max"] = np.max(result[trait]["perms"]) # Empirical p-value calculation
-        result[trait]["herit_minus_perm_max"] = result[trait]["herit"] - result[trait]["perm_max"]
-        result[trait]['location'], result[trait]['age'], result[trait]['pc'], result[trait]['field'] = parse_trait_name(trait)
-
-    return result
-
-def parse_trait_name(trait):
-    #pattern='trait_(.+)_otu_table_(.+)_even[^_]+__AGE_([^_]+)___pc_(PC.+)' # For patterns of "trait_unweighted_unifrac_otu_table_Ithaca_even10000__AGE_4___pc_PC1"
-    pattern='trait_(.+)\.week(.+)\.(.+)_(PC.+)'     #for patterns of trait_unweighted.week05.Ithaca_PC2
-    matcher = re.search(string=trait, pattern=pattern)
-    method = matcher.group(1)
-    week=matcher.group(2)
-    location=matcher.group(3)
-    pc=matcher.group(4)
-    
-    name =  method + ":" + location
-    return name, int(week), pc, location    # Return name, age, PC number, and field location
-
-def get_uniques(data, key):
-    myset = {data[trait][key] for trait in data}
-    return sorted(myset)
-
-# Make a data matrix to plot, with weeks in rows and PCs in columns
-def make_data_matrix(data, location, key):
-    # Subset data to just this location
-    subdata=dict()
-    for trait in data:
-        if data[trait]["location"] == location:
-            subdata[trait] = data[trait]
-
-    # Gather data for conversion to data frame
-    tempdata = dict()
-    for trait in subdata:
-        mypc = subdata[trait]["pc"]
-        myweek = subdata[trait]["age"]
-        if mypc not in tempdata:
-            tempdata[mypc] = dict()
-        if myweek in tempdata[mypc]:    # Check that this is new data; should only be one per dataset
-            print("WARNING! Data for location",location,"age",myweek,"and PC",mypc,"has multiple values! Trait:", trait)
-            print("\t",trait,":",key,":",subdata[trait][key],"versus",tempdata[mypc][myweek])
-        tempdata[mypc][myweek] = subdata[trait][key]
-
-    # Make sure all weeks have data
-    weeks = list(range(1,16)) + [20]
-    pcs = ["PC1", "PC2", "PC3", "PC4","PC5"]
-    for week in weeks:
-        for pc in pcs:
-            if pc not in tempdata:
-                tempdata[pc] = dict()
-            if week not in tempdata[pc]:
-                tempdata[pc][week] = np.nan
-    return pd.DataFrame(tempdata)
-
-def make_heatmap(ax, matrix, reverse=False, nan_value=0, cmap_name = "Blues"):
+        result = table.null().summary()     # Works the same for tables stored in summary-only mode
+
+        # Add parsed trait names for easier handling
+        return trait_table.parse_traits(result)
+
+def make_heatmap(ax, matrix, reverse=False, nan_value=0, cmap_name = "Blues", label_boxes=True):
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as colors
     nrow, ncol = matrix.shape
     offset=0.5
 
-    # Place text
-    for r in range(nrow):
-        for c in range(ncol):
-            myval = matrix.iloc[r, c]
-            myval = round(myval, 4)
-            text=str(myval)
-            if text == "nan": text=""
-            ax.text(x=c + offset, y=r + offset, s=text, fontsize="medium", ha="center", verticalalignment='center',
-                    bbox={"color": "white", "alpha": 0.5, "boxstyle": "round"}, zorder=99)
-            # Fix nans so doesn't mess up plotting
-            if np.isnan(myval):
-                matrix.iloc[r, c] = nan_value
+    # Place text (all cells at once)
+    heatmaps.draw_cell_labels(ax, heatmaps.cell_labels(matrix, nan_label=""), boxes=label_boxes)
 
 
     # Make color plot, including various transformations
@@ -204,7 +150,7 @@ def make_heatmap(ax, matrix, reverse=False, nan_value=0, cmap_name = "Blues"):
     #if log_transform:
         #ax.pcolormesh(np.array(np.log(matrix + 0.00001)), cmap=cm, norm = normalize, zorder=20)    # Add a small amount to prevent log(0) errors
     #else:
-    ax.pcolormesh(np.array(matrix), cmap=cm, norm = normalize, zorder=20)
+    ax.pcolormesh(heatmaps.fill_nans(matrix, nan_value), cmap=cm, norm = normalize, zorder=20)   # Fix nans so don't mess up plotting
 
 
 
@@ -1,79 +1,100 @@
 __author__ = 'jgwall'
 
 import argparse
-import biom
+import herit_store
 import math
-import matplotlib.pyplot as plt
 import numpy as np
+import os
 import pandas as pd
+import profiling
 import re
+import taxonomy_index
+import violins
+from figures import save_figure
 
 debug = False
 
 
 def main():
     args = parse_args()
+    profiling.start_from_args(args, __file__)
     print("Plotting heritabilities from", args.infile)
+    cachedir = args.taxonomy_cache if args.taxonomy_cache else os.path.dirname(args.outprefix) or "."
+    with profiling.phase("load"):
+        perms, stats, otu_key = load_heritabilities(args.infile, args.top_n, args.biom, cachedir)
 
+    # Plot
+    if not args.no_graphics:
+        with profiling.phase("render"):
+            fig = plot_figure(perms, stats, otu_key, args.p_cutoff, args.dist_style)
+        save_figure(fig, args.outprefix)
+
+    # Output simple text table
+    with profiling.phase("write"):
+        write_table(perms, stats, otu_key, args.outprefix + ".txt")
+
+
+def load_heritabilities(infile, top_n=None, biomfile=None, cachedir="."):
     # Load and sort data
-    data = pd.read_csv(args.infile, sep='\t')
-    order = np.argsort(data.loc['actual', :])[::-1]
-    data = data.iloc[:, order]
+    table = herit_store.open_table(infile)
+    order = np.argsort(table.actual)[::-1]
 
     # Subset
-    if args.top_n is not None:
-        print("\tSubsetting to just the top", args.top_n, "heritable taxa")
-        data = data.iloc[:, :args.top_n]
+    if top_n is not None:
+        print("\tSubsetting to just the top", top_n, "heritable taxa")
+        order = order[:top_n]
+    perms = table.permutations(order)     # Or their summary, for tables stored in summary-only mode
+    stats = table.null(order).summary(inclusive=True)   # Note that ties count against the actual value here (>=), unlike the PC summaries
+
+    # Load taxonomy names if a biom file was given; otherwise just use the OTU IDs
+    names = otu_names(stats)
+    if biomfile:
+        otu_key = taxonomy_index.resolve_names(biomfile, names, cachedir)
+    else:
+        otu_key = {otu: otu for otu in names}
+    return perms, stats, otu_key
+
+
+def otu_names(stats):
+    return [re.sub(string=trait, pattern="trait_", repl="") for trait in stats['trait']]
+
+
+def write_table(perms, stats, otu_key, outfile):
+    names = otu_names(stats)
+    taxonomy = [otu_key[otu] for otu in names]
+    heritability = pd.DataFrame({"otu":names, "h2":np.array(stats['herit']), "empirical_pval":np.array(stats['pval']),
+                                 "taxonomy_string":taxonomy})
+    heritability = heritability[["otu", "h2", "empirical_pval", "taxonomy_string"]]    # Order
+    heritability = heritability.sort_values('h2', ascending=False)
+    heritability.to_csv(outfile, sep='\t')
 
-    # Load biom data
-    table = biom.load_table(args.biom)
-    ids = table.ids(axis='observation')
-    metadata = table.metadata(axis='observation')
-    taxonomy = [m['taxonomy'] for m in metadata]
-    otu_key = make_otu_key(ids, taxonomy)
 
-    # Plot
-    fig = plt.figure(figsize=(3 + .08 * len(data.columns), 20))
+def plot_figure(perms, stats, otu_key, p_cutoff=0.001, dist_style="violin"):
+    import matplotlib.pyplot as plt     # Plotting libraries are only imported when needed, since they are slow to load
+    fig = plt.figure(figsize=(3 + .08 * len(stats), 20))
     ax_top    = fig.add_axes([0.05, 0.7, 0.92, 0.27], ylabel="Heritability (H$^2$)")   #TODO: Change y-values & figure size
     ax_bottom = fig.add_axes([0.05, 0.2, 0.92, 0.27], ylabel="Heritability (H$^2$)")
 
     #PLot
-    split = math.ceil(len(data.columns)/2)
-    plot_herits(ax_top, data.iloc[:, :split], args, otu_key)
-    plot_herits(ax_bottom, data.iloc[:, split:], args, otu_key)
+    split = math.ceil(len(stats)/2)
+    top, bottom = np.arange(split), np.arange(split, len(stats))
+    plot_herits(ax_top, take_traits(perms, top), stats.iloc[top], otu_key, p_cutoff, dist_style)
+    plot_herits(ax_bottom, take_traits(perms, bottom), stats.iloc[bottom], otu_key, p_cutoff, dist_style)
+    return fig
 
-    # Save
-    fig.savefig(args.outprefix + ".png", dpi=100)
-    fig.savefig(args.outprefix + ".svg", dpi=600)
-
-    # Output simple text table
-    names, h2, pvals, taxonomy = list(), list(), list(), list()
-    is_actual = data.index=="actual"
-    is_perm = ~is_actual
-    for trait in data.columns:
-        otu = re.sub(string=trait, pattern="trait_", repl="")
-        names.append(otu)
-        h2.append(data[trait].loc[is_actual][0])
-        taxonomy.append(otu_key[otu])
-        
-        # Empirical p-value
-        perms = np.array(data[trait].loc[is_perm])
-        actual = data[trait].loc[is_actual][0]
-        pvals.append(np.sum(perms >= actual)/len(perms))
-        
-
-    heritability = pd.DataFrame({"otu":names, "h2":h2, "empirical_pval":pvals, "taxonomy_string":taxonomy})
-    heritability = heritability[["otu", "h2", "empirical_pval", "taxonomy_string"]]    # Order
-    heritability = heritability.sort('h2', ascending=False)
-    heritability.to_csv(args.outprefix + ".txt", sep='\t')
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--infile")
     parser.add_argument("-o", "--outprefix")
     parser.add_argument("-b", "--biom", help="Biom file with taxonomic data for each OTU")
+    parser.add_argument("--taxonomy-cache", help="Directory for cached taxonomy names (default: same directory as the output)")
     parser.add_argument("-p", "--p-cutoff", type=float, default=0.001)
     parser.add_argument("-n", "--top-n", type=int, help="Only plot the top n heritable OTUs")
+    parser.add_argument("-s", "--dist-style", choices=["violin", "box"], default="violin",
+                        help="How to draw the permutation distributions ('box' = quartile boxes, for plots with very many OTUs)")
+    parser.add_argument("--no-graphics", default=False, action="store_true", help="Only write the text table of heritabilities")
+    profiling.add_arguments(parser)
     parser.add_argument("--debug", default=False, action="store_true")
     args = parser.parse_args()
 
@@ -84,30 +105,25 @@ def parse_args():
     return parser.parse_args()
 
 
-def plot_herits(ax, data, args, otu_key):
+# Permutations of some traits (by position), whether a DataFrame or a summary-only sketch
+def take_traits(perms, columns):
+    return perms.iloc[:, columns] if isinstance(perms, pd.DataFrame) else perms.subset(columns)
+
+
+def plot_herits(ax, perms, stats, otu_key, p_cutoff=0.001, dist_style="violin"):
     # Set up data structure to hold things for convenient output
 
-    # Violin plots of random permutations
-    perms = data.index != "actual"
-    xticks, xlabels = list(), list()
-    violins = list()
-    for x in range(len(data.columns)):
-        trait = data.columns[x]
-        xticks.append(x)
-        tmp_violin = ax.violinplot(data.loc[perms, trait], positions=[x])
-        violins.append(tmp_violin)
-        new_label = otu_key[trait.replace("trait_", "")]
-        xlabels.append(new_label)
+    # Violin plots of random permutations, all drawn at once (NAs = permutations skipped in adaptive mode)
+    xticks = list(range(len(stats)))
+    xlabels = [otu_key[otu] for otu in otu_names(stats)]
+    violincolor = 'darkblue'
+    violins.draw_distributions(ax, perms, xticks, style=dist_style, color=violincolor, alpha=0.5,
+                               bar_width=0.25, show_mins=False)
 
     # Add dots for actual heritabilities
-    actuals = np.array(data.loc['actual', :])
-    perms = np.array(data.iloc[1:, :])
-    pvals = [np.nan] * len(actuals)
-    for i in range(len(actuals)):
-        pvals[i] = np.sum(perms[:, i] >= actuals[i]) / len(perms)
-    colors = np.array(['red' if p <= args.p_cutoff else 'darkgray' for p in pvals])
-    print("\t", sum(colors == 'red'), "out of", len(colors), "p-values are significant at <=", args.p_cutoff)
-    ax.scatter(xticks, data.loc['actual', :], s=80, c=colors, zorder=99)
+    colors = np.array(['red' if p <= p_cutoff else 'darkgray' for p in stats['pval']])
+    print("\t", sum(colors == 'red'), "out of", len(colors), "p-values are significant at <=", p_cutoff)
+    ax.scatter(xticks, stats['herit'], s=80, c=colors, zorder=99)
 
     # Prettify tick labels and axis labels
     ax.set_xticks(xticks)
@@ -116,18 +132,6 @@ def plot_herits(ax, data, args, otu_key):
     ax.tick_params(left='on', top='off', right='off', bottom='on')
     ax.set_ylabel(ax.get_ylabel(), fontsize='x-large', weight='bold')
 
-    # Change violin colors
-    violincolor = 'darkblue'
-    for v in violins:
-        for body in v['bodies']:  # Violin body
-            body.set_facecolor(violincolor)
-            body.set_linewidth(0)
-            body.set_alpha(0.5)
-        v['cbars'].set_color(violincolor)
-        v['cbars'].set_linewidth(0.25)
-        v['cmaxes'].set_color(violincolor)
-        v['cmins'].set_visible(False)
-
     # Axis limts
     pad = 2
     ax.set_xlim(min(xticks) - pad, max(xticks) + pad)
@@ -136,50 +140,10 @@ def plot_herits(ax, data, args, otu_key):
     ax.set_ylim(ylim)
 
     # Custom legend
-    red_dots = ax.scatter([], [], color='red', label='Significant at p ≤ ' + str(args.p_cutoff))
+    red_dots = ax.scatter([], [], color='red', label='Significant at p ≤ ' + str(p_cutoff))
     gray_dots = ax.scatter([], [], color='gray', label='Not significant')
     ax.legend(handles=[red_dots, gray_dots], scatterpoints=1, markerscale=3, frameon=False,
               prop={'size': 'medium', 'weight': 'bold'})
 
 
-def make_otu_key(ids, taxonomy):
-    key = dict()
-    for id, lineage in zip(ids, taxonomy):
-        # print(id,"\n\t",lineage)
-        myname = "UNKNOWN"
-        clades = [re.sub("^.__", string=l, repl="") for l in lineage]
-        # If not assigned
-        if clades[0] == 'Unassigned':
-            key[id] = "Unassigned"
-            continue
-        # If have genus and species, use
-        if (len(clades) > 1) and (clades[-1] != "") and (clades[-2] != ""):
-            myname = clades[-2] + " " + clades[-1]
-            key[id] = myname
-            continue
-        # Otherwise, take last level
-        for i in range(1, len(clades) + 1):
-            if clades[-i] == "": continue
-            level = find_level(lineage[-i])
-            if level == 'genus':
-                myname = clades[-i] + " sp."
-            else:
-                myname = "Unnamed " + level + " " + clades[-i]
-            break  # Break so take the last available one
-        key[id] = myname
-        # print("\t", myname)
-    return key
-
-
-def find_level(clade):
-    if clade.startswith("k__"): return "kingdom"
-    if clade.startswith("p__"): return "phylum"
-    if clade.startswith("c__"): return "class"
-    if clade.startswith("o__"): return "order"
-    if clade.startswith("f__"): return "family"
-    if clade.startswith("g__"): return "genus"
-    if clade.startswith("s__"): return "species"
-    return "unkown_level"
-
-
-if __name__ == '__main__': main()
\ No newline at end of file
+if __name__ == '__main__': main()
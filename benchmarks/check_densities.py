@@ -0,0 +1,72 @@
+__author__ = 'jgwall'
+
+# Check the batched violin densities (violins.column_densities) against scipy's gaussian_kde, which is what
+# ax.violinplot() uses, one column at a time. The synthetic null distributions deliberately have very different ranges
+# (eg, a trait whose permutations all fall in [0, 0.01] next to ones spanning [0, 0.9]), plus skewed and mostly-zero
+# ones like those of real heritabilities. Since violins are scaled so their widest point is a fixed width, shapes are
+# compared after scaling each to a maximum of 1; the script exits with an error if any column differs by more than
+# --tolerance.
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))     # Pipeline modules are in the parent directory
+import violins
+
+debug = False
+
+
+def main():
+    args = parse_args()
+    from scipy.stats import gaussian_kde
+    values = mixed_range_nulls(args.perms, np.random.default_rng(args.seed))
+    grid, densities = violins.column_densities(values)
+
+    print("column\tmin\tmax\tmax_difference")
+    worst = 0
+    for j, name in enumerate(values_names):
+        column = values[:, j]
+        column = column[np.isfinite(column)]
+        expected = gaussian_kde(column)(grid[:, j])
+        difference = np.max(np.abs(densities[:, j] / np.max(densities[:, j]) - expected / np.max(expected)))
+        print("\t".join([name, "{:.4g}".format(np.min(column)), "{:.4g}".format(np.max(column)), "{:.2e}".format(difference)]))
+        worst = max(worst, difference)
+    if worst > args.tolerance:
+        sys.exit("ERROR! Densities differ from gaussian_kde by up to " + "{:.2e}".format(worst) + " (tolerance " + str(args.tolerance) + ")")
+    print("All columns within", args.tolerance, "of gaussian_kde")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--perms", type=int, default=1000, help="Number of permutations (values) per column")
+    parser.add_argument("-t", "--tolerance", type=float, default=1e-3, help="Largest difference allowed between scaled densities")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+values_names = ["narrow", "wide", "skewed", "mostly_zero", "shifted", "with_nans"]
+
+
+# One column per kind of null distribution in values_names
+def mixed_range_nulls(n_perms, rng):
+    values = np.column_stack([rng.uniform(0, 0.01, n_perms),
+                              rng.uniform(0, 0.9, n_perms),
+                              rng.beta(1, 8, n_perms),
+                              np.where(rng.random(n_perms) < 0.7, 0, rng.beta(2, 20, n_perms)),
+                              rng.normal(0.5, 0.02, n_perms),
+                              rng.beta(2, 5, n_perms)])
+    values[rng.random(n_perms) < 0.2, -1] = np.nan     # Eg, permutations skipped in adaptive mode
+    return values
+
+
+if __name__ == '__main__': main()
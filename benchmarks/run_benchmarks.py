@@ -0,0 +1,253 @@
+__author__ = 'jgwall'
+
+# Time and memory-profile the pipeline's Python loaders and plots on synthetic data (see synthetic_data.py), sweeping
+# the number of traits, samples and permutations one at a time to show how each step scales. Each benchmark only sweeps
+# the sizes it depends on; the others stay at their smallest value. Time is the median (and minimum) wall time of
+# --reps runs; peak memory is from a separate run under tracemalloc (which also sees numpy's allocations), since tracing
+# slows things down. Results are printed as a table, and can be compared between commits to catch scaling regressions.
+
+import argparse
+import contextlib
+import importlib
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))     # Pipeline modules are in the parent directory
+import figures
+import herit_stats
+import herit_store
+import oneway_herit
+import qiime_pcs
+import synthetic_data
+import taxonomy_index
+import trait_table
+
+debug = False
+
+axes = ["traits", "samples", "perms"]
+
+
+def main():
+    args = parse_args()
+    import matplotlib
+    matplotlib.use("Agg")
+    workdir = args.workdir if args.workdir else tempfile.mkdtemp(prefix="herit_bench.")
+    if not os.path.exists(workdir): os.makedirs(workdir)
+    names = [b for b in benchmarks if not args.only or any(o in b for o in args.only)]
+    sweeps = {"traits": args.traits, "samples": args.samples, "perms": args.perms}
+
+    OUT = open(args.outfile, "w") if args.outfile else sys.stdout
+    OUT.write("\t".join(["benchmark"] + axes + ["median_sec", "min_sec", "peak_mb"]) + "\n")
+    for name in names:
+        setup, scales = benchmarks[name]
+        for sizes in sweep_points(sweeps, scales):
+            print("Running", name, "with", sizes, file=sys.stderr)
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                run = setup(workdir, np.random.default_rng(args.seed), **sizes)
+            times, peak = measure(run, args.reps)
+            OUT.write("\t".join([name] + [str(sizes[a]) for a in axes] + ["{:.4f}".format(statistics.median(times)),
+                                 "{:.4f}".format(min(times)), "{:.1f}".format(peak / 2 ** 20)]) + "\n")
+            OUT.flush()
+    if OUT is not sys.stdout: OUT.close()
+    if not args.workdir: shutil.rmtree(workdir)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", "--traits", type=int, nargs="*", default=[100, 400, 1600], help="Numbers of traits (OTUs or PC traits) to try")
+    parser.add_argument("-s", "--samples", type=int, nargs="*", default=[100, 400, 1600], help="Numbers of samples to try")
+    parser.add_argument("-p", "--perms", type=int, nargs="*", default=[100, 1000, 10000], help="Numbers of permutations to try")
+    parser.add_argument("--only", nargs="*", help="Only run benchmarks whose names contain one of these strings")
+    parser.add_argument("-r", "--reps", type=int, default=3, help="Number of timed runs at each size")
+    parser.add_argument("-o", "--outfile", help="File to write results to (default: standard output)")
+    parser.add_argument("-w", "--workdir", help="Directory for synthetic inputs and plot outputs (default: a temporary directory, removed afterwards)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+# Sizes to run a benchmark at: each axis it scales with is swept in turn, with everything else at its smallest value
+def sweep_points(sweeps, scales):
+    base = {a: min(sweeps[a]) for a in axes}
+    points = [base]
+    for axis in scales:
+        points += [dict(base, **{axis: value}) for value in sorted(sweeps[axis]) if value != base[axis]]
+    return points
+
+
+# Wall times of each rep, then peak traced memory (bytes) of one more run. Output printed by the pipeline code is hidden
+def measure(run, reps):
+    import matplotlib.pyplot as plt
+    times = list()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        for i in range(reps):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+            plt.close("all")
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        plt.close("all")
+    return times, peak
+
+
+# Script names start with numbers, so have to be imported this way
+def load_script(script):
+    return importlib.import_module(script)
+
+
+# Inputs for the benchmarks. Each setup function writes whatever files it needs to workdir and returns the call to time
+
+def write_pcs(workdir, rng, traits, samples):
+    pcfile = os.path.join(workdir, "pcoa_distances.bench." + str(samples) + "x" + str(traits) + ".txt")
+    ids = ["S" + str(i) for i in range(samples)]
+    qiime_pcs.write_pc_file(synthetic_data.make_pcs(ids, traits, rng), pcfile)
+    return pcfile
+
+
+def write_pc_herits(workdir, rng, traits, perms):
+    heritfile = os.path.join(workdir, "1f_bench." + str(traits) + "x" + str(perms) + ".heritabilities.txt")
+    oneway_herit.write_herit_table(synthetic_data.make_herits(synthetic_data.pc_traits("weighted", traits), perms, rng), heritfile)
+    return heritfile
+
+
+def write_otu_herits(workdir, rng, traits, perms):
+    heritfile = os.path.join(workdir, "1b_bench." + str(traits) + "x" + str(perms) + ".txt")
+    traits = ["trait_" + o for o in synthetic_data.otu_ids(traits)]
+    oneway_herit.write_herit_table(synthetic_data.make_herits(traits, perms, rng), heritfile)
+    return heritfile
+
+
+# The same as a summary-only table: just the actual row, plus a sketch of the permutations
+def write_herit_sketch(heritfile):
+    data = herit_store.open_table(heritfile).frame()
+    sketchfile = heritfile.replace(".txt", ".summary_only.txt")
+    oneway_herit.write_herit_table(data.loc[["actual"], :], sketchfile)
+    sketch = herit_stats.PermutationSketch(data.columns, data.loc["actual", :])
+    sketch.update(data.loc[data.index != "actual", :])
+    herit_store.write_sketch(sketchfile, sketch)
+    return sketchfile
+
+
+def setup_load_pcs(workdir, rng, traits, samples, perms):
+    pcfile = write_pcs(workdir, rng, traits, samples)
+    convert = load_script("1c_ConvertQiimePcsToFakeBiomFile")
+    return lambda: convert.load_pcs([pcfile], traits, "bench")
+
+
+def setup_output_fake_biom(workdir, rng, traits, samples, perms):
+    convert = load_script("1c_ConvertQiimePcsToFakeBiomFile")
+    pcs = convert.load_pcs([write_pcs(workdir, rng, traits, samples)], traits, "bench")
+    return lambda: convert.output_fake_biom(pcs, os.path.join(workdir, "bench.biom.txt"))
+
+
+def setup_load_herit(workdir, rng, traits, samples, perms):
+    heritfile = write_pc_herits(workdir, rng, traits, perms)
+    summarize = load_script("1d_SummarizePcHeritabilities")
+    return lambda: summarize.load_herit(heritfile)
+
+
+def setup_load_herit_summary(workdir, rng, traits, samples, perms):
+    heritfile = write_herit_sketch(write_pc_herits(workdir, rng, traits, perms))
+    summarize = load_script("1d_SummarizePcHeritabilities")
+    return lambda: summarize.load_herit(heritfile)
+
+
+# What used to be make_data_matrix() in 1d/3b: the week x PC matrices of heritabilities and p-values for every location
+def setup_make_data_matrix(workdir, rng, traits, samples, perms):
+    compiled = load_script("1d_SummarizePcHeritabilities").load_herit(write_pc_herits(workdir, rng, traits, perms))
+    def run():
+        table = trait_table.TraitTable(compiled)
+        for location in table.locations:
+            table.matrix(location, key="herit")
+            table.matrix(location, key="pval")
+    return run
+
+
+def setup_make_otu_key(workdir, rng, traits, samples, perms):
+    ids = synthetic_data.otu_ids(traits)
+    lineages = [synthetic_data.make_lineage(rng) for i in ids]
+    return lambda: taxonomy_index.make_otu_key(ids, lineages)
+
+
+# The PC files have 5 PCs in the pipeline, so this only scales with samples
+def setup_plot_pc_distributions(workdir, rng, traits, samples, perms):
+    convert = load_script("1c_ConvertQiimePcsToFakeBiomFile")
+    pcs = convert.load_pcs([write_pcs(workdir, rng, 5, samples)], 5, "bench")
+    return lambda: convert.output_pheno_distributions(pcs, os.path.join(workdir, "1c_bench.png"))
+
+
+def setup_plot_heritabilities(workdir, rng, traits, samples, perms):
+    data = herit_store.open_table(write_otu_herits(workdir, rng, traits, perms)).frame()
+    plot = load_script("1b_PlotHeritabilities")
+    return lambda: plot.plot_heritabilities(data.loc["actual", :], data.loc[data.index != "actual", :], os.path.join(workdir, "1b_bench.png"))
+
+
+def setup_plot_pc_summary(workdir, rng, traits, samples, perms):
+    summarize = load_script("1d_SummarizePcHeritabilities")
+    compiled = summarize.load_herit(write_pc_herits(workdir, rng, traits, perms))
+    return lambda: summarize.plot_summary(compiled, os.path.join(workdir, "1d_bench.png"))
+
+
+# Traits = number of PCs in the sum of squares table
+def setup_plot_sum_squares(workdir, rng, traits, samples, perms):
+    script = load_script("3a_PlotSumSquaresPretty")
+    ssfile = os.path.join(workdir, "2a_bench.sum_squares.txt")
+    synthetic_data.write_sum_squares(synthetic_data.make_sum_squares(traits, rng), ssfile)
+    data = script.load_sum_squares(ssfile, percent=True, pcfile=write_pcs(workdir, rng, traits, 10))
+    return lambda: figures.save_figure(script.plot_sum_squares(data, percent=True), os.path.join(workdir, "3a_bench"), ["png"])
+
+
+def setup_plot_pc_heritabilities(workdir, rng, traits, samples, perms):
+    script = load_script("3b_SummarizePcHeritabilities_pretty")
+    compiled = script.load_compiled([write_pc_herits(workdir, rng, traits, perms)], exclude=["Columbia", "Urbana"])
+    return lambda: figures.save_figure(script.plot_summary(compiled), os.path.join(workdir, "3b_bench"), ["png"])
+
+
+def setup_plot_otu_heritabilities(workdir, rng, traits, samples, perms):
+    script = load_script("3c_PlotOtuHeritabilities_two_column")
+    perms, stats, otu_key = script.load_heritabilities(write_otu_herits(workdir, rng, traits, perms))
+    return lambda: figures.save_figure(script.plot_figure(perms, stats, otu_key), os.path.join(workdir, "3c_bench"), ["png"])
+
+
+# Loading and plotting together, since the point of summary-only tables is that loading doesn't scale with permutations
+def setup_otu_figure_summary(workdir, rng, traits, samples, perms):
+    script = load_script("3c_PlotOtuHeritabilities_two_column")
+    heritfile = write_herit_sketch(write_otu_herits(workdir, rng, traits, perms))
+    return lambda: figures.save_figure(script.plot_figure(*script.load_heritabilities(heritfile)), os.path.join(workdir, "3c_bench"), ["png"])
+
+
+# Name: (setup function, axes it scales with)
+benchmarks = {
+    "load_pcs": (setup_load_pcs, ["traits", "samples"]),
+    "output_fake_biom": (setup_output_fake_biom, ["traits", "samples"]),
+    "load_herit": (setup_load_herit, ["traits", "perms"]),
+    "load_herit.summary_only": (setup_load_herit_summary, ["traits", "perms"]),
+    "make_data_matrix": (setup_make_data_matrix, ["traits"]),
+    "make_otu_key": (setup_make_otu_key, ["traits"]),
+    "plot.1c_pc_distributions": (setup_plot_pc_distributions, ["samples"]),
+    "plot.1b_heritabilities": (setup_plot_heritabilities, ["traits", "perms"]),
+    "plot.1d_pc_summary": (setup_plot_pc_summary, ["traits"]),
+    "plot.3a_sum_squares": (setup_plot_sum_squares, ["traits"]),
+    "plot.3b_pc_heritabilities": (setup_plot_pc_heritabilities, ["traits"]),
+    "plot.3c_otu_heritabilities": (setup_plot_otu_heritabilities, ["traits", "perms"]),
+    "plot.3c_otu_heritabilities.summary_only": (setup_otu_figure_summary, ["traits", "perms"]),
+}
+
+
+if __name__ == '__main__': main()
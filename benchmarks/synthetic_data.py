@@ -0,0 +1,150 @@
+__author__ = 'jgwall'
+
+# Synthetic inputs shaped like the real ones, for benchmarks (the real data isn't in git). Makes a QIIME mapping file,
+# QIIME PC files, heritability tables (an "actual" row plus N permutation rows) for OTUs and for week/location PCs, a
+# sum-of-squares table as 2_QuantifyVarianceComponents.py writes it, and a JSON BIOM table with taxonomy metadata. Values
+# are random but everything parses the same way the real files do, so the pipeline's loaders and plots can run on it.
+
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))     # Pipeline modules are in the parent directory
+import oneway_herit
+import qiime_pcs
+import variance_components
+
+debug = False
+
+locations = ["Aurora", "Ithaca", "Columbia", "Urbana", "Lansing"]
+inbreds = ["B73", "Mo17", "W22", "Oh43", "CML247", "Ki3", "Tx303", "P39", "Il14H", "Hp301"]
+ranks = ["k", "p", "c", "o", "f", "g", "s"]
+
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.outdir): os.makedirs(args.outdir)
+    print("Writing synthetic data with", args.samples, "samples,", args.otus, "OTUs and", args.perms, "permutations to", args.outdir)
+    rng = np.random.default_rng(args.seed)
+    key = make_key(args.samples, rng)
+    write_key(key, os.path.join(args.outdir, "mapping_with_abundance.txt"))
+    write_biom(make_biom(key.index, args.otus, rng), os.path.join(args.outdir, "otu_table_80percShared_relAbundance.biom"))
+    for set in ["weighted", "unweighted"]:
+        qiime_pcs.write_pc_file(make_pcs(key.index, args.pcs, rng), os.path.join(args.outdir, set + "_unifrac_pc.txt"))
+        write_sum_squares(make_sum_squares(args.pcs, rng), os.path.join(args.outdir, "2a_" + set + "_pcs.sum_squares.txt"))
+        oneway_herit.write_herit_table(make_herits(pc_traits(set, args.pc_traits), args.perms, rng),
+                                       os.path.join(args.outdir, "1f_" + set + ".heritabilities.txt"))
+    oneway_herit.write_herit_table(make_herits(["trait_" + o for o in otu_ids(args.otus)], args.perms, rng),
+                                   os.path.join(args.outdir, "1b_otu_heritabilities.combined.txt"))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--outdir", help="Directory to write the synthetic files to")
+    parser.add_argument("-s", "--samples", type=int, default=500, help="Number of samples")
+    parser.add_argument("-t", "--otus", type=int, default=1000, help="Number of OTUs (= traits in the OTU heritability table)")
+    parser.add_argument("-n", "--pcs", type=int, default=20, help="Number of principal coordinates in each PC file")
+    parser.add_argument("-c", "--pc-traits", type=int, default=160, help="Number of traits in the week/location PC heritability tables")
+    parser.add_argument("-p", "--perms", type=int, default=1000, help="Number of permutation rows in heritability tables")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+# QIIME mapping file: each sample gets a location, week and inbred, plus a sequence count
+def make_key(n_samples, rng):
+    ages = rng.choice(list(range(1, 16)) + [20], size=n_samples)
+    key = pd.DataFrame({"ENV": rng.choice(locations[:2], size=n_samples),
+                        "AGE": ages,
+                        "INBREDS": rng.choice(inbreds, size=n_samples),
+                        "Seq_Count_80Perc": rng.integers(1000, 50000, size=n_samples),
+                        "AGE_fixed": ["week" + str(a).zfill(2) for a in ages]},
+                       index=["S" + str(i) for i in range(n_samples)])
+    key.index.name = "#SampleID"
+    return key
+
+
+def write_key(key, outfile):
+    key.to_csv(outfile, sep='\t')
+
+
+# Principal coordinates with decreasing eigenvalues, like QIIME's output
+def make_pcs(ids, n_pcs, rng):
+    eigvals = np.sort(rng.exponential(1, size=n_pcs))[::-1]
+    coords = rng.normal(size=(len(ids), n_pcs)) * np.sqrt(eigvals)
+    return qiime_pcs.PcFile(np.array(ids), coords, eigvals, eigvals / (np.sum(eigvals) * 1.5))
+
+
+def otu_ids(n_otus):
+    return ["otu" + str(i) for i in range(n_otus)]
+
+
+# Full Greengenes-style lineages, with some left unassigned below a random rank
+def make_lineage(rng):
+    if rng.random() < 0.02: return ["Unassigned"]
+    depth = rng.integers(2, len(ranks) + 1)
+    return [r + "__" + (r.upper() + str(rng.integers(20)) if i < depth else "") for i, r in enumerate(ranks)]
+
+
+# Sparse relative abundances (about 10% non-zero) with taxonomy metadata, as a BIOM 1.0 (JSON) table
+def make_biom(samples, n_otus, rng):
+    otus = otu_ids(n_otus)
+    nonzero = rng.random((n_otus, len(samples))) < 0.1
+    rows, cols = np.nonzero(nonzero)
+    values = rng.exponential(0.01, size=len(rows))
+    return {"id": "synthetic", "format": "Biological Observation Matrix 1.0.0", "type": "OTU table", "matrix_type": "sparse",
+            "shape": [n_otus, len(samples)],
+            "rows": [{"id": otu, "metadata": {"taxonomy": make_lineage(rng)}} for otu in otus],
+            "columns": [{"id": s, "metadata": None} for s in samples],
+            "data": [[int(r), int(c), float(v)] for r, c, v in zip(rows, cols, values)]}
+
+
+def write_biom(table, outfile):
+    OUT = open(outfile, "w")
+    json.dump(table, OUT)
+    OUT.close()
+
+
+# Names for n per-week/location PC heritabilities (eg, trait_weighted.week05.Ithaca_PC2). The real data has 5 PCs for
+# each of 16 weeks at a few locations; larger n adds more locations.
+def pc_traits(set, n_traits):
+    weeks = ["week" + str(w).zfill(2) for w in list(range(1, 16)) + [20]]
+    traits = list()
+    for i in range(n_traits):
+        split, pc = divmod(i, 5)
+        location, week = divmod(split, len(weeks))
+        name = locations[location] if location < len(locations) else "Field" + str(location)
+        traits.append("trait_" + set + "." + weeks[week] + "." + name + "_PC" + str(pc + 1))
+    return traits
+
+
+# Heritabilities between 0 and 1: permutations from a beta distribution, actual values sometimes well above them
+def make_herits(traits, n_perms, rng):
+    perms = rng.beta(1, 8, size=(n_perms, len(traits)))
+    actual = np.where(rng.random(len(traits)) < 0.2, rng.uniform(0.2, 0.9, size=len(traits)), rng.beta(1, 8, size=len(traits)))
+    return oneway_herit.make_herit_table(traits, actual, perms)
+
+
+def make_sum_squares(n_pcs, rng):
+    terms = variance_components.terms + ["Residuals"]
+    return pd.DataFrame(rng.exponential(1, size=(len(terms), n_pcs)), index=terms, columns=["pc" + str(i) for i in range(1, n_pcs + 1)])
+
+
+# Same layout as 2_QuantifyVarianceComponents.py's output (no header entry for the row names)
+def write_sum_squares(ss, outfile):
+    OUT = open(outfile, "w")
+    OUT.write("\t".join(ss.columns) + "\n")
+    ss.to_csv(OUT, sep='\t', header=False)
+    OUT.close()
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,120 @@
+__author__ = 'jgwall'
+
+# Load BIOM tables straight into a sparse OTU x sample matrix, instead of going through "biom convert --to-tsv" and
+# reading a dense text file. Handles both HDF5 (BIOM 2.x) and JSON (BIOM 1.0) tables; h5py is only needed for HDF5.
+# The log transform matches 1a_BroadSenseHeritability.r: zeros in each sample become one tenth of that sample's smallest
+# non-zero value, then everything is logged. Since the fill value is the same for every zero in a sample, the
+# transformed matrix never has to exist in full; it is written out one OTU at a time.
+
+import json
+import numpy as np
+import pandas as pd
+import rawdata
+from scipy import sparse
+
+hdf5_magic = b"\x89HDF"
+
+
+class BiomTable:
+
+    def __init__(self, otus, samples, matrix):
+        self.otus = otus        # Observation (OTU) IDs, one per row
+        self.samples = samples  # Sample IDs, one per column
+        self.matrix = matrix    # scipy CSR matrix, OTUs x samples
+
+    # Keep only the OTUs in the given list (in their original order), like the R script's --subset
+    def subset(self, otus):
+        keep = np.flatnonzero(np.isin(self.otus, list(otus)))
+        return BiomTable(self.otus[keep], self.samples, self.matrix[keep, :])
+
+    # Per-sample value that zeros get replaced with before logging (inf for samples with no non-zero values, as in R)
+    def zero_fill(self):
+        mins = np.full(len(self.samples), np.inf)
+        nonzero = self.matrix.data != 0
+        np.minimum.at(mins, self.matrix.indices[nonzero], self.matrix.data[nonzero])
+        return mins / 10
+
+    # Iterate over (OTU, log-transformed values across samples), densifying one row at a time
+    def log_rows(self):
+        log_fill = np.log(self.zero_fill())
+        indptr, indices, data = self.matrix.indptr, self.matrix.indices, self.matrix.data
+        for i, otu in enumerate(self.otus):
+            row = log_fill.copy()
+            start, end = indptr[i], indptr[i + 1]
+            nonzero = data[start:end] != 0
+            row[indices[start:end][nonzero]] = np.log(data[start:end][nonzero])
+            yield otu, row
+
+    # Full log-transformed matrix as a DataFrame of OTUs x samples, for analyzing in-process
+    def log_frame(self):
+        values = np.empty(self.matrix.shape)
+        for i, (otu, row) in enumerate(self.log_rows()):
+            values[i, :] = row
+        return pd.DataFrame(values, index=self.otus, columns=self.samples)
+
+
+def load_biom(infile):
+    return load_hdf5(infile) if is_hdf5(infile) else load_json(infile)
+
+
+def is_hdf5(infile):
+    IN = rawdata.open_raw(infile, "rb", verify=False)
+    magic = IN.read(len(hdf5_magic))
+    IN.close()
+    return magic == hdf5_magic
+
+
+# BIOM 2.x stores the table compressed by observation (CSR) under observation/matrix
+def load_hdf5(infile):
+    import h5py
+    with h5py.File(rawdata.read_raw(infile), "r") as h5:
+        otus = np.array([decode(i) for i in h5["observation/ids"][:]])
+        samples = np.array([decode(i) for i in h5["sample/ids"][:]])
+        group = h5["observation/matrix"]
+        matrix = sparse.csr_matrix((group["data"][:], group["indices"][:], group["indptr"][:]), shape=(len(otus), len(samples)))
+    return BiomTable(otus, samples, matrix)
+
+
+# BIOM 1.0 is JSON, with either sparse [row, column, value] triplets or a dense list of rows
+def load_json(infile):
+    IN = rawdata.open_raw(infile)
+    table = json.load(IN)
+    IN.close()
+    otus = np.array([r["id"] for r in table["rows"]])
+    samples = np.array([c["id"] for c in table["columns"]])
+    if table["matrix_type"] == "sparse":
+        triplets = np.array(table["data"], dtype=float).reshape(-1, 3)
+        matrix = sparse.csr_matrix((triplets[:, 2], (triplets[:, 0].astype(int), triplets[:, 1].astype(int))),
+                                   shape=(len(otus), len(samples)))
+    else:
+        matrix = sparse.csr_matrix(np.array(table["data"], dtype=float))
+    return BiomTable(otus, samples, matrix)
+
+
+def decode(x):
+    return x.decode("utf-8") if isinstance(x, bytes) else str(x)
+
+
+# One OTU ID per whitespace-separated token, as R's scan() reads them
+def read_subset(infile):
+    IN = open(infile, "r")
+    otus = IN.read().split()
+    IN.close()
+    return otus
+
+
+# Write the transformed table in the BIOM text format that 1a_BroadSenseHeritability.r writes with --write-transformed
+# (a comment line, then "#OTU ID" and the sample names, then one row per OTU)
+def write_transformed(table, outfile):
+    OUT = open(outfile, "w")
+    OUT.write("# Transformed from biom file\n")
+    OUT.write("\t".join(["#OTU ID"] + list(table.samples)) + "\n")
+    for otu, row in table.log_rows():
+        OUT.write(otu + "\t" + "\t".join(format_value(v) for v in row) + "\n")
+    OUT.close()
+
+
+# Numbers the way R's write.table prints them (15 significant digits, Inf/-Inf for infinities)
+def format_value(v):
+    if np.isinf(v): return "Inf" if v > 0 else "-Inf"
+    return "%.15g" % v
@@ -0,0 +1,121 @@
+__author__ = 'jgwall'
+
+# Binary store for square distance matrices (eg, QIIME's *_unifrac_dm.txt). For a prefix "X" the store is:
+#   X.bin - float64 n x n matrix, row-major
+#   X.ids - sample IDs, one per line; written last, so it marks a complete store
+# The text matrix is parsed once, a row at a time, and after that any subset of samples (eg, one week x location split)
+# is pulled out by integer index straight from the memory-mapped matrix, with no text round trip.
+
+import numpy as np
+import os
+import rawdata
+
+dtype = np.float64
+
+
+# Stores go in the output directory rather than next to the input, which may be in 0_RawData/ (or only in its archive)
+def store_prefix(infile, outdir=""):
+    name = os.path.basename(infile)
+    return os.path.join(outdir, (name[:-len(".txt")] if name.endswith(".txt") else name) + ".dm")
+
+
+# Check that a complete store exists and, if given its text matrix, that it is at least as new as it (or as the archive
+# the matrix is read from)
+def has_store(prefix, infile=None):
+    if not (os.path.exists(prefix + ".bin") and os.path.exists(prefix + ".ids")):
+        return False
+    if infile and os.path.getmtime(prefix + ".ids") < os.path.getmtime(rawdata.locate(infile)[0]):
+        return False
+    return True
+
+
+# Convert a tab-delimited square distance matrix (header of sample IDs, then one row per sample) to a store
+def convert_text(infile, prefix):
+    IN = rawdata.open_raw(infile)
+    ids = IN.readline().rstrip("\n").split("\t")[1:]
+    if os.path.exists(prefix + ".ids"): os.remove(prefix + ".ids")    # Invalidate any older store
+    if os.path.dirname(prefix): os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    matrix = np.memmap(prefix + ".bin", dtype=dtype, mode="w+", shape=(len(ids), len(ids)))
+    nrow = 0
+    for i, line in enumerate(IN):
+        if line.strip() == "": continue
+        fields = line.rstrip("\n").split("\t")
+        if i >= len(ids) or fields[0] != ids[i]:
+            raise ValueError("ERROR! Row and column names do not match in " + infile + " at row " + str(i + 1))
+        matrix[i, :] = np.array(fields[1:], dtype=dtype)
+        nrow += 1
+    IN.close()
+    if nrow != len(ids):
+        raise ValueError("ERROR! " + infile + " has " + str(nrow) + " rows but " + str(len(ids)) + " columns")
+    matrix.flush()
+    del matrix
+    OUT = open(prefix + ".ids", "w")
+    for i in ids:
+        OUT.write(i + "\n")
+    OUT.close()
+
+
+class DistanceStore:
+
+    def __init__(self, prefix):
+        IN = open(prefix + ".ids", "r")
+        self.ids = np.array([line.rstrip("\n") for line in IN])
+        IN.close()
+        self.matrix = np.memmap(prefix + ".bin", dtype=dtype, mode="r", shape=(len(self.ids), len(self.ids)))
+
+    # Square submatrix for the given integer indices (a copy, so the memory map only has to touch those rows)
+    def submatrix(self, indices):
+        return np.array(self.matrix[np.ix_(indices, indices)])
+
+    # Integer indices of samples in each split, where splits are combinations of key columns (eg, AGE_fixed and ENV)
+    # named like R's paste(..., collapse='.'). Splits come in the order they are first seen, and samples that are not in
+    # the key are left out. The key is a DataFrame indexed by sample ID.
+    def split_indices(self, key, columns):
+        found = np.isin(self.ids, key.index)
+        if not np.all(found):
+            print("WARNING!", np.sum(~found), "samples not found in sample key and will be skipped")
+        names = key.loc[self.ids[found], columns].fillna("NA").astype(str).agg(".".join, axis=1)
+        indices = np.flatnonzero(found)
+        splits = dict()
+        for name in dict.fromkeys(names):
+            splits[name] = indices[np.array(names == name)]
+        return splits
+
+    # Iterate over (split name, sample IDs, distance submatrix)
+    def split_views(self, key, columns):
+        for name, indices in self.split_indices(key, columns).items():
+            yield name, self.ids[indices], self.submatrix(indices)
+
+
+def open_store(prefix):
+    return DistanceStore(prefix)
+
+
+# Write a submatrix the way R's write.table(..., col.names=NA) does, which is what QIIME reads
+def write_text(ids, distances, outfile):
+    OUT = open(outfile, "w")
+    OUT.write("\t" + "\t".join(ids) + "\n")
+    for i, row in zip(ids, distances):
+        OUT.write(i + "\t" + "\t".join(repr(float(d)) for d in row) + "\n")
+    OUT.close()
+
+
+# Split index files start with a "#store<tab>prefix" line, then have one line per split: name<tab>comma-separated indices
+def write_splits(splits, outfile, prefix):
+    OUT = open(outfile, "w")
+    OUT.write("#store\t" + prefix + "\n")
+    for name, indices in splits.items():
+        OUT.write(name + "\t" + ",".join(str(i) for i in indices) + "\n")
+    OUT.close()
+
+
+# Returns the store prefix and the splits as {name: integer indices}
+def read_splits(infile):
+    splits = dict()
+    IN = open(infile, "r")
+    prefix = IN.readline().rstrip("\n").split("\t")[1]
+    for line in IN:
+        name, indices = line.rstrip("\n").split("\t")
+        splits[name] = np.array([int(i) for i in indices.split(",")])
+    IN.close()
+    return prefix, splits
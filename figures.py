@@ -0,0 +1,16 @@
+__author__ = 'jgwall'
+
+# Saving publication figures: each figure is drawn once and then written in every requested format
+
+import profiling
+
+formats = ["png", "svg"]
+dpi = {"png": 100, "svg": 600}
+
+
+def save_figure(fig, outprefix, formats=formats):
+    import matplotlib.pyplot as plt
+    for ext in formats:
+        with profiling.phase("savefig." + ext):
+            fig.savefig(outprefix + "." + ext, dpi=dpi.get(ext, 100))
+    plt.close(fig)
@@ -0,0 +1,95 @@
+__author__ = 'jgwall'
+
+# Saved per-group sufficient statistics (counts, sums and sums of squares of each trait in each group; see
+# oneway_herit.py) for the actual data and every permutation, so one-way heritabilities can be updated as new samples
+# come in instead of recalculated from scratch (see 1a_UpdateHeritability.py). The statistics are a single .npz file:
+#   traits, groups, samples - names; samples are those already counted
+#   counts, sums, sumsq     - groups x traits, for the actual data
+#   perm_counts, perm_sums, perm_sumsq - perms x groups x traits, one set per permutation
+#   seed, batches           - master seed and number of batches of samples added so far
+# The file is written under a temporary name and renamed, so it is never left half-written.
+#
+# Permutations of a new batch only shuffle that batch's samples among themselves before being added to each stored
+# permutation, so the null distribution is permutations within batches rather than across all samples. Groups are nested
+# within environment and age, so a new week or location brings its own groups and this matches how the data came in.
+
+import numpy as np
+import oneway_herit
+import os
+
+stat_fields = ["counts", "sums", "sumsq"]
+count_dtype = np.float32    # Counts are small whole numbers, so don't need float64
+
+
+# Statistics of a first set of samples. With batch 0 the permutations use the master seed itself, so the heritabilities
+# are the same as 1a_BroadSenseHeritability.py gives with the same --seed.
+def create(traits, values, codes, groups, samples, n_perms, seed=1):
+    stats = {"traits": np.array(traits, dtype=str), "groups": np.array(groups, dtype=str), "samples": np.array(samples, dtype=str),
+             "seed": seed, "batches": 1}
+    stats.update(zip(stat_fields, oneway_herit.sufficient_stats(values, codes, len(groups))))
+    stats.update(zip(["perm_" + f for f in stat_fields], oneway_herit.permuted_stats(values, codes, len(groups), n_perms, seed=seed)))
+    return stats
+
+
+def n_perms(stats):
+    return stats["perm_counts"].shape[0]
+
+
+# Add a batch of new samples (values is samples x traits, in the same trait order). Samples already counted are skipped,
+# since changing their values would need a full recalculation; returns the number added.
+def add_samples(stats, values, codes, groups, samples):
+    new = ~np.isin(np.array(samples, dtype=str), stats["samples"])
+    if not np.any(new): return 0
+    values, codes, samples = values[new, :], codes[new], np.array(samples, dtype=str)[new]
+
+    # Groups not seen before go on the end, with empty statistics so far
+    groups = np.array(groups, dtype=str)
+    added = groups[~np.isin(groups, stats["groups"])]
+    if len(added):
+        stats["groups"] = np.concatenate([stats["groups"], added])
+        for field in stat_fields:
+            stats[field] = np.concatenate([stats[field], np.zeros((len(added), stats[field].shape[-1]))], axis=-2)
+            stats["perm_" + field] = np.concatenate([stats["perm_" + field], np.zeros(stats["perm_" + field].shape[:1] + (len(added), stats["perm_" + field].shape[-1]))], axis=-2)
+    index = {g: i for i, g in enumerate(stats["groups"])}
+    codes = np.array([index[g] for g in groups[codes]], dtype=int)
+
+    # Each batch's permutations get their own seed, derived from the master seed and the batch number
+    seed = np.random.SeedSequence([int(stats["seed"]), int(stats["batches"])])
+    n_groups = len(stats["groups"])
+    for field, update in zip(stat_fields, oneway_herit.sufficient_stats(values, codes, n_groups)):
+        stats[field] = stats[field] + update
+    for field, update in zip(stat_fields, oneway_herit.permuted_stats(values, codes, n_groups, n_perms(stats), seed=seed)):
+        stats["perm_" + field] = stats["perm_" + field] + update
+    stats["samples"] = np.concatenate([stats["samples"], samples])
+    stats["batches"] = int(stats["batches"]) + 1
+    return len(samples)
+
+
+# Heritabilities of the actual data and of each permutation
+def heritabilities(stats):
+    actual = oneway_herit.heritability(*[stats[f] for f in stat_fields])
+    perms = oneway_herit.heritability(*[stats["perm_" + f] for f in stat_fields])
+    return actual, perms
+
+
+def load(infile):
+    IN = open(infile, "rb")
+    data = np.load(IN)
+    stats = {key: data[key] for key in data.files}
+    IN.close()
+    for key in ["seed", "batches"]:
+        stats[key] = int(stats[key])
+    for key in ["counts", "perm_counts"]:
+        stats[key] = stats[key].astype(float)
+    return stats
+
+
+def save(stats, outfile):
+    data = dict(stats)
+    for key in ["counts", "perm_counts"]:
+        data[key] = data[key].astype(count_dtype)
+    tmpfile = outfile + "." + str(os.getpid()) + ".tmp"
+    OUT = open(tmpfile, "wb")
+    np.savez(OUT, **data)
+    OUT.close()
+    os.replace(tmpfile, outfile)
@@ -0,0 +1,68 @@
+__author__ = 'jgwall'
+
+# Cell labels for the 1d/3b heatmaps. Label strings and the NaN mask are worked out as whole arrays. Instead of one
+# ax.text() (with its own bbox) per cell, each distinct label string is turned into a text path once (matplotlib's
+# public TextPath) and drawn at every cell showing it by a single PathCollection, and the rounded background boxes for
+# all labels are one PatchCollection. Both are laid out in points around each cell's centre and offset to it, so they
+# stay the same size at any dpi, and the SVG backend writes each distinct label's path once and reuses it.
+
+import numpy as np
+
+box_pad = 0.3   # Padding around labels, as a fraction of font size (same as the default "round" boxstyle)
+
+
+# Which cells are NaN
+def nan_mask(matrix):
+    return np.isnan(np.asarray(matrix, dtype=float))
+
+
+# Labels for each cell, rounded to the given number of digits; NaNs get nan_label
+def cell_labels(matrix, digits=4, nan_label=""):
+    values = np.round(np.asarray(matrix, dtype=float), digits)
+    labels = np.array([str(v) for v in values.ravel()], dtype=object).reshape(values.shape)
+    labels[nan_mask(values)] = nan_label
+    return labels
+
+
+# Matrix values with NaNs replaced, so they don't mess up plotting
+def fill_nans(matrix, nan_value):
+    values = np.asarray(matrix, dtype=float)
+    return np.where(nan_mask(values), nan_value, values)
+
+
+# Draw labels (a nrow x ncol array of strings) centred on the cells of a pcolormesh, ie at (col + 0.5, row + 0.5)
+def draw_cell_labels(ax, labels, fontsize="medium", boxes=True, zorder=99):
+    from matplotlib.collections import PatchCollection, PathCollection
+    from matplotlib.font_manager import FontProperties
+    from matplotlib.patches import BoxStyle, FancyBboxPatch
+    from matplotlib.textpath import TextPath, TextToPath
+    from matplotlib.transforms import Affine2D
+
+    rows, cols = np.nonzero(labels != "")
+    cells = np.column_stack([cols + 0.5, rows + 0.5])
+    cell_labels = labels[rows, cols]
+    points = Affine2D().scale(1 / 72) + ax.figure.dpi_scale_trans     # Points to display units
+    prop = FontProperties(size=fontsize)
+    measure = TextToPath()
+    extents = {text: measure.get_text_width_height_descent(text, prop, ismath=False) for text in set(cell_labels)}
+
+    # Background boxes (same padding as the default "round" bbox); added before the labels so they are drawn underneath
+    collections = list()
+    if boxes and len(cell_labels):
+        pad = box_pad * prop.get_size_in_points()
+        patches = [FancyBboxPatch((-extents[text][0] / 2, -extents[text][1] / 2), extents[text][0], extents[text][1],
+                                  boxstyle=BoxStyle.Round(pad=pad)) for text in cell_labels]
+        collections.append(PatchCollection(patches, offsets=cells, offset_transform=ax.transData, facecolors="white",
+                                           edgecolors="white", alpha=0.5, zorder=zorder))
+
+    # Labels, one collection per distinct string, each centred on its own extent like ha="center", va="center"
+    for text in dict.fromkeys(cell_labels):
+        width, height, descent = extents[text]
+        path = TextPath((-width / 2, descent - height / 2), text, prop=prop)
+        if len(path.vertices) == 0: continue   # Nothing to draw (eg, spaces)
+        collections.append(PathCollection([path], offsets=cells[cell_labels == text], offset_transform=ax.transData,
+                                          facecolors="black", edgecolors="none", zorder=zorder))
+    for collection in collections:
+        collection.set_transform(points)
+        ax.add_collection(collection, autolim=False)
+    return collections
@@ -0,0 +1,159 @@
+__author__ = 'jgwall'
+
+# Shared empirical p-value calculations for heritability tables (one "actual" row plus one row per permutation,
+# one column per trait). Everything is calculated for all traits at once instead of one column at a time.
+#
+# PermutationSketch gives the same summaries for tables stored in summary-only mode, where the permutations themselves
+# are never kept: it is built up one block of permutations at a time, and only holds what the p-values and plots need.
+
+import numpy as np
+import pandas as pd
+
+
+class PermutationNull:
+
+    def __init__(self, data):
+        isperm = np.array(data.index != "actual")
+        self.traits = np.array(data.columns)
+        self.actual = np.array(data.loc[~isperm, :], dtype=float)[0, :]
+        perms = np.array(data.loc[isperm, :], dtype=float)
+
+        # Sort each permutation column once; NaNs (permutations not run for a trait) sort to the bottom and are not counted
+        self.n_perms = np.sum(~np.isnan(perms), axis=0)
+        self.sorted_perms = np.asfortranarray(np.sort(perms, axis=0))    # Fortran order so each trait's column is contiguous
+
+    # Number of permutations above each cutoff (default = actual heritability). Inclusive means count ties as well (>=)
+    #
+    # All traits are searched at once: each sorted column is shifted up by its own offset (more than the range of the
+    # data apart) so the whole matrix becomes one sorted array, each cutoff is shifted the same way and looked up in it,
+    # and subtracting each column's start gives the number below it. Adding an offset can round values that are within
+    # a rounding error of a cutoff onto it, so values that land exactly on a shifted cutoff (usually just real ties) are
+    # compared to it again unshifted.
+    def count_exceeding(self, cutoffs=None, inclusive=False):
+        if cutoffs is None: cutoffs = self.actual
+        cutoffs = np.broadcast_to(np.asarray(cutoffs, dtype=float), self.actual.shape)
+        n_rows, n_cols = self.sorted_perms.shape
+        has_perms = self.n_perms > 0
+        lo = np.nanmin(np.concatenate([self.sorted_perms[:1, has_perms].ravel(), cutoffs]), initial=0)
+        hi = np.nanmax(np.concatenate([self.perm_max()[has_perms], cutoffs]), initial=0)
+        gap = 2 * (hi - lo) + 1
+        offsets = np.arange(n_cols) * gap
+        starts = np.arange(n_cols) * n_rows
+        shifted = np.fmin(self.sorted_perms, hi + gap / 2)     # NaNs go above everything in their column
+        shifted += offsets
+        shifted = shifted.ravel(order="F")
+        values = self.sorted_perms.ravel(order="F")
+        keys = offsets + np.where(np.isnan(cutoffs), hi, cutoffs)
+        first, last = np.searchsorted(shifted, keys, side="left"), np.searchsorted(shifted, keys, side="right")
+
+        # Exact comparisons for values that shifted onto a cutoff
+        lengths = last - first
+        trait = np.repeat(np.arange(n_cols), lengths)
+        ties = np.repeat(first - np.cumsum(lengths) + lengths, lengths) + np.arange(np.sum(lengths))
+        tied_below = values[ties] < cutoffs[trait] if inclusive else values[ties] <= cutoffs[trait]
+        below = first - starts + np.bincount(trait, weights=tied_below, minlength=n_cols).astype(int)
+        below[np.isnan(cutoffs)] = self.n_perms[np.isnan(cutoffs)]  # Nothing is above a missing cutoff
+        return self.n_perms - below
+
+    # Empirical p-values (fraction of permutations with heritability greater than the actual one)
+    def pvals(self, inclusive=False):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.count_exceeding(inclusive=inclusive) / self.n_perms
+
+    def perm_max(self):
+        maxes = np.full(len(self.traits), np.nan)
+        has_perms = self.n_perms > 0
+        maxes[has_perms] = self.sorted_perms[self.n_perms[has_perms] - 1, np.flatnonzero(has_perms)]
+        return maxes
+
+    # Table of summary statistics for each trait
+    def summary(self, inclusive=False):
+        perm_max = self.perm_max()
+        result = pd.DataFrame({"trait": self.traits, "herit": self.actual, "pval": self.pvals(inclusive=inclusive),
+                               "perm_max": perm_max, "herit_minus_perm_max": self.actual - perm_max}, index=self.traits)
+        return result
+
+
+class PermutationSketch:
+    # Fixed-size summary of each trait's permutations: how many there were and how many were above (or tied with) the
+    # actual value, their minimum, maximum, mean and SD, and a histogram on a fixed grid (default 0 to 1, the range of
+    # heritabilities; values outside it go in the end bins) to draw the distributions from. NaNs are not counted.
+
+    per_trait = ["traits", "actual", "n_perms", "n_above", "n_ties", "mins", "maxes", "sums", "sumsq", "histogram"]
+
+    def __init__(self, traits, actual, bins=128, lo=0.0, hi=1.0):
+        self.traits = np.array(traits)
+        self.actual = np.array(actual, dtype=float)
+        self.lo, self.hi = lo, hi
+        n = len(self.traits)
+        self.n_perms, self.n_above, self.n_ties = [np.zeros(n, dtype=np.int64) for i in range(3)]
+        self.mins, self.maxes = np.full(n, np.inf), np.full(n, -np.inf)
+        self.sums, self.sumsq = np.zeros(n), np.zeros(n)
+        self.histogram = np.zeros((n, bins), dtype=np.int64)
+
+    # Add a block of permutations (perms x traits)
+    def update(self, perms):
+        perms = np.array(perms, dtype=float)
+        counted = ~np.isnan(perms)
+        self.n_perms += np.sum(counted, axis=0)
+        self.n_above += np.sum(perms > self.actual, axis=0)
+        self.n_ties += np.sum(perms == self.actual, axis=0)
+        self.mins = np.minimum(self.mins, np.min(np.where(counted, perms, np.inf), axis=0, initial=np.inf))
+        self.maxes = np.maximum(self.maxes, np.max(np.where(counted, perms, -np.inf), axis=0, initial=-np.inf))
+        y = np.where(counted, perms, 0)
+        self.sums += np.sum(y, axis=0)
+        self.sumsq += np.sum(y * y, axis=0)
+        bins = self.histogram.shape[1]
+        rows, cols = np.nonzero(counted)
+        index = np.clip(np.floor((perms[rows, cols] - self.lo) / (self.hi - self.lo) * bins).astype(int), 0, bins - 1)
+        self.histogram += np.bincount(cols * bins + index, minlength=self.histogram.size).reshape(self.histogram.shape)
+
+    # Sketch of just some traits (integer positions or names), in the order given
+    def subset(self, columns):
+        columns = np.asarray(columns)
+        if columns.dtype.kind not in "iu":
+            columns = pd.Index(self.traits).get_indexer(columns)
+        sketch = PermutationSketch.__new__(PermutationSketch)
+        sketch.lo, sketch.hi = self.lo, self.hi
+        for field in self.per_trait:
+            setattr(sketch, field, getattr(self, field)[columns])
+        return sketch
+
+    # Same as PermutationNull, but only for cutoffs at the actual values
+    def count_exceeding(self, inclusive=False):
+        return self.n_above + self.n_ties if inclusive else self.n_above
+
+    def pvals(self, inclusive=False):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.count_exceeding(inclusive=inclusive) / self.n_perms
+
+    def perm_max(self):
+        return np.where(self.n_perms > 0, self.maxes, np.nan)
+
+    def perm_min(self):
+        return np.where(self.n_perms > 0, self.mins, np.nan)
+
+    def mean(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums / self.n_perms
+
+    def sd(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(np.maximum(self.sumsq - self.sums ** 2 / self.n_perms, 0) / (self.n_perms - 1))
+
+    # Approximate quantiles (qs between 0 and 1) of each trait, interpolated within histogram bins; returns
+    # (quantiles x traits). The minimum and maximum are exact.
+    def quantiles(self, qs):
+        bins = self.histogram.shape[1]
+        edges = np.linspace(self.lo, self.hi, bins + 1)
+        cumulative = np.cumsum(self.histogram, axis=1) / np.maximum(self.n_perms, 1)[:, np.newaxis]
+        result = np.full((len(qs), len(self.traits)), np.nan)
+        for j in np.flatnonzero(self.n_perms > 0):
+            result[:, j] = np.interp(qs, np.concatenate([[0], cumulative[j, :]]), edges)
+        return np.clip(result, self.perm_min(), self.perm_max())
+
+    def summary(self, inclusive=False):
+        perm_max = self.perm_max()
+        result = pd.DataFrame({"trait": self.traits, "herit": self.actual, "pval": self.pvals(inclusive=inclusive),
+                               "perm_max": perm_max, "herit_minus_perm_max": self.actual - perm_max}, index=self.traits)
+        return result
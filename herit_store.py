@@ -0,0 +1,174 @@
+__author__ = 'jgwall'
+
+# Binary sidecar store for heritability tables (one "actual" row plus one row per permutation, one column per trait).
+# For a table "X.txt" the store is three files:
+#   X.h2.bin    - float64 matrix of rows x traits, in column (Fortran) order so each trait is contiguous on disk
+#   X.h2.traits - trait names, one per line
+#   X.h2.rows   - row names ("actual", "perm1_1", ...), one per line; written last, so it marks a complete store
+# Readers open the matrix with np.memmap, so pulling out a subset of traits only touches those columns.
+#
+# Tables written in summary-only mode (eg, 1b_RecombineHeritabilities.py --summary-only) instead keep just the "actual"
+# row in X.txt and a fixed-size summary of each trait's permutations (see herit_stats.PermutationSketch) in
+#   X.h2.sketch.npz - counts as int32, extremes and moments as float32, the histogram as uint32
+# which is written to a temporary name and renamed, so it's only there once complete. null() and permutations() give
+# the same interface to readers whichever way a table was stored.
+
+import numpy as np
+import os
+import pandas as pd
+from herit_stats import PermutationNull, PermutationSketch
+
+dtype = np.float64
+
+
+def store_prefix(table):
+    prefix = table[:-len(".txt")] if table.endswith(".txt") else table
+    return prefix + ".h2"
+
+
+# Check that a complete store exists and is at least as new as its text table
+def has_store(table):
+    prefix = store_prefix(table)
+    files = [prefix + ".bin", prefix + ".traits", prefix + ".rows"]
+    if not all(os.path.exists(f) for f in files):
+        return False
+    if os.path.exists(table) and os.path.getmtime(prefix + ".rows") < os.path.getmtime(table):
+        return False
+    return True
+
+
+class StoreWriter:
+    # Writes a store one block of rows at a time; the total number of rows has to be known up front
+
+    def __init__(self, table, traits, nrows):
+        self.prefix = store_prefix(table)
+        self.traits = list(traits)
+        self.rows = list()
+        if os.path.exists(self.prefix + ".rows"): os.remove(self.prefix + ".rows")    # Invalidate any older store
+        if os.path.exists(sketch_file(table)): os.remove(sketch_file(table))
+        self.matrix = np.memmap(self.prefix + ".bin", dtype=dtype, mode="w+", shape=(nrows, len(self.traits)), order="F")
+
+    def write_rows(self, data):
+        start = len(self.rows)
+        self.matrix[start:start + len(data), :] = np.array(data, dtype=dtype)
+        self.rows.extend(str(r) for r in data.index)
+
+    def close(self):
+        if len(self.rows) != self.matrix.shape[0]:
+            raise ValueError("Store " + self.prefix + " expected " + str(self.matrix.shape[0]) + " rows but got " + str(len(self.rows)))
+        self.matrix.flush()
+        del self.matrix
+        write_names(self.prefix + ".traits", self.traits)
+        write_names(self.prefix + ".rows", self.rows)
+
+
+def write_store(table, data):
+    writer = StoreWriter(table, data.columns, len(data))
+    writer.write_rows(data)
+    writer.close()
+
+
+class HeritTable:
+    # Uniform access to a heritability table, through the binary store if there is one and the text table otherwise
+
+    def __init__(self, table):
+        self.table = table
+        if has_store(table):
+            prefix = store_prefix(table)
+            self.traits = np.array(read_names(prefix + ".traits"))
+            self.rows = np.array(read_names(prefix + ".rows"))
+            self.matrix = np.memmap(prefix + ".bin", dtype=dtype, mode="r", shape=(len(self.rows), len(self.traits)), order="F")
+            self.data = None
+        else:
+            self.data = pd.read_csv(table, sep='\t')
+            self.traits = np.array(self.data.columns)
+            self.rows = np.array(self.data.index)
+            self.matrix = None
+        self.sketch = read_sketch(table) if has_sketch(table) else None
+
+    @property
+    def actual(self):
+        isactual = np.flatnonzero(self.rows == "actual")[0]
+        if self.matrix is not None:
+            return np.array(self.matrix[isactual, :])
+        return np.array(self.data.iloc[isactual, :], dtype=float)
+
+    # DataFrame of the requested traits (integer positions or names; default all) in the order given
+    def frame(self, columns=None):
+        columns = self.positions(columns)
+        if self.matrix is not None:
+            return pd.DataFrame(self.matrix[:, columns], index=self.rows, columns=self.traits[columns])
+        return self.data.iloc[:, columns]
+
+    # Permutation null distribution of the requested traits (see frame()), for p-values
+    def null(self, columns=None):
+        if self.sketch is not None:
+            return self.sketch.subset(self.positions(columns))
+        return PermutationNull(self.frame(columns))
+
+    # Permutations of the requested traits, for plotting: a DataFrame of the permutation rows, or a sketch
+    def permutations(self, columns=None):
+        if self.sketch is not None:
+            return self.sketch.subset(self.positions(columns))
+        data = self.frame(columns)
+        return data.loc[data.index != "actual", :]
+
+    def positions(self, columns=None):
+        if columns is None:
+            return np.arange(len(self.traits))
+        columns = np.asarray(columns)
+        return columns if columns.dtype.kind in "iu" else pd.Index(self.traits).get_indexer(columns)
+
+
+def open_table(table):
+    return HeritTable(table)
+
+
+def read_names(infile):
+    IN = open(infile, "r")
+    names = [line.rstrip("\n") for line in IN]
+    IN.close()
+    return names
+
+
+def write_names(outfile, names):
+    OUT = open(outfile, "w")
+    for n in names:
+        OUT.write(n + "\n")
+    OUT.close()
+
+
+# Summary-only permutation sketches (see above)
+def sketch_file(table):
+    return store_prefix(table) + ".sketch.npz"
+
+
+def has_sketch(table):
+    sketch = sketch_file(table)
+    return os.path.exists(sketch) and not (os.path.exists(table) and os.path.getmtime(sketch) < os.path.getmtime(table))
+
+
+def write_sketch(table, sketch):
+    if os.path.exists(store_prefix(table) + ".rows"): os.remove(store_prefix(table) + ".rows")     # Invalidate any full store
+    tmpfile = sketch_file(table) + "." + str(os.getpid()) + ".tmp"
+    OUT = open(tmpfile, "wb")
+    np.savez(OUT, traits=sketch.traits.astype(str), actual=sketch.actual, lo=sketch.lo, hi=sketch.hi,
+             n_perms=sketch.n_perms.astype(np.int32), n_above=sketch.n_above.astype(np.int32), n_ties=sketch.n_ties.astype(np.int32),
+             mins=sketch.mins.astype(np.float32), maxes=sketch.maxes.astype(np.float32), mean=sketch.mean().astype(np.float32),
+             sd=sketch.sd().astype(np.float32), histogram=sketch.histogram.astype(np.uint32))
+    OUT.close()
+    os.replace(tmpfile, sketch_file(table))
+
+
+def read_sketch(table):
+    IN = open(sketch_file(table), "rb")
+    data = np.load(IN)
+    sketch = PermutationSketch(data["traits"], data["actual"], bins=data["histogram"].shape[1], lo=float(data["lo"]), hi=float(data["hi"]))
+    for field in ["n_perms", "n_above", "n_ties", "histogram"]:
+        setattr(sketch, field, data[field].astype(np.int64))
+    sketch.mins, sketch.maxes = data["mins"].astype(float), data["maxes"].astype(float)
+    n, mean, sd = sketch.n_perms, data["mean"].astype(float), data["sd"].astype(float)
+    sketch.sums = np.where(n > 0, mean * n, 0)
+    sketch.sumsq = np.where(n > 1, sd ** 2 * (n - 1), 0) + np.where(n > 0, mean ** 2 * n, 0)    # Moments back from the saved mean and SD
+    IN.close()
+    return sketch
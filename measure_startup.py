@@ -0,0 +1,68 @@
+__author__ = 'jgwall'
+
+# Measure how long each Python script in the pipeline takes just to start (interpreter plus module-level imports), by
+# timing "python3 <script> --help" several times. Optionally lists the slowest imports from "python3 -X importtime"
+
+import argparse
+import glob
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+debug = False
+
+
+def main():
+    args = parse_args()
+    scripts = args.scripts
+    if not scripts:
+        scripts = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "[0-9]*.py")))
+    print("Measuring startup time of", len(scripts), "scripts over", args.reps, "runs each")
+
+    print("\t".join(["script", "median_sec", "min_sec"]))
+    for script in scripts:
+        times = [time_startup(script) for i in range(args.reps)]
+        print("\t".join([os.path.basename(script), "{:.3f}".format(statistics.median(times)), "{:.3f}".format(min(times))]))
+        if args.imports:
+            for module, cumulative in slowest_imports(script, args.imports):
+                print("\t\t" + module + "\t{:.3f}".format(cumulative))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--scripts", nargs="*", help="Scripts to time (default: all numbered Python scripts)")
+    parser.add_argument("-r", "--reps", type=int, default=5, help="Number of times to start each script")
+    parser.add_argument("-i", "--imports", type=int, default=0, help="Also list this many of the slowest top-level imports for each script")
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+# Time one start of a script; --help makes argparse exit right after the module-level imports
+def time_startup(script):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, script, "--help"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+# Slowest top-level imports (cumulative seconds) according to "python -X importtime"
+def slowest_imports(script, n):
+    result = subprocess.run([sys.executable, "-X", "importtime", script, "--help"], stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    imports = list()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line: continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        if module.startswith("  "): continue    # Only top-level imports (nested ones are indented)
+        imports.append((module.strip(), int(cumulative_us) / 1e6))
+    return sorted(imports, key=lambda x: x[1], reverse=True)[:n]
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,171 @@
+__author__ = 'jgwall'
+
+# Closed-form one-way random-effects heritability, equivalent to the "(1|INBRED_nested)" model that
+# 1a_BroadSenseHeritability.r fits with lmer when there are no covariates. Everything works off per-group sufficient
+# statistics (counts, sums and sums of squares of each trait in each group), which are built for all traits (and
+# blocks of permutations) at once as matrix products with a group indicator matrix.
+#
+# Variance components are the ANOVA (method of moments) estimates, with n0 to handle unbalanced groups. These match
+# REML for balanced data; like lmer, a negative group variance is truncated to zero (and all variance is then residual).
+# Heritability is calculated the same way as run.lmer(), ie, as a ratio of the standard deviations:
+# sd_group / (sd_group + sd_residual).
+
+import numpy as np
+import pandas as pd
+import rawdata
+
+target_column = "INBRED_nested"
+max_block_elements = 2e7    # Upper limit on the size of the group indicator arrays built at once for permutations
+
+
+# Load a (fake) BIOM text file of traits x samples, as written by 1c_ConvertQiimePcsToFakeBiomFile.py or "biom convert"
+def load_traits(infile):
+    return pd.read_csv(infile, sep='\t', skiprows=1, index_col=0)
+
+
+# Load the QIIME key and add the nested genotype-within-environment-and-age column used as the random effect
+def load_key(keyfile):
+    IN = rawdata.open_raw(keyfile)
+    key = pd.read_csv(IN, sep='\t', index_col=0)
+    IN.close()
+    factors = key[["ENV", "AGE", "INBREDS"]]
+    key[target_column] = factors.fillna("NA").astype(str).agg(".".join, axis=1)
+    key.loc[factors.isnull().any(axis=1), target_column] = np.nan   # As with R's interaction(), missing factors give a missing group
+    return key
+
+
+# Match traits to the key; returns a samples x traits matrix and the group codes of each sample (in key order)
+def match_data(data, key):
+    key = key[key.index.isin(data.columns) & key[target_column].notnull()]
+    values = np.array(data.loc[:, key.index], dtype=float).T
+    groups, codes = np.unique(np.array(key[target_column]), return_inverse=True)
+    return values, codes, groups, np.array(key.index)
+
+
+# Per-group sufficient statistics. Codes can be one set of group assignments (samples) or a block of them (perms x samples);
+# returns counts, sums and sums of squares with shape ([perms x] groups x traits). Non-finite values are dropped per trait.
+def sufficient_stats(values, codes, n_groups):
+    finite = np.isfinite(values)
+    y = np.where(finite, values, 0)
+    indicators = np.zeros(codes.shape[:-1] + (n_groups, codes.shape[-1]))
+    np.put_along_axis(indicators, np.expand_dims(codes, -2), 1, axis=-2)
+    counts = indicators @ finite.astype(float)
+    sums = indicators @ y
+    sumsq = indicators @ (y * y)
+    return counts, sums, sumsq
+
+
+# Variance components from sufficient statistics (groups are the second-to-last axis)
+def variance_components(counts, sums, sumsq):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n = np.sum(counts, axis=-2)
+        n_groups = np.sum(counts > 0, axis=-2)
+        group_ss = np.sum(np.where(counts > 0, sums * sums / counts, 0), axis=-2)
+        ss_between = group_ss - np.sum(sums, axis=-2) ** 2 / n
+        ss_within = np.sum(sumsq, axis=-2) - group_ss
+        df_between, df_within = n_groups - 1, n - n_groups
+        ms_between, ms_within = ss_between / df_between, ss_within / df_within
+        n0 = (n - np.sum(counts * counts, axis=-2) / n) / df_between
+        var_group = np.maximum((ms_between - ms_within) / n0, 0)
+        var_resid = np.where(var_group > 0, ms_within, (ss_between + ss_within) / (n - 1))  # At the boundary, all variance is residual
+    invalid = (df_between < 1) | (df_within < 1)
+    var_group[invalid] = np.nan
+    var_resid[invalid] = np.nan
+    return var_group, var_resid
+
+
+def heritability(counts, sums, sumsq):
+    var_group, var_resid = variance_components(counts, sums, sumsq)
+    sd_group, sd_resid = np.sqrt(var_group), np.sqrt(var_resid)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sd_group / (sd_group + sd_resid)
+
+
+# Heritability of the actual data plus each of n_perms random permutations of samples across groups
+def permuted_heritabilities(values, codes, n_groups, n_perms, seed=1):
+    actual = heritability(*sufficient_stats(values, codes, n_groups))
+    rng = np.random.default_rng(seed)
+    perms = np.empty((n_perms, values.shape[1]))
+    block = max(1, int(max_block_elements // (n_groups * len(codes))))
+    for start in range(0, n_perms, block):
+        stop = min(start + block, n_perms)
+        scrambled = np.array([rng.permutation(codes) for i in range(start, stop)])
+        perms[start:stop, :] = heritability(*sufficient_stats(values, scrambled, n_groups))
+    return actual, perms
+
+
+# Sufficient statistics of n_perms random permutations, each (perms x groups x traits), instead of their heritabilities.
+# Permutations are drawn the same way as in permuted_heritabilities(), so heritability() of these gives the same values.
+def permuted_stats(values, codes, n_groups, n_perms, seed=1):
+    rng = np.random.default_rng(seed)
+    counts, sums, sumsq = [np.empty((n_perms, n_groups, values.shape[1])) for i in range(3)]
+    block = max(1, int(max_block_elements // (n_groups * len(codes))))
+    for start in range(0, n_perms, block):
+        stop = min(start + block, n_perms)
+        scrambled = np.array([rng.permutation(codes) for i in range(start, stop)])
+        counts[start:stop], sums[start:stop], sumsq[start:stop] = sufficient_stats(values, scrambled, n_groups)
+    return counts, sums, sumsq
+
+
+# Sequential (Besag-Clifford style) version of permuted_heritabilities(). Permutations are drawn in blocks, and a trait
+# stops getting new ones as soon as it has stop_hits permutations at or above its actual heritability, or as soon as it
+# can no longer reach p <= p_cutoff within max_perms permutations. Traits near or below the cutoff run to max_perms.
+# Permutations a trait did not get are left as NaN, so (hits / non-NaN permutations) is still its exact empirical p-value.
+#
+# The stopping is one-sided: only traits that are clearly NOT significant stop early. Traits that are clearly significant
+# (no hits, or too few for any later ones to push them over the cutoff) still get all max_perms permutations, since the
+# smallest p-value they can show, and so how well the most heritable traits are resolved, depends on how many they get.
+# Savings therefore come from the non-heritable bulk of traits. Only this one-way engine (used for the PC traits) has
+# early stopping; the lmer fits in 1a_BroadSenseHeritability.r (the OTUs) always run every permutation.
+def adaptive_heritabilities(values, codes, n_groups, max_perms, p_cutoff, stop_hits=10, block_size=100, seed=1):
+    actual = heritability(*sufficient_stats(values, codes, n_groups))
+    rng = np.random.default_rng(seed)
+    perms = np.full((max_perms, values.shape[1]), np.nan)
+    hits = np.zeros(values.shape[1], dtype=int)
+    drawn = np.zeros(values.shape[1], dtype=int)
+    max_hits = min(stop_hits, int(np.floor(p_cutoff * max_perms)) + 1)     # Any more than this and the trait can't be significant
+    active = np.isfinite(actual)
+    for start in range(0, max_perms, block_size):
+        if not np.any(active): break
+        stop = min(start + block_size, max_perms)
+        scrambled = np.array([rng.permutation(codes) for i in range(start, stop)])
+        block = heritability(*sufficient_stats(values[:, active], scrambled, n_groups))
+
+        # Find where each trait reaches the hit limit within this block and throw away any permutations after that
+        cumulative = hits[active] + np.cumsum(block >= actual[active], axis=0)
+        done = cumulative[-1, :] >= max_hits
+        last = np.where(done, np.argmax(cumulative >= max_hits, axis=0) + 1, stop - start)
+        block[np.arange(stop - start)[:, np.newaxis] >= last] = np.nan
+
+        perms[start:stop, active] = block
+        hits[active] = cumulative[last - 1, np.arange(len(last))]
+        drawn[active] += last
+        active[np.flatnonzero(active)[done]] = False
+    perms = perms[:np.max(drawn, initial=0), :]    # Drop permutations no trait needed
+    return actual, perms, drawn, hits
+
+
+# BLUPs of each group's random effect, given the variance components (shrunken deviations from the GLS mean)
+def blups(counts, sums, sumsq):
+    var_group, var_resid = variance_components(counts, sums, sumsq)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        weights = counts / (var_resid + counts * var_group)
+        overall = np.nansum(weights * means, axis=-2) / np.sum(weights, axis=-2)
+        shrinkage = counts * var_group / (var_resid + counts * var_group)
+        effects = np.where(counts > 0, shrinkage * (means - overall), np.nan)
+    return effects
+
+
+# Table in the same format as 1a_BroadSenseHeritability.r: "actual" row, then perm1..permN, one column per trait
+def make_herit_table(traits, actual, perms):
+    rows = ["actual"] + ["perm" + str(i) for i in range(1, len(perms) + 1)]
+    return pd.DataFrame(np.vstack([actual, perms]), index=rows, columns=traits)
+
+
+# Write a heritability table the way R's write.table does (no header entry for the row names)
+def write_herit_table(table, outfile):
+    OUT = open(outfile, "w")
+    OUT.write("\t".join(table.columns) + "\n")
+    table.to_csv(OUT, sep='\t', header=False, na_rep="NA")
+    OUT.close()
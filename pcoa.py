@@ -0,0 +1,43 @@
+__author__ = 'jgwall'
+
+# Principal coordinates analysis that only computes the top k components. The distance matrix is double-centred
+# (B = -0.5 * J D^2 J) and its largest eigenpairs are found with ARPACK's Lanczos solver (scipy's eigsh), which iterates
+# until the eigenpairs have converged to machine precision however flat the leading spectrum is, at a cost that grows
+# with n^2 per iteration instead of the n^3 of a full eigendecomposition. Small matrices just get the full
+# decomposition.
+#
+# As in QIIME, coordinates are eigenvectors scaled by the square root of their eigenvalues, and the proportion explained
+# is each eigenvalue over the sum of all of them (ie, the trace of B, which doesn't need the full spectrum).
+
+import numpy as np
+from qiime_pcs import PcFile
+from scipy.sparse.linalg import eigsh
+
+full_cutoff = 500   # Matrices this small or smaller get a full decomposition
+
+
+def center_distances(distances):
+    squared = np.asarray(distances, dtype=float) ** 2
+    row_means = squared.mean(axis=1)
+    return -0.5 * (squared - row_means[:, np.newaxis] - row_means[np.newaxis, :] + row_means.mean())
+
+
+def top_eigenpairs(matrix, k, seed=1):
+    n = len(matrix)
+    if n <= full_cutoff or k >= n - 1:     # eigsh needs k < n
+        eigvals, eigvecs = np.linalg.eigh(matrix)
+    else:
+        start = np.random.default_rng(seed).normal(size=n)     # Fixed starting vector, so results are reproducible
+        eigvals, eigvecs = eigsh(matrix, k=k, which="LA", v0=start)
+    order = np.argsort(eigvals)[::-1][:k]
+    return eigvals[order], eigvecs[:, order]
+
+
+# PCoA of a square distance matrix; returns the same PcFile object the QIIME PC parser does
+def pcoa(distances, ids, k, seed=1):
+    centered = center_distances(distances)
+    eigvals, eigvecs = top_eigenpairs(centered, k, seed=seed)
+    coords = eigvecs * np.sqrt(np.maximum(eigvals, 0))
+    total = np.trace(centered)
+    proportion_explained = eigvals / total if total > 0 else np.zeros_like(eigvals)  # Degenerate (eg, single-sample) splits
+    return PcFile(np.asarray(ids), coords, eigvals, proportion_explained)
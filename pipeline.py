@@ -0,0 +1,235 @@
+__author__ = 'jgwall'
+
+# Small incremental pipeline runner. Each Node is a shell command with input files, output files and dependencies on
+# other nodes. A node's key is a hash of its command (which holds all its parameters) and the contents of its inputs
+# (including the script it runs); if the key matches the one saved from the last successful run and all its outputs
+# still exist, the node is skipped. Independent nodes run in parallel, up to a total number of processes.
+#
+# Python scripts among a node's inputs (including the one it runs) bring in the local modules they import, directly or
+# through other local modules, so editing eg a shared helper module reruns every node that uses it. Scripts that are
+# only run or imported by name at run time (eg, through importlib or a subprocess) still have to be listed as inputs.
+#
+# Inputs and outputs can be glob patterns, which are resolved when the node is about to run, as are command arguments
+# wrapped in Glob() (which become all the matching files). Files matching a glob output are removed before the node
+# reruns, so they only ever hold what the latest run made. Nodes whose downstream jobs aren't known until they've run
+# (eg, one job per split of a distance matrix) can have an expand() function that returns new nodes afterwards; anything
+# that depends on such a node waits for everything it expanded into as well. The outputs of those children are only
+# named once they exist, so a child that no longer comes up (eg, a split that went away) would leave its old files
+# behind; such a node's clears patterns name everything its children make, and are removed whenever it reruns.
+
+import ast
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+
+chunk_size = 2 ** 20    # Bytes read at a time when hashing files
+
+
+class Node:
+
+    def __init__(self, name, cmd, inputs=[], outputs=[], deps=[], procs=1, expand=None, clears=[]):
+        self.name = name
+        self.cmd = cmd              # Command as a list of arguments
+        self.inputs = list(inputs)  # Files (or glob patterns) whose contents determine the output
+        self.outputs = list(outputs)
+        self.deps = list(deps)      # Names of nodes that have to finish first
+        self.procs = procs          # Number of processes the command uses, for scheduling
+        self.expand = expand        # Optional function returning more nodes once this one is done
+        self.clears = list(clears)  # Files (or glob patterns) made by the nodes it expands into, removed when it reruns
+        self.children = list()
+
+        # The script being run counts as an input, so changing it reruns the node
+        if len(cmd) > 1 and os.path.splitext(cmd[1])[1] in [".py", ".r", ".R"]:
+            self.inputs.insert(0, cmd[1])
+
+
+# Command argument that is replaced by the sorted files matching it when the command is run
+class Glob(str):
+    pass
+
+
+def resolve_cmd(cmd):
+    args = list()
+    for arg in cmd:
+        args.extend(sorted(glob.glob(arg)) if isinstance(arg, Glob) else [arg])
+    return args
+
+
+# Run a command and return its exit code (127, like the shell, if the program can't be found)
+def run_command(cmd):
+    try:
+        return subprocess.run(cmd).returncode
+    except OSError as error:
+        print("ERROR! Could not run", cmd[0], ":", error)
+        return 127
+
+
+# Local modules (.py files in the same directory) imported by a Python script, directly or through each other
+def local_imports(script, found=None):
+    found = set() if found is None else found
+    IN = open(script, "r")
+    tree = ast.parse(IN.read(), script)
+    IN.close()
+    for statement in ast.walk(tree):     # Includes imports inside functions, like the lazily imported ones
+        if isinstance(statement, ast.Import):
+            names = [alias.name for alias in statement.names]
+        elif isinstance(statement, ast.ImportFrom) and statement.module and not statement.level:
+            names = [statement.module]
+        else:
+            continue
+        for name in names:
+            module = os.path.join(os.path.dirname(script), name.split(".")[0] + ".py")
+            if module not in found and os.path.exists(module):
+                found.add(module)
+                local_imports(module, found)
+    return found
+
+
+def resolve(patterns):
+    files = list()
+    for pattern in patterns:
+        files.extend(sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern])
+    return files
+
+
+class Pipeline:
+
+    def __init__(self, statefile, maxprocs=1, force=[], dry_run=False):
+        self.statefile = statefile
+        self.maxprocs = maxprocs
+        self.force = force          # Names of nodes to rerun no matter what
+        self.dry_run = dry_run
+        self.nodes = dict()
+        self.state = {"keys": dict(), "hashes": dict()}
+        if os.path.exists(statefile):
+            IN = open(statefile, "r")
+            self.state = json.load(IN)
+            IN.close()
+
+    def add(self, node):
+        if node.name in self.nodes:
+            raise ValueError("ERROR! Pipeline already has a node named " + node.name)
+        self.nodes[node.name] = node
+
+    # MD5 of a file, cached by path, size and modification time so unchanged files aren't read again
+    def file_hash(self, path):
+        if not os.path.exists(path): return None
+        stat = os.stat(path)
+        cached = self.state["hashes"].get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return cached[2]
+        md5 = hashlib.md5()
+        IN = open(path, "rb")
+        for chunk in iter(lambda: IN.read(chunk_size), b""):
+            md5.update(chunk)
+        IN.close()
+        self.state["hashes"][path] = [stat.st_size, stat.st_mtime, md5.hexdigest()]
+        return md5.hexdigest()
+
+    def node_key(self, node):
+        files = resolve(node.inputs)
+        modules = set()
+        for path in files:
+            if path.endswith(".py") and os.path.exists(path): local_imports(path, modules)
+        files += sorted(modules.difference(files))
+        inputs = [[path, self.file_hash(path)] for path in files]
+        return hashlib.sha256(json.dumps([resolve_cmd(node.cmd), inputs]).encode("utf-8")).hexdigest()
+
+    def up_to_date(self, node, key):
+        if node.name in self.force or self.state["keys"].get(node.name) != key: return False
+        for pattern in node.outputs:
+            files = resolve([pattern])
+            if len(files) == 0 or not all(os.path.exists(f) for f in files): return False
+        return True
+
+    def save_state(self):
+        tmpfile = self.statefile + ".tmp"
+        OUT = open(tmpfile, "w")
+        json.dump(self.state, OUT, indent=1, sort_keys=True)
+        OUT.close()
+        os.replace(tmpfile, self.statefile)
+
+    # Done = this node and everything it expanded into have finished
+    def complete(self, name, finished):
+        return name in finished and all(self.complete(c, finished) for c in self.nodes[name].children)
+
+    def has_failed(self, name, failed):
+        return name in failed or any(self.has_failed(c, failed) for c in self.nodes[name].children)
+
+    def run(self):
+        finished, failed, running = set(), set(), dict()
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.maxprocs)   # Threads just wait on subprocesses
+        progress = True
+        while True:
+            # Start everything that's ready and fits, skipping nodes that are up to date. Keep going while that finishes
+            # nodes, since they may have made others ready
+            if not progress and not running:
+                break
+            progress = False
+            for name, node in list(self.nodes.items()):
+                if name in finished or name in failed or name in [r[0] for r in running.values()]: continue
+                if any(self.has_failed(d, failed) for d in node.deps):
+                    print("Skipping", name, "because a dependency failed")
+                    failed.add(name)
+                    progress = True
+                    continue
+                if not all(self.complete(d, finished) for d in node.deps): continue
+                key = self.node_key(node)
+                if self.up_to_date(node, key):
+                    print("Up to date:", name)
+                    self.finish(node, finished)
+                    progress = True
+                    continue
+                used = sum(self.nodes[r[0]].procs for r in running.values())
+                if running and used + node.procs > self.maxprocs: continue
+                print("Running:", name, "\n\t" + " ".join(shlex.quote(c) for c in resolve_cmd(node.cmd)))
+                if self.dry_run:
+                    self.finish(node, finished)
+                    progress = True
+                    continue
+                self.clear_outputs(node)
+                running[pool.submit(run_command, resolve_cmd(node.cmd))] = (name, key)
+
+            if not running:
+                continue
+
+            # Wait for something to finish
+            done, pending = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name, key = running.pop(future)
+                if future.result() != 0:
+                    print("ERROR! Node", name, "failed with exit code", future.result())
+                    failed.add(name)
+                    progress = True
+                    continue
+                self.state["keys"][name] = key
+                self.save_state()
+                self.finish(self.nodes[name], finished)
+                progress = True
+        pool.shutdown()
+        self.save_state()
+        waiting = [n for n in self.nodes if n not in finished and n not in failed]
+        return finished, failed, waiting
+
+    # Make output directories, and remove old files matching glob outputs, and anything its children made, so files
+    # from splits that no longer exist don't get picked up downstream
+    def clear_outputs(self, node):
+        for output in node.outputs:
+            outdir = os.path.dirname(output)
+            if outdir and not glob.has_magic(outdir) and not os.path.exists(outdir): os.makedirs(outdir)
+            if glob.has_magic(output):
+                for stale in glob.glob(output):
+                    os.remove(stale)
+        for stale in resolve(node.clears):
+            if os.path.exists(stale): os.remove(stale)
+
+    def finish(self, node, finished):
+        finished.add(node.name)
+        if node.expand:
+            for child in node.expand():
+                self.add(child)
+                node.children.append(child.name)
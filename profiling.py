@@ -0,0 +1,170 @@
+__author__ = 'jgwall'
+
+# Optional timing and memory instrumentation shared by the pipeline scripts. Scripts mark their phases with
+#   with profiling.phase("load"): ...
+# which does nothing unless profiling was turned on, either with a script's --profile flag or by setting the
+# HERIT_PROFILE environment variable (to 1, or to a directory to put the results in). When on, each phase records its
+# wall time, CPU time (including child processes that have finished) and peak resident memory, and the totals per phase
+# are written to a JSON sidecar file when the script exits. --profile-phase (or HERIT_PROFILE_PHASE) also runs cProfile
+# over every call of one phase and dumps the stats next to the JSON file, for looking at with pstats or snakeviz.
+#
+# Peak memory is per phase on Linux, where the kernel's high-water mark can be reset at the start of each phase; it is
+# the peak of the whole process so far elsewhere. Phases can be nested, and a phase's times and peak include those of
+# its sub-phases. CPU time and the high-water mark belong to the whole process, so phases are only recorded from the
+# main thread; in other threads phase() does nothing, and threaded work should be wrapped in one phase around the
+# whole pool instead.
+
+import atexit
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+env_var = "HERIT_PROFILE"
+env_phase = "HERIT_PROFILE_PHASE"
+
+enabled = False
+outfile = None
+cprofile_phase = None
+script = None
+phases = dict()     # Totals per phase name, in the order phases were first entered
+stack = list()      # Phases currently running, innermost last
+profiler = None
+
+
+def add_arguments(parser):
+    parser.add_argument("--profile", nargs="?", const="", default=None,
+                        help="Record time and memory of each phase to a JSON file (default: <script>.profile.json; also turned on by " + env_var + ")")
+    parser.add_argument("--profile-phase", help="Also run cProfile over this phase (eg, render) and dump the stats next to the JSON file")
+
+
+# Turn profiling on if the arguments or environment ask for it
+def start_from_args(args, scriptfile):
+    name = os.path.splitext(os.path.basename(scriptfile))[0]
+    env = os.environ.get(env_var, "")
+    if args.profile is not None:
+        start(name, args.profile or None, args.profile_phase or os.environ.get(env_phase))
+    elif env not in ["", "0"]:
+        outdir = env if env != "1" else None
+        start(name, os.path.join(outdir, name + "." + str(os.getpid()) + ".profile.json") if outdir else None,
+              args.profile_phase or os.environ.get(env_phase))
+
+
+def start(name, output=None, phase_name=None):
+    global enabled, outfile, cprofile_phase, script
+    enabled, script, cprofile_phase = True, name, phase_name
+    outfile = output if output else name + ".profile.json"
+    phases.clear()
+    stack.append(Phase("total"))
+    atexit.register(write)
+
+
+class Phase:
+
+    def __init__(self, name):
+        self.name = name
+        self.child_peak = 0     # Highest peak of sub-phases, which reset the high-water mark
+        reset_peak()
+        self.cpu = cpu_time()
+        self.wall = time.perf_counter()
+
+    def finish(self):
+        wall = time.perf_counter() - self.wall
+        cpu = cpu_time() - self.cpu
+        peak = max(read_peak(), self.child_peak)
+        totals = phases.setdefault(self.name, {"calls": 0, "wall_sec": 0.0, "cpu_sec": 0.0, "peak_rss_mb": 0.0})
+        totals["calls"] += 1
+        totals["wall_sec"] += wall
+        totals["cpu_sec"] += cpu
+        totals["peak_rss_mb"] = max(totals["peak_rss_mb"], peak / 2 ** 20)
+        return peak
+
+
+@contextlib.contextmanager
+def phase(name):
+    if not enabled or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    global profiler
+    if stack: stack[-1].child_peak = max(stack[-1].child_peak, read_peak())    # Would be lost when the new phase resets it
+    current = Phase(name)
+    stack.append(current)
+    run_cprofile = name == cprofile_phase and profiler is None
+    if run_cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if run_cprofile: profiler.disable()
+        stack.pop()
+        peak = current.finish()
+        if stack: stack[-1].child_peak = max(stack[-1].child_peak, peak)
+
+
+# Totals from phases run in worker processes (see collect()), added to this process's
+def merge(records):
+    for name, record in records.items():
+        totals = phases.setdefault(name, {"calls": 0, "wall_sec": 0.0, "cpu_sec": 0.0, "peak_rss_mb": 0.0})
+        for key in ["calls", "wall_sec", "cpu_sec"]:
+            totals[key] += record[key]
+        totals["peak_rss_mb"] = max(totals["peak_rss_mb"], record["peak_rss_mb"])
+
+
+# This process's totals so far (eg, to send back from a worker process), which are then cleared
+def collect():
+    if not enabled: return dict()
+    records = {name: dict(totals) for name, totals in phases.items()}
+    phases.clear()
+    return records
+
+
+def write():
+    global enabled
+    if not enabled: return
+    while stack:
+        stack.pop().finish()
+    enabled = False
+    totals = phases.pop("total", None)
+    OUT = open(outfile, "w")
+    json.dump({"script": script, "argv": sys.argv, "total": totals, "phases": phases}, OUT, indent=1)
+    OUT.close()
+    print("Wrote profile of", len(phases), "phases to", outfile, file=sys.stderr)
+    if profiler is not None:
+        statsfile = os.path.splitext(outfile)[0] + "." + cprofile_phase + ".prof"
+        profiler.dump_stats(statsfile)
+        print("Wrote cProfile stats for phase", cprofile_phase, "to", statsfile, file=sys.stderr)
+
+
+def cpu_time():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+# Peak resident memory in bytes. Linux keeps a resettable high-water mark (VmHWM); otherwise fall back to getrusage,
+# which is the peak over the whole life of the process
+def read_peak():
+    try:
+        IN = open("/proc/self/status", "r")
+        for line in IN:
+            if line.startswith("VmHWM:"):
+                IN.close()
+                return int(line.split()[1]) * 1024
+        IN.close()
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024     # Bytes on macOS, kilobytes on Linux
+
+
+def reset_peak():
+    try:
+        OUT = open("/proc/self/clear_refs", "w")
+        OUT.write("5")
+        OUT.close()
+    except OSError:
+        pass
@@ -0,0 +1,89 @@
+__author__ = 'jgwall'
+
+# Parser for QIIME principal coordinate (ordination results) files. These look like:
+#   Eigvals<tab>n
+#   <n eigenvalues>
+#
+#   Proportion explained<tab>n
+#   <n proportions>
+#
+#   Species<tab>0<tab>0
+#
+#   Site<tab>nrow<tab>ncol
+#   <sample id><tab><ncol coordinates>
+#   ...
+# Only the first num_pcs coordinates of each sample are split out of the line and converted, straight into a float64 buffer
+
+import numpy as np
+import rawdata
+
+
+class PcFile:
+
+    def __init__(self, ids, coords, eigvals, proportion_explained):
+        self.ids = ids      # Sample IDs, in the same order as the rows of coords
+        self.coords = coords
+        self.eigvals = eigvals
+        self.proportion_explained = proportion_explained
+
+    # Total variance (sum of all eigenvalues), for converting sums of squares to proportion of variance. Files that only
+    # have the first few components (see pcoa.py) still have the right proportions, so the total comes from those
+    @property
+    def total_variance(self):
+        if len(self.proportion_explained) == len(self.eigvals) and np.sum(self.proportion_explained) > 0:
+            return np.sum(self.eigvals) / np.sum(self.proportion_explained)
+        return np.sum(self.eigvals)
+
+
+# Load a PC file, keeping only the first num_pcs coordinates (None = all of them; 0 = skip the coordinates entirely)
+def read_pc_file(infile, num_pcs=None):
+    eigvals, proportion_explained = np.array([]), np.array([])
+    ids, coords = list(), np.empty((0, 0))
+    IN = rawdata.open_raw(infile)
+    for line in IN:
+        if line.startswith("Eigvals"):
+            eigvals = read_vector(IN, line)
+        elif line.startswith("Proportion explained"):
+            proportion_explained = read_vector(IN, line)
+        elif line.startswith("Site\t"):
+            if num_pcs == 0: break
+            ids, coords = read_coords(IN, line, num_pcs)
+            break   # Nothing else of interest after the coordinates
+    IN.close()
+    return PcFile(ids, coords, eigvals, proportion_explained)
+
+
+# Helper function to read the single line of values after an "Eigvals" or "Proportion explained" header
+def read_vector(IN, header):
+    n = int(header.rstrip("\n").split("\t")[1])
+    if n == 0: return np.array([])
+    return np.array(IN.readline().split("\t"), dtype=float)
+
+
+# Helper function to read the coordinate block after the "Site" header
+def read_coords(IN, header, num_pcs):
+    site, nrow, ncol = header.rstrip("\n").split("\t")
+    nrow, ncol = int(nrow), int(ncol)
+    k = ncol if num_pcs is None else min(num_pcs, ncol)
+    ids = list()
+    coords = np.empty((nrow, k), dtype=np.float64)
+    for i, line in enumerate(IN):
+        if line == "\n" or i >= nrow: break  # When hit white space, break out
+        fields = line.split("\t", k + 1)    # Only split off as many fields as needed; the rest stay as one string
+        ids.append(fields[0])
+        coords[i, :] = [float(f) for f in fields[1:k + 1]]
+    return np.array(ids), coords[:len(ids), :]
+
+
+# Write a PC file in the same format QIIME does
+def write_pc_file(pcfile, outfile):
+    OUT = open(outfile, "w")
+    for name, values in [("Eigvals", pcfile.eigvals), ("Proportion explained", pcfile.proportion_explained)]:
+        OUT.write(name + "\t" + str(len(values)) + "\n")
+        OUT.write("\t".join(repr(float(v)) for v in values) + "\n\n")
+    OUT.write("Species\t0\t0\n\n")
+    OUT.write("Site\t" + str(pcfile.coords.shape[0]) + "\t" + str(pcfile.coords.shape[1]) + "\n")
+    for sample, row in zip(pcfile.ids, pcfile.coords):
+        OUT.write(sample + "\t" + "\t".join(repr(float(v)) for v in row) + "\n")
+    OUT.write("\nBiplot\t0\t0\n\nSite constraints\t0\t0\n")
+    OUT.close()
@@ -0,0 +1,252 @@
+__author__ = 'jgwall'
+
+# Access to the raw data files listed in rawdata_md5.txt. Files are read from the extracted 0_RawData/ directory if it's
+# there, or else straight out of 0_RawData.zip as a stream, so the archive never has to be unpacked. Either way each
+# file's MD5 is updated as it is read and checked against rawdata_md5.txt once the end is reached, so verifying costs no
+# extra pass over the data. Only files in a 0_RawData/ directory (or its archive) are checked, so other files that happen
+# to share a name with a raw file (eg, synthetic test data) are read as is. Files that passed are recorded in a small
+# cache next to the raw data (.0_RawData.verified.json), keyed by the size and modification time of the file (or of the
+# archive it came from), and aren't checked again until those change.
+#
+# Scripts keep taking paths like 0_RawData/mapping_with_abundance.txt and call open_raw() instead of open(). Run as a
+# script to verify raw files up front or extract the few that outside tools (R, biom) need as real files.
+
+import argparse
+import fcntl
+import hashlib
+import io
+import json
+import os
+import zipfile
+
+debug = False
+
+md5file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rawdata_md5.txt")
+rawdir = "0_RawData"    # Name of the directory (or <name>.zip archive) whose files are checked
+chunk_size = 2 ** 20    # Bytes read at a time when extracting or checking files
+
+
+def main():
+    args = parse_args()
+    for infile in args.infiles:
+        if args.extract and not os.path.exists(infile):
+            print("Extracting", infile)
+            extract(infile)
+        elif not is_verified(infile):
+            print("Checking", infile)
+            checksum(infile)
+        else:
+            print("Already verified:", infile)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--infiles", nargs="*", help="Raw data files (eg, 0_RawData/mapping_with_abundance.txt)")
+    parser.add_argument("-x", "--extract", default=False, action="store_true",
+                        help="Extract (and verify) files that are only in the archive, for tools that need a real file")
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+# Expected MD5 sums by file name
+def load_md5s(infile=md5file):
+    md5s = dict()
+    if not os.path.exists(infile): return md5s
+    IN = open(infile, "r")
+    for line in IN:
+        if line.strip() == "": continue
+        md5, name = line.split(None, 1)
+        md5s[name.strip()] = md5
+    IN.close()
+    return md5s
+
+
+# Where a raw file lives: (path, None) for a real file, or (archive, member) for one inside <directory>.zip. Archives can
+# hold either the whole directory (0_RawData/x.txt) or just its contents (x.txt).
+def locate(path):
+    if os.path.exists(path): return path, None
+    directory, name = os.path.split(os.path.normpath(path))
+    archive = directory + ".zip"
+    if directory and os.path.exists(archive):
+        ZIP = zipfile.ZipFile(archive)
+        members = set(ZIP.namelist())
+        ZIP.close()
+        for member in [os.path.basename(directory) + "/" + name, name]:
+            if member in members: return archive, member
+    raise FileNotFoundError("ERROR! Could not find raw data file " + path + " or an archive containing it")
+
+
+# The raw data directory a path is in (whether or not it has been extracted), or None if it isn't a raw data file
+def raw_root(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    return directory if os.path.basename(directory) == rawdir else None
+
+
+# Expected MD5 of a raw file, or None if it isn't one (or isn't listed)
+def expected_md5(path):
+    return load_md5s().get(os.path.basename(path)) if raw_root(path) else None
+
+
+# Binary stream that updates an MD5 as it is read from start to end and checks it on reaching the end. Reads after a
+# seek only count while they carry on from where hashing got to. If a file is closed before the end (eg, a parser stops
+# after the part it needs), the rest is read through on close so the check still happens.
+class VerifiedReader(io.RawIOBase):
+
+    def __init__(self, stream, name, expected, source):
+        self.stream = stream
+        self.name = name
+        self.expected = expected    # None = nothing to check against (or already verified)
+        self.source = source        # (path, member) as returned by locate(), for the cache
+        self.md5 = hashlib.md5()
+        self.hashed = 0             # Number of bytes hashed so far
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.stream.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.position = self.stream.seek(offset, whence)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        if self.expected and self.position <= self.hashed < self.position + n:
+            self.md5.update(data[self.hashed - self.position:])
+            self.hashed = self.position + n
+        self.position += n
+        if self.expected and n == 0 and self.hashed == self.position:
+            self.check()
+        return n
+
+    def check(self):
+        if self.md5.hexdigest() != self.expected:
+            raise ValueError("ERROR! MD5 of " + self.name + " (" + self.md5.hexdigest() + ") does not match " +
+                             self.expected + " in " + md5file)
+        record_verified(*self.source)
+        self.expected = None
+
+    def close(self):
+        if not self.closed:
+            if self.expected:
+                self.stream.seek(self.hashed)
+                for chunk in iter(lambda: self.stream.read(chunk_size), b""):
+                    self.md5.update(chunk)
+                self.check()
+            self.stream.close()
+        super().close()
+
+
+# Open a raw file for reading (mode "r" or "rb"), checking it against rawdata_md5.txt as it's read. Use verify=False
+# to just peek at the start of a file without reading the rest of it.
+def open_raw(path, mode="r", verify=True):
+    source, member = locate(path)
+    if member is None:
+        stream = open(source, "rb")
+    else:
+        ZIP = zipfile.ZipFile(source)
+        stream = ZIP.open(member)
+        ZIP.close()     # The member stream keeps the archive file open until it's closed itself
+    expected = expected_md5(path) if verify else None
+    if expected and is_verified(path): expected = None
+    reader = io.BufferedReader(VerifiedReader(stream, path, expected, (source, member)), buffer_size=chunk_size)
+    return reader if mode == "rb" else io.TextIOWrapper(reader, encoding="utf-8")
+
+
+# Whole raw file in a seekable in-memory buffer (eg, for h5py, which jumps around and would be slow on a zip member)
+def read_raw(path):
+    IN = open_raw(path, "rb")
+    data = IN.read()
+    IN.close()
+    return io.BytesIO(data)
+
+
+# Verified MD5 of a raw file; files already in the cache aren't read at all
+def checksum(path):
+    md5 = expected_md5(path)
+    if md5 is None or not is_verified(path):
+        IN = open_raw(path, "rb")
+        hasher = hashlib.md5()
+        for chunk in iter(lambda: IN.read(chunk_size), b""):
+            hasher.update(chunk)
+        IN.close()
+        md5 = hasher.hexdigest()
+    return md5
+
+
+# Write a raw file from the archive out to its path, verifying it on the way
+def extract(path):
+    IN = open_raw(path, "rb")
+    if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpfile = path + ".tmp"
+    OUT = open(tmpfile, "wb")
+    for chunk in iter(lambda: IN.read(chunk_size), b""):
+        OUT.write(chunk)
+    OUT.close()
+    IN.close()
+    os.replace(tmpfile, path)
+    if expected_md5(path): record_verified(path, None)  # Checked while extracting
+
+
+# Cache of verified files: {path or archive:member: [size, mtime]} of the file or archive they were verified from. It
+# sits next to the raw data directory, so it's the same whichever directory scripts are run from.
+def cache_file(source):
+    root = raw_root(source) or os.path.splitext(os.path.abspath(source))[0]     # Archives are <raw data directory>.zip
+    return os.path.join(os.path.dirname(root), "." + os.path.basename(root) + ".verified.json")
+
+
+def cache_key(source, member):
+    return os.path.abspath(source) + (":" + member if member else "")
+
+
+def load_cache(cachefile):
+    if not os.path.exists(cachefile): return dict()
+    IN = open(cachefile, "r")
+    try:
+        cache = json.load(IN)
+    except ValueError:
+        cache = dict()      # Half-written or corrupt; just verify everything again
+    IN.close()
+    return cache
+
+
+def is_verified(path):
+    if not raw_root(path): return False
+    source, member = locate(path)
+    stat = os.stat(source)
+    return load_cache(cache_file(source)).get(cache_key(source, member)) == [stat.st_size, stat.st_mtime]
+
+
+# Several scripts may be verifying files at once, so the cache is updated under a lock to keep from losing entries
+def record_verified(source, member):
+    stat = os.stat(source)
+    cachefile = cache_file(source)
+    LOCK = open(cachefile + ".lock", "w")
+    fcntl.flock(LOCK, fcntl.LOCK_EX)
+    try:
+        cache = load_cache(cachefile)
+        cache[cache_key(source, member)] = [stat.st_size, stat.st_mtime]
+        tmpfile = cachefile + "." + str(os.getpid())
+        OUT = open(tmpfile, "w")
+        json.dump(cache, OUT, indent=1, sort_keys=True)
+        OUT.close()
+        os.replace(tmpfile, cachefile)
+    finally:
+        fcntl.flock(LOCK, fcntl.LOCK_UN)
+        LOCK.close()
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,193 @@
+__author__ = 'jgwall'
+
+# Run the whole analysis (1_CalculateHeritabilities.sh, 2_VarianceComponents.sh and 3_PrettifyGraphics.sh) as one
+# incremental pipeline (see pipeline.py). Every step only reruns if its command, its script or its input files have
+# changed since it last ran successfully, so eg changing a plot option only remakes that plot. Independent steps
+# (like the per-week/location PC heritabilities) run in parallel up to --maxprocs processes.
+
+import argparse
+import glob
+import os
+import pipeline
+from pipeline import Glob, Node
+
+debug = False
+
+rawdir = "0_RawData"
+parsedir = "0a_ParsedData"
+broaddir = "1_BroadHerit"
+vardir = "2_Variances"
+plotdir = "3_PublicationGraphics"
+sets = ["weighted", "unweighted"]
+
+rawzip = rawdir + ".zip"    # Raw files are read from here if rawdir hasn't been extracted (see rawdata.py)
+keyfile = os.path.join(rawdir, "mapping_with_abundance.txt")
+biom = os.path.join(rawdir, "otu_table_80percShared_relAbundance.biom")
+biom_log = os.path.join(parsedir, "0a_otu_table.log_transformed.txt")
+splitdir = os.path.join(broaddir, "1c_split_distances")
+pcdir = os.path.join(broaddir, "1d_split_pcs")
+biomdir = os.path.join(broaddir, "1e_pc_biom_files")
+outdir = os.path.join(broaddir, "1f_pc_heirtability")
+
+n_perms = 5000
+perms_per_block = 100
+
+
+def main():
+    args = parse_args()
+    runner = pipeline.Pipeline(args.statefile, maxprocs=args.maxprocs, force=args.force, dry_run=args.dry_run)
+    for node in make_nodes(args.maxprocs, args.stages):
+        runner.add(node)
+    finished, failed, waiting = runner.run()
+    print("Finished", len(finished), "steps;", len(failed), "failed;", len(waiting), "could not run")
+    for name in sorted(failed):
+        print("\tFailed:", name)
+    if failed or waiting:
+        raise SystemExit(1)
+
+
+def make_nodes(maxprocs, stages):
+    nodes = list()
+    if 1 in stages:
+        nodes += otu_heritability_nodes(maxprocs) + pc_heritability_nodes(maxprocs)
+    if 2 in stages:
+        nodes += variance_nodes(stages)
+    if 3 in stages:
+        nodes += figure_nodes(stages)
+    return nodes
+
+
+# OTU heritabilities (first half of 1_CalculateHeritabilities.sh)
+def otu_heritability_nodes(maxprocs):
+    nodes = [
+        Node("extract_raw", ["python3", "rawdata.py", "--extract", "-i", keyfile, biom], inputs=[rawzip, "rawdata_md5.txt"],
+             outputs=[keyfile, biom]),     # biom and R need real files
+        Node("biom_summary.samples", ["biom", "summarize-table", "-i", biom, "-o", os.path.join(parsedir, "0a_biom_summary.samples.txt")],
+             inputs=[biom], outputs=[os.path.join(parsedir, "0a_biom_summary.samples.txt")], deps=["extract_raw"]),
+        Node("biom_summary.observations", ["biom", "summarize-table", "-i", biom, "-o", os.path.join(parsedir, "0a_biom_summary.observations.txt"),
+             "--observations"], inputs=[biom], outputs=[os.path.join(parsedir, "0a_biom_summary.observations.txt")], deps=["extract_raw"]),
+        Node("log_transform", ["python3", "1a_LogTransformBiom.py", "-i", biom, "-o", biom_log], inputs=[biom, rawzip],
+             outputs=[biom_log], deps=["extract_raw"])]
+
+    # Permutations run in checkpointed blocks (see 1a_RunPermutationBlocks.py), so an interrupted run picks up where it
+    # left off; the block files aren't outputs, so they survive reruns of this node
+    combined = os.path.join(broaddir, "1b_otu_heritabilities.combined.txt")
+    nodes.append(Node("otu_herits.combined",
+        ["python3", "1a_RunPermutationBlocks.py", "--perms", str(n_perms), "--block-size", str(perms_per_block), "--seed", "1",
+         "-d", os.path.join(broaddir, "1a_otu_heritabilities.blocks"), "-o", combined, "--",
+         "Rscript", "1a_BroadSenseHeritability.r", "-i", biom_log, "-k", keyfile, "--num-cores", str(maxprocs),
+         "--covariates", "Seq_Count_80Perc + (1|AGE) + (1|ENV)", "--rescale", "Seq_Count_80Perc"],
+        inputs=[biom_log, keyfile, "1a_BroadSenseHeritability.r", "1b_RecombineHeritabilities.py"], outputs=[combined],
+        deps=["log_transform", "extract_raw"], procs=maxprocs))
+    nodes.append(Node("otu_herits.plot", ["python3", "1b_PlotHeritabilities.py", "-i", combined, "-o", combined.replace(".txt", ".png")],
+                      inputs=[combined], outputs=[combined.replace(".txt", ".png")],
+                      deps=["otu_herits.combined"]))
+    return nodes
+
+
+# PC heritabilities by week and location (second half of 1_CalculateHeritabilities.sh). The splits aren't known until
+# the distance matrices have been split, so the per-split steps are added once the PC files exist.
+def pc_heritability_nodes(maxprocs):
+    nodes = list()
+    for set in sets:
+        distances = os.path.join(rawdir, set + "_unifrac_dm.txt")
+        splitprefix = os.path.join(splitdir, "1c_distances." + set)
+        store = os.path.join(splitdir, set + "_unifrac_dm.dm")
+        nodes.append(Node("split." + set, ["python3", "1c_SplitDistanceMatrices.py", "-i", distances, "-o", splitprefix, "-k", keyfile,
+                                           "--splits", "AGE_fixed", "ENV", "--rebuild"],   # Rerunning means the matrix may have changed
+                          inputs=[distances, keyfile, rawzip], outputs=[splitprefix + ".splits.txt", store + ".bin", store + ".ids"],
+                          deps=["extract_raw"]))
+        nodes.append(Node("pcoa." + set, ["python3", "1c_PrincipalCoordinates.py", "-i", splitprefix + ".splits.txt", "-o", pcdir, "--num-pcs", "5"],
+                          inputs=[splitprefix + ".splits.txt", store + ".bin", store + ".ids"],
+                          outputs=[os.path.join(pcdir, "pcoa_1c_distances." + set + ".*.txt")], deps=["split." + set]))
+        pcfiles = os.path.join(pcdir, "pcoa_1c_distances." + set + ".*.txt")
+        nodes.append(Node("pc_biom." + set, ["python3", "1c_ConvertQiimePcsToFakeBiomFile.py", "-i", Glob(pcfiles), "--batch-outdir", biomdir,
+                                             "--num-pcs", "5", "--num-procs", str(maxprocs)],
+                          inputs=[pcfiles], outputs=[os.path.join(biomdir, "1e_" + set + ".*.biom.txt")],
+                          deps=["pcoa." + set], procs=maxprocs, expand=per_split_nodes(set),
+                          clears=[os.path.join(outdir, "1f_" + set + ".*"), os.path.join(outdir, "1e_" + set + ".*")]))  # Everything per_split_nodes() makes
+
+    herits = os.path.join(outdir, "*heritabilities.txt")
+    nodes.append(Node("pc_herits.summary", ["python3", "1d_SummarizePcHeritabilities.py", "-i", Glob(herits),
+                                            "-o", os.path.join(broaddir, "1g_pc_heritabilities.summary.txt"),
+                                            "-g", os.path.join(broaddir, "1g_pc_heritabilities.pretty.png")],
+                      inputs=[herits],
+                      outputs=[os.path.join(broaddir, "1g_pc_heritabilities.summary.txt"), os.path.join(broaddir, "1g_pc_heritabilities.pretty.png")],
+                      deps=["pc_biom." + set for set in sets]))
+    return nodes
+
+
+# Heritability and plot for each split of one distance type
+def per_split_nodes(set):
+    def expand():
+        nodes = list()
+        for biomfile in sorted(glob.glob(os.path.join(biomdir, "1e_" + set + ".*.biom.txt"))):
+            stem = os.path.basename(biomfile)[len("1e_"):-len(".biom.txt")]
+            herits = os.path.join(outdir, "1f_" + stem + ".heritabilities.txt")
+            blups = os.path.join(outdir, "1e_" + stem + ".blups.txt")
+            nodes.append(Node("pc_herits." + stem, ["python3", "1a_BroadSenseHeritability.py", "-i", biomfile, "-o", blups, "-k", keyfile,
+                                                    "--heritfile", herits, "--random-perms", "1000", "--seed", "1"],
+                              inputs=[biomfile, keyfile, rawzip], outputs=[herits, blups]))
+            nodes.append(Node("pc_herits.plot." + stem, ["python3", "1b_PlotHeritabilities.py", "-i", herits, "-o", herits.replace(".txt", ".png")],
+                              inputs=[herits], outputs=[herits.replace(".txt", ".png")],
+                              deps=["pc_herits." + stem]))
+        return nodes
+    return expand
+
+
+# Variance components of PCs (2_VarianceComponents.sh)
+def variance_nodes(stages):
+    nodes = list()
+    for set in sets:
+        pcfile = os.path.join(rawdir, set + "_unifrac_pc.txt")
+        outprefix = os.path.join(vardir, "2a_" + set + "_pcs.sum_squares")
+        nodes.append(Node("variance." + set, ["python3", "2_QuantifyVarianceComponents.py", "-i", pcfile, "--num-pcs", "20", "-o", outprefix,
+                                              "-k", keyfile],
+                          inputs=[pcfile, keyfile, rawzip], outputs=[outprefix + ".txt"], deps=["extract_raw"] if 1 in stages else []))
+    return nodes
+
+
+# Publication figures (3_PrettifyGraphics.sh), one step per figure. 3_MakeFigures.py imports each figure's script by name,
+# so those are listed as inputs (their own imports are picked up from them). Dependencies on earlier stages only apply if
+# those stages are being run too.
+def figure_nodes(stages):
+    nodes = list()
+    figure = ["python3", "3_MakeFigures.py", "--rawdir", rawdir, "--broaddir", broaddir, "--vardir", vardir, "--plotdir", plotdir,
+              "--num-procs", "1", "--only"]
+    for set in sets:
+        sumsquares = os.path.join(vardir, "2a_" + set + "_pcs.sum_squares.txt")
+        nodes.append(Node("figure.3a." + set, figure + ["3a_sum_squares." + set],
+                          inputs=[sumsquares, os.path.join(rawdir, set + "_unifrac_pc.txt"), rawzip, "3a_PlotSumSquaresPretty.py"],
+                          outputs=[os.path.join(plotdir, "3a_sum_squares." + set + ".png")],
+                          deps=["variance." + set] if 2 in stages else []))
+        herits = os.path.join(outdir, "1f_" + set + "*heritabilities.txt")
+        nodes.append(Node("figure.3b." + set, figure + ["3b_" + set + "_pc_heritabilities"],
+                          inputs=[herits, "3b_SummarizePcHeritabilities_pretty.py"],
+                          outputs=[os.path.join(plotdir, "3b_" + set + "_pc_heritabilities.summary.png")],
+                          deps=["pc_biom." + set] if 1 in stages else []))
+    combined = os.path.join(broaddir, "1b_otu_heritabilities.combined.txt")
+    nodes.append(Node("figure.3c", figure + ["3c_broad_heritabilities"],
+                      inputs=[combined, biom, rawzip, "3c_PlotOtuHeritabilities_two_column.py"],
+                      outputs=[os.path.join(plotdir, "3c_broad_heritabilities.png")],
+                      deps=["otu_herits.combined"] if 1 in stages else []))
+    return nodes
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--maxprocs", type=int, default=8, help="Maximum number of processes to run at once")
+    parser.add_argument("-s", "--stages", type=int, nargs="*", default=[1, 2, 3], help="Which stages (numbered scripts) to run")
+    parser.add_argument("-f", "--force", nargs="*", default=[], help="Names of steps to rerun even if they are up to date")
+    parser.add_argument("-n", "--dry-run", default=False, action="store_true", help="Only print what would be run")
+    parser.add_argument("--statefile", default=".pipeline_state.json", help="File recording the inputs each step was last run with")
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,131 @@
+__author__ = 'jgwall'
+
+# Display names for OTUs from the taxonomy in a BIOM file's observation metadata. Only the metadata is read (never the
+# counts), names are only worked out for the OTUs asked for, and resolved names are saved to a cache file named after
+# the BIOM file's MD5 checksum. Once every name asked for is in the cache, the BIOM file isn't parsed at all (and if
+# it's a verified raw file, see rawdata.py, it isn't even read to get the checksum).
+
+import biom_loader
+import json
+import numpy as np
+import os
+import profiling
+import rawdata
+import re
+
+
+# Lineages ([k__..., p__..., ...]) of each OTU, from the observation metadata only
+class TaxonomyIndex:
+
+    def __init__(self, ids, lineages):
+        self.lineages = dict(zip(ids, lineages))
+
+    def names(self, otus):
+        with profiling.phase("make_otu_key"):
+            return make_otu_key(otus, [self.lineages[otu] for otu in otus])
+
+
+def load_index(biomfile):
+    if biom_loader.is_hdf5(biomfile):
+        ids, lineages = load_hdf5_taxonomy(biomfile)
+    else:
+        ids, lineages = load_json_taxonomy(biomfile)
+    return TaxonomyIndex(ids, lineages)
+
+
+# BIOM 2.x keeps taxonomy as a 2D array of clades (padded with empty strings) under observation/metadata
+def load_hdf5_taxonomy(biomfile):
+    import h5py
+    with h5py.File(rawdata.read_raw(biomfile), "r") as h5:
+        ids = [biom_loader.decode(i) for i in h5["observation/ids"][:]]
+        taxonomy = h5["observation/metadata/taxonomy"][:]
+    lineages = list()
+    for row in taxonomy:
+        if np.ndim(row) == 0: row = biom_loader.decode(row).split(";")  # Older files with one string per OTU
+        lineages.append([biom_loader.decode(c).strip() for c in row if biom_loader.decode(c).strip() != ""])
+    return ids, lineages
+
+
+# BIOM 1.0 has to be parsed as a whole, but the data matrix is never built
+def load_json_taxonomy(biomfile):
+    IN = rawdata.open_raw(biomfile)
+    rows = json.load(IN)["rows"]
+    IN.close()
+    return [r["id"] for r in rows], [r["metadata"]["taxonomy"] for r in rows]
+
+
+# Names for the given OTU IDs, using the cache where possible and only loading the BIOM file for the rest
+def resolve_names(biomfile, otus, cachedir):
+    cachefile = os.path.join(cachedir, rawdata.checksum(biomfile) + ".taxonomy_names.txt")
+    names = read_cache(cachefile)
+    missing = [otu for otu in dict.fromkeys(otus) if otu not in names]
+    if len(missing) > 0:
+        print("\tResolving taxonomy for", len(missing), "OTUs from", biomfile)
+        with profiling.phase("load_taxonomy"):
+            index = load_index(biomfile)
+        new_names = index.names(missing)
+        append_cache(cachefile, new_names)
+        names.update(new_names)
+    else:
+        print("\tAll", len(otus), "taxonomy names found in cache", cachefile)
+    return {otu: names[otu] for otu in otus}
+
+
+# Cache files are OTU<tab>name, one per line
+def read_cache(cachefile):
+    names = dict()
+    if not os.path.exists(cachefile): return names
+    IN = open(cachefile, "r")
+    for line in IN:
+        otu, name = line.rstrip("\n").split("\t")
+        names[otu] = name
+    IN.close()
+    return names
+
+
+def append_cache(cachefile, names):
+    if not os.path.exists(os.path.dirname(cachefile) or "."): os.makedirs(os.path.dirname(cachefile))
+    OUT = open(cachefile, "a")
+    for otu, name in names.items():
+        OUT.write(otu + "\t" + name + "\n")
+    OUT.close()
+
+
+def make_otu_key(ids, taxonomy):
+    key = dict()
+    for id, lineage in zip(ids, taxonomy):
+        # print(id,"\n\t",lineage)
+        myname = "UNKNOWN"
+        clades = [re.sub("^.__", string=l, repl="") for l in lineage]
+        # If not assigned
+        if clades[0] == 'Unassigned':
+            key[id] = "Unassigned"
+            continue
+        # If have genus and species, use
+        if (len(clades) > 1) and (clades[-1] != "") and (clades[-2] != ""):
+            myname = clades[-2] + " " + clades[-1]
+            key[id] = myname
+            continue
+        # Otherwise, take last level
+        for i in range(1, len(clades) + 1):
+            if clades[-i] == "": continue
+            level = find_level(lineage[-i])
+            if level == 'genus':
+                myname = clades[-i] + " sp."
+            else:
+                myname = "Unnamed " + level + " " + clades[-i]
+            break  # Break so take the last available one
+        key[id] = myname
+        # print("\t", myname)
+    return key
+
+
+def find_level(clade):
+    if clade.startswith("k__"): return "kingdom"
+    if clade.startswith("p__"): return "phylum"
+    if clade.startswith("c__"): return "class"
+    if clade.startswith("o__"): return "order"
+    if clade.startswith("f__"): return "family"
+    if clade.startswith("g__"): return "genus"
+    if clade.startswith("s__"): return "species"
+    return "unkown_level"
@@ -0,0 +1,55 @@
+__author__ = 'jgwall'
+
+# Parsed PC trait names (eg, "trait_unweighted.week05.Ithaca_PC2") for the 1d/3b summaries. All names are parsed in one
+# vectorized pass, and the table is indexed by location ("<distance type>:<field>") so each week x PC heatmap matrix is
+# a lookup plus a single pivot.
+
+import numpy as np
+import pandas as pd
+import profiling
+
+# For patterns of trait_unweighted.week05.Ithaca_PC2
+pattern = r'trait_(?P<method>.+)\.week(?P<age>.+)\.(?P<field>.+)_(?P<pc>PC.+)'
+weeks = list(range(1, 16)) + [20]   # Every heatmap gets at least these weeks...
+pcs = ["PC1", "PC2", "PC3", "PC4", "PC5"]    # ...and these PCs, filled with NaN where missing
+
+
+# Add method/age/field/pc columns and location (method + field) to a table of results indexed by trait name
+def parse_traits(data):
+    parsed = pd.Series(data.index, index=data.index).str.extract(pattern)
+    unparsed = parsed['method'].isnull()
+    if unparsed.any():
+        raise ValueError("ERROR! Could not parse trait names: " + ", ".join(data.index[unparsed][:5]))
+    parsed['age'] = parsed['age'].astype(int)
+    parsed['location'] = parsed['method'] + ":" + parsed['field']  # Name = type of distance matrix + location
+    return data.join(parsed)
+
+
+class TraitTable:
+
+    def __init__(self, data):
+        self.data = data.reset_index().rename(columns={'index': 'trait'}).set_index('location').sort_index()
+        self.locations = sorted(self.data.index.unique())
+        self.ages = sorted(self.data['age'].unique())
+        self.pcs = sorted(self.data['pc'].unique(), key=pc_number)
+
+    # Data matrix to plot, with weeks in rows and PCs in columns
+    def matrix(self, location, key):
+        with profiling.phase("make_data_matrix"):
+            return self.pivot(location, key)
+
+    def pivot(self, location, key):
+        subdata = self.data.loc[[location]]
+        duplicated = subdata.duplicated(['age', 'pc'], keep=False)
+        for trait, myweek, mypc, myval in zip(subdata['trait'][duplicated], subdata['age'][duplicated],
+                                              subdata['pc'][duplicated], subdata[key][duplicated]):
+            print("WARNING! Data for location", location, "age", myweek, "and PC", mypc, "has multiple values! Trait:",
+                  trait, ":", key, ":", myval)
+        subdata = subdata.drop_duplicates(['age', 'pc'], keep='last')
+        matrix = subdata.pivot(index='age', columns='pc', values=key)
+        return matrix.reindex(index=sorted(set(weeks) | set(matrix.index)),
+                              columns=sorted(set(pcs) | set(matrix.columns), key=pc_number))
+
+
+def pc_number(pc):
+    return int(pc[len("PC"):]) if pc[len("PC"):].isdigit() else np.inf
@@ -0,0 +1,80 @@
+__author__ = 'jgwall'
+
+# Sums of squares for the week*location*inbred model of 2_QuantifyVarianceComponents.r, for many responses at once.
+# The sum-contrast design matrix is built once and orthogonalized once, term by term, and then every response column
+# is projected onto it together. This gives the same sequential (type I) sums of squares as anova(lm(...)), with
+# aliased columns dropped the same way lm() does. Type III sums of squares (each term dropped from the full model in turn)
+# are also available, at the cost of one extra factorization per term.
+
+import numpy as np
+import pandas as pd
+
+factors = ["week", "location", "inbred"]
+terms = ["week", "location", "inbred", "week:location", "week:inbred", "location:inbred", "week:location:inbred"]  # R's order
+tolerance = 1e-7    # Relative size below which a column counts as aliased (as in lm's QR)
+
+
+# Sum-to-zero contrasts for one factor (R's contr.sum): one column per level except the last, which gets -1 everywhere
+def sum_contrasts(values):
+    levels, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    contrasts = np.zeros((len(codes), len(levels) - 1))
+    for i in range(len(levels) - 1):
+        contrasts[codes == i, i] = 1
+    contrasts[codes == len(levels) - 1, :] = -1
+    return contrasts
+
+
+# Design matrix blocks for each term; interactions are the row-wise products of their factors' contrast columns
+def design_blocks(data):
+    contrasts = {f: sum_contrasts(data[f]) for f in factors}
+    blocks = list()
+    for term in terms:
+        block = np.ones((len(data), 1))
+        for f in term.split(":"):
+            block = (block[:, :, np.newaxis] * contrasts[f][:, np.newaxis, :]).reshape(len(data), -1)
+        blocks.append(block)
+    return blocks
+
+
+# Orthonormal basis for the part of each block not already explained by the blocks before it (ie, a blockwise QR)
+def orthogonalize(blocks, nrow):
+    basis = [np.ones((nrow, 1)) / np.sqrt(nrow)]    # Intercept
+    for block in blocks:
+        previous = np.hstack(basis)
+        resid = block - previous @ (previous.T @ block)
+        resid -= previous @ (previous.T @ resid)    # Second pass to keep things orthogonal
+        u, s, vt = np.linalg.svd(resid, full_matrices=False)
+        scale = np.max(np.linalg.norm(block, axis=0)) if block.size else 0
+        basis.append(u[:, s > tolerance * scale])
+    return basis
+
+
+# Sequential (type I) sums of squares for each term plus Residuals; responses are the columns of Y
+def sequential_ss(data, Y):
+    Y = np.asarray(Y, dtype=float)
+    basis = orthogonalize(design_blocks(data), len(Y))
+    ss = [np.sum((b.T @ Y) ** 2, axis=0) for b in basis[1:]]
+    ss.append(residual_ss(basis, Y))
+    return np.array(ss)
+
+
+# Type III sums of squares: increase in residual sum of squares when each term is dropped from the full model
+def type3_ss(data, Y):
+    Y = np.asarray(Y, dtype=float)
+    blocks = design_blocks(data)
+    full_resid = residual_ss(orthogonalize(blocks, len(Y)), Y)
+    ss = [residual_ss(orthogonalize(blocks[:i] + blocks[i + 1:], len(Y)), Y) - full_resid for i in range(len(blocks))]
+    ss.append(full_resid)
+    return np.array(ss)
+
+
+def residual_ss(basis, Y):
+    full = np.hstack(basis)
+    return np.sum((Y - full @ (full.T @ Y)) ** 2, axis=0)
+
+
+# Table in the same layout as 2_QuantifyVarianceComponents.r: one row per term plus Residuals, one column per PC
+def sum_squares_table(data, pcs, ss_type=1):
+    calculator = sequential_ss if ss_type == 1 else type3_ss
+    ss = calculator(data, data[pcs])
+    return pd.DataFrame(ss, index=terms + ["Residuals"], columns=pcs)
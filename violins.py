@@ -0,0 +1,135 @@
+__author__ = 'jgwall'
+
+# Batched replacement for calling ax.violinplot() once per trait. Densities for every column of a (perms x traits)
+# array are estimated together in one pass: each column gets a grid of the same number of points spanning its own
+# range (so a trait with a narrow null distribution is as finely resolved as one with a wide one), values are binned
+# onto their column's grid, and then all columns are smoothed with a Gaussian kernel (Scott's rule bandwidth, the same
+# default as violinplot) by FFT convolution. All bodies are drawn as a single
+# PolyCollection and all bars as a single LineCollection, so the artist count (and SVG size) doesn't grow with the
+# number of traits. For very wide plots, style="box" draws interquartile boxes with min-max whiskers and medians instead.
+#
+# As with violinplot, each violin only covers its own data range and is scaled so its widest point is the given width.
+# NaNs (eg, permutations skipped in adaptive mode) are ignored. Instead of an array of values, distributions can also be
+# drawn from a herit_stats.PermutationSketch (summary-only tables), whose histograms are smoothed the same way.
+
+import numpy as np
+from herit_stats import PermutationSketch
+
+grid_points = 512   # Number of points in each column's density grid
+outline_points = 100    # Points down each side of a violin (same as violinplot)
+
+
+def draw_distributions(ax, values, positions, style="violin", width=0.5, color="darkblue", alpha=0.5, bar_width=1,
+                       show_mins=True, show_maxes=True):
+    from matplotlib.collections import LineCollection, PolyCollection
+    positions = np.asarray(positions, dtype=float)
+    if isinstance(values, PermutationSketch):
+        mins, maxes = values.perm_min(), values.perm_max()
+    else:
+        values = np.asarray(values, dtype=float)
+        mins, maxes = np.nanmin(values, axis=0), np.nanmax(values, axis=0)
+    if style == "violin":
+        grid, densities = sketch_densities(values) if isinstance(values, PermutationSketch) else column_densities(values)
+        bodies = violin_polygons(grid, densities, mins, maxes, positions, width)
+        bars = extrema_segments(mins, maxes, positions, width, show_mins, show_maxes)
+    elif style == "box":
+        quantiles = [0, 0.25, 0.5, 0.75, 1]
+        if isinstance(values, PermutationSketch):
+            quartiles = values.quantiles(quantiles)
+        else:
+            keep = np.any(np.isfinite(values), axis=0)
+            quartiles = np.full((len(quantiles), values.shape[1]), np.nan)
+            quartiles[:, keep] = np.nanpercentile(values[:, keep], [q * 100 for q in quantiles], axis=0)
+        bodies, bars = box_shapes(quartiles, positions, width)
+    else:
+        raise ValueError("Unknown distribution style '" + str(style) + "'; must be 'violin' or 'box'")
+    bodies = PolyCollection(bodies, facecolors=color, edgecolors="none", alpha=alpha)
+    bars = LineCollection(bars, colors=color, linewidths=bar_width)
+    ax.add_collection(bodies)
+    ax.add_collection(bars)
+    ax.autoscale_view()
+    return bodies, bars
+
+
+# Kernel density of each column on a grid spanning that column's range; returns the grids and densities, both as
+# (grid points x columns) arrays
+def column_densities(values, n_points=grid_points):
+    finite = np.isfinite(values)
+    counts = np.sum(finite, axis=0)
+    lo = np.min(np.where(finite, values, np.inf), axis=0)
+    hi = np.max(np.where(finite, values, -np.inf), axis=0)
+    lo[counts == 0], hi[counts == 0] = 0, 1     # Columns with nothing to draw
+    hi = np.where(hi > lo, hi, lo + 1)
+    step = (hi - lo) / (n_points - 1)
+    grid = lo[np.newaxis, :] + np.arange(n_points)[:, np.newaxis] * step[np.newaxis, :]
+
+    # Linear binning of each value onto its two neighbouring grid points
+    rows, cols = np.nonzero(finite)
+    position = (values[rows, cols] - lo[cols]) / step[cols]
+    left = np.minimum(np.floor(position).astype(int), n_points - 2)
+    frac = position - left
+    binned = np.zeros(n_points * values.shape[1])
+    np.add.at(binned, left * values.shape[1] + cols, 1 - frac)
+    np.add.at(binned, (left + 1) * values.shape[1] + cols, frac)
+    binned = binned.reshape(n_points, values.shape[1])
+
+    # Scott's rule bandwidth, in grid units
+    sigma = np.nanstd(values, axis=0, ddof=1) * np.power(np.maximum(counts, 1), -1 / 5) / step
+    return grid, smooth(binned, sigma)
+
+
+# Densities from a sketch's histograms, on the grid of bin centers (the same for every column, since all histograms
+# share their bins)
+def sketch_densities(sketch):
+    bins = sketch.histogram.shape[1]
+    edges = np.linspace(sketch.lo, sketch.hi, bins + 1)
+    grid = np.repeat(((edges[:-1] + edges[1:]) / 2)[:, np.newaxis], sketch.histogram.shape[0], axis=1)
+    sigma = sketch.sd() * np.power(np.maximum(sketch.n_perms, 1), -1 / 5) / (edges[1] - edges[0])
+    return grid, smooth(sketch.histogram.T.astype(float), sigma)
+
+
+# Gaussian smoothing of each column of binned counts by FFT, with a per-column bandwidth (sigma, in grid units); padding
+# keeps kernel tails from wrapping around
+def smooth(binned, sigma):
+    n_points = binned.shape[0]
+    sigma = np.where(np.isfinite(sigma), sigma, 0)
+    size = int(2 ** np.ceil(np.log2(n_points + 2 * np.ceil(4 * min(np.max(sigma, initial=0), n_points)) + 1)))
+    freqs = np.fft.rfftfreq(size)
+    kernels = np.exp(-2 * (np.pi * freqs[:, np.newaxis] * sigma[np.newaxis, :]) ** 2)
+    densities = np.fft.irfft(np.fft.rfft(binned, size, axis=0) * kernels, size, axis=0)[:n_points, :]
+    return np.maximum(densities, 0)
+
+
+def violin_polygons(grid, densities, mins, maxes, positions, width):
+    polygons = list()
+    for j in np.flatnonzero(np.isfinite(mins)):
+        y = np.linspace(mins[j], maxes[j], outline_points)
+        half = np.interp(y, grid[:, j], densities[:, j])
+        if np.max(half) > 0: half = half / np.max(half) * width / 2
+        polygons.append(np.column_stack([np.concatenate([positions[j] - half, positions[j] + half[::-1]]),
+                                         np.concatenate([y, y[::-1]])]))
+    return polygons
+
+
+# Vertical min-max bars plus horizontal caps, like violinplot's cbars/cmins/cmaxes
+def extrema_segments(mins, maxes, positions, width, show_mins=True, show_maxes=True):
+    keep = np.isfinite(mins)
+    x, mins, maxes = positions[keep], mins[keep], maxes[keep]
+    segments = [np.stack([np.column_stack([x, mins]), np.column_stack([x, maxes])], axis=1)]
+    for show, y in [(show_mins, mins), (show_maxes, maxes)]:
+        if show:
+            segments.append(np.stack([np.column_stack([x - width / 4, y]), np.column_stack([x + width / 4, y])], axis=1))
+    return np.concatenate(segments)
+
+
+# Interquartile boxes, plus whiskers out to the min and max and a line at the median, from (min, quartiles, max) x columns
+def box_shapes(quartiles, positions, width):
+    keep = np.isfinite(quartiles[0])
+    q0, q25, q50, q75, q100 = quartiles[:, keep]
+    x, half = positions[keep], width / 2
+    boxes = np.stack([np.column_stack([x - half, q25]), np.column_stack([x + half, q25]),
+                      np.column_stack([x + half, q75]), np.column_stack([x - half, q75])], axis=1)
+    lines = np.concatenate([np.stack([np.column_stack([x, q0]), np.column_stack([x, q25])], axis=1),
+                            np.stack([np.column_stack([x, q75]), np.column_stack([x, q100])], axis=1),
+                            np.stack([np.column_stack([x - half, q50]), np.column_stack([x + half, q50])], axis=1)])
+    return boxes, lines
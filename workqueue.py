@@ -0,0 +1,223 @@
+__author__ = 'jgwall'
+
+# A work queue kept entirely in a shared directory, so workers on any node that can see it (eg, over NFS) can share out
+# a big batch of commands. Each task is a small JSON file that moves between subdirectories as it's worked on:
+#   pending/  - waiting to be run
+#   claimed/  - being run; the file's modification time is the worker's lease, which it renews while the task runs
+#   done/     - finished; its output is in results/
+#   failed/   - failed --max-attempts times (see logs/ for why)
+# A worker claims a task by renaming it from pending/ to claimed/, which only one worker can do, since rename is atomic
+# within a filesystem. If a worker dies, its lease stops being renewed, and once it expires any worker (or the
+# coordinator) moves the task back to pending/. A task's command writes to the placeholder "{output}", which is a
+# per-attempt file in results/ that is renamed to results/<task>.txt only once the command succeeds, so a task that
+# ends up run twice (eg, if a slow worker's lease ran out) is harmless.
+#
+# Run as a script to start a worker, which runs tasks until there are none left: python3 workqueue.py -q queue_dir
+# 1a_QueueHeritabilities.py is the coordinator that fills a queue with heritability tasks and merges the results.
+
+import argparse
+import glob
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+
+debug = False
+
+output_placeholder = "{output}"
+
+
+def main():
+    args = parse_args()
+    queue = Queue(args.queue)
+    worker = args.worker if args.worker else worker_id()
+    print("Worker", worker, "taking tasks from", args.queue)
+    n_run = work(queue, worker, lease=args.lease, poll=args.poll, max_attempts=args.max_attempts)
+    print("Worker", worker, "ran", n_run, "tasks; none left to claim")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-q", "--queue", help="Queue directory")
+    parser.add_argument("-w", "--worker", help="Name for this worker in logs (default: <host>.<process id>)")
+    parser.add_argument("-l", "--lease", type=float, default=600, help="Seconds without a renewal before a claimed task is given to someone else")
+    parser.add_argument("--poll", type=float, default=10, help="Seconds to wait between checks while other workers' tasks are running")
+    parser.add_argument("-m", "--max-attempts", type=int, default=3, help="Number of times to try a task before moving it to failed/")
+    parser.add_argument("--debug", default=False, action="store_true")
+    args = parser.parse_args()
+
+    # Handle debug flag
+    global debug
+    debug = args.debug
+
+    return parser.parse_args()
+
+
+def worker_id():
+    return socket.gethostname() + "." + str(os.getpid())
+
+
+class Queue:
+
+    states = ["pending", "claimed", "done", "failed"]
+
+    def __init__(self, path):
+        self.path = path
+        for subdir in self.states + ["results", "logs"]:
+            os.makedirs(os.path.join(path, subdir), exist_ok=True)
+
+    def task_file(self, state, task_id):
+        return os.path.join(self.path, state, task_id + ".json")
+
+    def result_file(self, task_id):
+        return os.path.join(self.path, "results", task_id + ".txt")
+
+    def log_file(self, task_id):
+        return os.path.join(self.path, "logs", task_id + ".log")
+
+    def task_ids(self, state):
+        return sorted(os.path.basename(f)[:-len(".json")] for f in glob.glob(os.path.join(self.path, state, "*.json")))
+
+    def is_done(self, task_id):
+        return os.path.exists(self.task_file("done", task_id)) and os.path.exists(self.result_file(task_id))
+
+    # Add a task (unless it's already queued or done); failed tasks get a fresh set of attempts
+    def submit(self, task_id, cmd, cwd=None):
+        if self.is_done(task_id): return False
+        if os.path.exists(self.task_file("pending", task_id)) or os.path.exists(self.task_file("claimed", task_id)): return False
+        if os.path.exists(self.task_file("failed", task_id)): os.remove(self.task_file("failed", task_id))
+        task = {"id": task_id, "cmd": cmd, "cwd": os.path.abspath(cwd if cwd else os.getcwd()), "attempts": 0}
+        write_json(task, self.task_file("pending", task_id))
+        return True
+
+    # Claim the next pending task, or return None if there aren't any
+    def claim(self, worker):
+        for task_id in self.task_ids("pending"):
+            claimed = self.task_file("claimed", task_id)
+            try:
+                os.rename(self.task_file("pending", task_id), claimed)
+                os.utime(claimed)   # Start the lease now, not when the task was submitted
+                task = read_json(claimed)
+            except FileNotFoundError:
+                continue    # Another worker got it first (or its old timestamp looked expired and it was requeued)
+            if self.is_done(task_id):   # Finished by a worker whose lease had expired
+                remove_if_exists(claimed)
+                continue
+            task["worker"] = worker
+            return task
+        return None
+
+    # Renew the lease on a claimed task; False if it was taken back in the meantime
+    def renew(self, task_id):
+        try:
+            os.utime(self.task_file("claimed", task_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, task):
+        write_json(task, self.task_file("done", task["id"]))
+        remove_if_exists(self.task_file("claimed", task["id"]))
+
+    # Put a failed task back in pending/, or in failed/ once it has used up its attempts
+    def fail(self, task, max_attempts):
+        task = dict(task, attempts=task["attempts"] + 1)
+        write_json(task, self.task_file("failed" if task["attempts"] >= max_attempts else "pending", task["id"]))
+        remove_if_exists(self.task_file("claimed", task["id"]))
+
+    # Move claimed tasks whose lease has run out back to pending/; returns their IDs
+    def requeue_expired(self, lease):
+        expired = list()
+        for task_id in self.task_ids("claimed"):
+            claimed = self.task_file("claimed", task_id)
+            try:
+                if time.time() - os.path.getmtime(claimed) < lease: continue
+                os.rename(claimed, self.task_file("pending", task_id))
+            except FileNotFoundError:
+                continue    # Finished or requeued by someone else
+            expired.append(task_id)
+        return expired
+
+    def counts(self):
+        return {state: len(self.task_ids(state)) for state in self.states}
+
+
+# Run tasks until none are pending or claimed. Tasks claimed by others are waited on, in case their leases run out.
+def work(queue, worker, lease=600, poll=10, max_attempts=3):
+    n_run = 0
+    while True:
+        task = queue.claim(worker)
+        if task is not None:
+            run_task(queue, task, lease, max_attempts)
+            n_run += 1
+            continue
+        if not queue.task_ids("claimed") and not queue.task_ids("pending"):
+            return n_run
+        for task_id in queue.requeue_expired(lease):
+            print("Lease expired on", task_id, "; requeued it")
+        time.sleep(poll)
+
+
+def run_task(queue, task, lease, max_attempts):
+    attempt = os.path.join(queue.path, "results", task["id"] + ".attempt-" + task["worker"])
+    cmd = [attempt + ".txt" if c == output_placeholder else c for c in task["cmd"]]
+    print("Running", task["id"])
+
+    # Renew the lease from another thread for as long as the command runs
+    stop = threading.Event()
+    def renew():
+        while not stop.wait(lease / 4):
+            if not queue.renew(task["id"]):
+                print("Warning! Lost the lease on", task["id"], "; finishing it anyway")
+                return
+    renewer = threading.Thread(target=renew, daemon=True)
+    renewer.start()
+
+    LOG = open(queue.log_file(task["id"]), "a")
+    LOG.write("### " + task["worker"] + " at " + time.strftime("%Y-%m-%d %H:%M:%S") + ": " + " ".join(cmd) + "\n")
+    LOG.flush()
+    try:
+        returncode = subprocess.run(cmd, cwd=task["cwd"], stdout=LOG, stderr=subprocess.STDOUT).returncode
+    except OSError as error:
+        LOG.write("ERROR! Could not run " + cmd[0] + ": " + str(error) + "\n")
+        returncode = None
+    LOG.close()
+    stop.set()
+    renewer.join()
+
+    if returncode == 0 and os.path.exists(attempt + ".txt"):
+        os.replace(attempt + ".txt", queue.result_file(task["id"]))
+        queue.complete(task)
+    else:
+        print("ERROR! Task", task["id"], "failed (exit code", str(returncode) + "); see", queue.log_file(task["id"]))
+        queue.fail(task, max_attempts)
+    for leftover in glob.glob(attempt + ".*"):     # Eg, sidecar files written alongside the output
+        os.remove(leftover)
+
+
+# JSON files are written to a temporary name and renamed, so no one ever reads half of one
+def write_json(data, outfile):
+    tmpfile = os.path.join(os.path.dirname(os.path.dirname(outfile)), "." + os.path.basename(outfile) + "." + worker_id() + ".tmp")
+    OUT = open(tmpfile, "w")
+    json.dump(data, OUT)
+    OUT.close()
+    os.replace(tmpfile, outfile)
+
+
+def read_json(infile):
+    IN = open(infile, "r")
+    data = json.load(IN)
+    IN.close()
+    return data
+
+
+def remove_if_exists(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+if __name__ == '__main__': main()